@@ -12,7 +12,9 @@ Attributes:
 """
 
 import logging
-from typing import List
+import threading
+import time
+from typing import Dict, List, Tuple
 
 
 def _init_logger():
@@ -24,6 +26,8 @@ def _init_logger():
 logger = _init_logger()
 LOG_FORMAT = '%(asctime)-15s\t%(levelname)-8s\t%(module)s\t%(funcName)s %(lineno)d:\t%(message)s'
 _log_modules = []
+_samples: Dict[str, Tuple[float, int]] = {}
+_samples_lock = threading.Lock()
 
 
 def set_logger(name: str, logfile=None):
@@ -114,6 +118,36 @@ def read_from_memory(logger, level="INFO"):
         
     return logs
 
+def is_enabled(module_name: str, level: int) -> bool:
+    """Checks whether a record of `level` from the module would be logged, to skip building expensive messages."""
+
+    return module_name in _log_modules and logger.isEnabledFor(level)
+
+def log_sampled(level: int, key: str, message: str, interval: float = 60.0):
+    """Logs at most one record of a kind per interval, for failures that can repeat on every line.
+
+    Records of the same `key` within `interval` seconds of the last one logged are only
+    counted, and the count is appended to the next record that gets logged.
+
+    Args:
+        level (int): logging level of the record.
+        key (str): kind of the record, e.g. the operation that failed.
+        message (str): message of the record.
+        interval (float): minimum number of seconds between two records of a kind (default 60).
+    """
+
+    now = time.monotonic()
+    with _samples_lock:
+        last, suppressed = _samples.get(key, (None, 0))
+        if last is not None and now - last < interval:
+            _samples[key] = (last, suppressed + 1)
+            return
+        _samples[key] = (now, 0)
+    if suppressed:
+        message = f"{message} ({suppressed} similar records suppressed)"
+    # Attribute the record to the caller, whose module the filter checks.
+    logger.log(level, message, stacklevel=2)
+
 def remove_module(module_name: str):
     """Sets a given module to no longer be tracked."""
 
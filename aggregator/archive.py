@@ -0,0 +1,178 @@
+import os
+from datetime import date, timedelta
+from typing import Iterator, List, Optional, Set, Tuple
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from database import CopyStream, TableColumn
+from log_parser import BasicLogParser
+import applog
+
+ARROW_TYPES = {'TEXT': pa.string(), 'INTEGER': pa.int32(), 'FLOAT': pa.float64(), 'BOOLEAN': pa.bool_(), 'TIMESTAMP': pa.timestamp('us')}
+
+def arrow_schema(columns: List[TableColumn]) -> pa.Schema:
+    fields = []
+    for col in columns:
+        if col.datatype not in ARROW_TYPES:
+            raise ValueError(f"Column '{col.name}' of type {col.datatype} cannot be archived.")
+        fields.append(pa.field(col.name, pa.list_(ARROW_TYPES[col.datatype]) if col.isArray else ARROW_TYPES[col.datatype]))
+    return pa.schema(fields)
+
+def days(start: date, end: date) -> Iterator[date]:
+    """The days of [start, end)."""
+    day = start
+    while day < end:
+        yield day
+        day += timedelta(days=1)
+
+class LogArchive:
+    """
+        Moves the rows of a log table older than a retention window to zstd compressed Parquet
+        files, one per day, `{directory}/{log_type}/{YYYY-MM-DD}.parquet`, and loads them back
+        on demand.
+
+        A day is read through a server-side cursor, `chunk_size` rows at a time, each chunk a row
+        group of the file, and removed in the transaction that read it once its file is on disk.
+        Partitions whose whole period is archived are dropped; the rows of other days are deleted.
+        Rows a day's earlier files already hold, e.g. restored ones, are not written again.
+    """
+    def __init__(self, parser: BasicLogParser, directory: str, chunk_size: int = 50000):
+        self.parser = parser
+        self.database = parser.database
+        self.directory = os.path.join(directory, parser.log_type)
+        self.chunk_size = chunk_size
+        self.schema = arrow_schema(parser.table_schema)
+        timestamps = [col.name for col in parser.table_schema if col.datatype == 'TIMESTAMP' and not col.isArray]
+        self.column = parser.partitions.column if parser.partitions else timestamps[0] if timestamps else None
+        if self.column is None:
+            raise ValueError(f"Log type '{parser.log_type}' has no TIMESTAMP column to archive by.")
+        # Rows are told apart by their primary key, or by all their values without one.
+        names = [col.name for col in parser.table_schema]
+        self.key_indexes = [i for i, col in enumerate(parser.table_schema) if col.isPrimary] or list(range(len(names)))
+        self.key_names = [names[i] for i in self.key_indexes]
+
+    def day_files(self, day: date) -> List[str]:
+        """The files of a day: `{day}.parquet`, then `{day}.1.parquet` and so on for rows archived later."""
+        if not os.path.isdir(self.directory):
+            return []
+        first = f"{day.isoformat()}.parquet"
+        names = [name for name in os.listdir(self.directory) if name.startswith(f"{day.isoformat()}.") and name.endswith('.parquet')]
+        return [os.path.join(self.directory, name) for name in sorted(names, key=lambda name: (name != first, len(name), name))]
+
+    def key(self, row: Tuple) -> Tuple:
+        return tuple(tuple(row[i]) if row[i].__class__ is list else row[i] for i in self.key_indexes)
+
+    def archived_keys(self, files: List[str]) -> Set[Tuple]:
+        keys = set()
+        for path in files:
+            columns = pq.read_table(path, columns=self.key_names).to_pydict()
+            values = [columns[name] for name in self.key_names]
+            keys.update(tuple(tuple(value) if value.__class__ is list else value for value in row) for row in zip(*values))
+        return keys
+
+    def export_day(self, conn, day: date) -> int:
+        """Writes the rows of a day, read on `conn`, to a new file of the day; returns how many."""
+        os.makedirs(self.directory, exist_ok=True)
+        files = self.day_files(day)
+        known = self.archived_keys(files) if files else None
+        path = os.path.join(self.directory, f"{day.isoformat()}.parquet" if not files else f"{day.isoformat()}.{len(files)}.parquet")
+        temp_path = f"{path}.tmp"
+        writer = None
+        written = 0
+        try:
+            with conn.cursor(name=f"archive_{self.parser.log_type}") as cursor:
+                cursor.itersize = self.chunk_size
+                cursor.execute(f"SELECT {', '.join(self.schema.names)} FROM {self.parser.main_table} "
+                               f"WHERE {self.column} >= %s AND {self.column} < %s", (day, day + timedelta(days=1)))
+                while True:
+                    rows = cursor.fetchmany(self.chunk_size)
+                    if not rows:
+                        break
+                    if known:
+                        rows = [row for row in rows if self.key(row) not in known]
+                        if not rows:
+                            continue
+                    batch = pa.RecordBatch.from_arrays([pa.array(list(values), type=field.type) for values, field in zip(zip(*rows), self.schema)], schema=self.schema)
+                    if writer is None:
+                        writer = pq.ParquetWriter(temp_path, self.schema, compression='zstd')
+                    writer.write_batch(batch)
+                    written += len(rows)
+        except Exception:
+            if writer is not None:
+                writer.close()
+                os.remove(temp_path)
+            raise
+        if writer is None:
+            return 0
+        writer.close()
+        # The rows are removed from the database once the file is certainly on disk.
+        with open(temp_path, 'rb') as file:
+            os.fsync(file.fileno())
+        os.replace(temp_path, path)
+        applog.logger.debug(f"Archived {written} rows of {day} to {path}.")
+        return written
+
+    def move(self, start: date, end: date, lock: str, remove: str, values: Tuple = None) -> List[Tuple[date, int]]:
+        """Exports the days of [start, end) after running `lock`, then runs `remove`, all in one transaction."""
+        conn = self.database.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(lock)
+            moved = [(day, self.export_day(conn, day)) for day in days(start, end)]
+            with conn.cursor() as cursor:
+                cursor.execute(remove, values)
+        except Exception as e:
+            conn.rollback()
+            raise e
+        else:
+            conn.commit()
+        finally:
+            self.database.release_connection(conn)
+        return moved
+
+    def next_day(self, after: Optional[date], cutoff: date) -> Optional[date]:
+        """The first day from `after` until `cutoff` with rows left in the table."""
+        condition = f"{self.column} < %s" + (f" AND {self.column} >= %s" if after else "")
+        result = self.database.execute_command(f"SELECT min({self.column})::date FROM {self.parser.storage()[0]} WHERE {condition}",
+                                               (cutoff, after) if after else (cutoff,))
+        return result[0][0]
+
+    def archive(self, older_than: int) -> List[Tuple[date, int]]:
+        """Moves the rows older than `older_than` days to the archive; returns the rows archived per day."""
+        cutoff = date.today() - timedelta(days=older_than)
+        archived = []
+        partitions = self.parser.partitions
+        if partitions:
+            for name, start, end in partitions.list_partitions():
+                if end > cutoff:
+                    continue
+                # SHARE keeps rows from being added to the partition while it is exported, not from being read.
+                archived += self.move(start, end, f"LOCK TABLE {name} IN SHARE MODE", f"DROP TABLE {name}")
+                partitions.known.discard(start)
+                applog.logger.info(f"Archived and dropped partition {name}.")
+        table = self.parser.storage()[0]
+        day = self.next_day(None, cutoff)
+        while day is not None:
+            # Rows added to the day while it is exported are not in the snapshot, so they are not deleted either.
+            archived += self.move(day, day + timedelta(days=1), "SET TRANSACTION ISOLATION LEVEL REPEATABLE READ",
+                                  f"DELETE FROM {table} WHERE {self.column} >= %s AND {self.column} < %s", (day, day + timedelta(days=1)))
+            day = self.next_day(day + timedelta(days=1), cutoff)
+        return [(day, rows) for day, rows in archived if rows]
+
+    def restore(self, since: date, until: date) -> List[Tuple[str, int]]:
+        """Loads the archived rows of the days from `since` to `until` back into the table; returns the rows read per file."""
+        parser = self.parser
+        restored = []
+        for day in days(since, until + timedelta(days=1)):
+            for path in self.day_files(day):
+                count = 0
+                for batch in pq.ParquetFile(path).iter_batches(batch_size=self.chunk_size):
+                    columns = batch.to_pydict()
+                    values = [columns.get(col.name, [None] * batch.num_rows) for col in parser.table_schema]
+                    periods = parser.partitions.periods(columns[parser.partitions.column]) if parser.partitions else None
+                    parser.insert_payload(CopyStream(parser.table_schema, zip(*values)).read(), periods, path)
+                    count += batch.num_rows
+                restored.append((path, count))
+                applog.logger.debug(f"Restored {count} rows from {path}.")
+        return restored
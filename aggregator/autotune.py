@@ -0,0 +1,247 @@
+import threading
+import time
+from datetime import datetime, time as clock
+from typing import Callable, Dict, Optional, Tuple
+
+from database import DatabaseConnectionPool
+import applog
+import metrics
+
+# Mean commit latency in seconds below which a window never counts as congested, whatever the baseline.
+MIN_SPIKE = 0.05
+# Smallest relative gain in rows per second for which a probe is kept.
+MIN_GAIN = 0.02
+# Windows for which a setting whose probe did not pay is not probed again.
+HOLD_WINDOWS = 6
+
+class WriterGate:
+    """
+        Lets at most `limit` writer threads insert at a time. The limit may change while they
+        run: lowering it holds back the next batches until enough writers have finished.
+    """
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        self.cond = threading.Condition()
+
+    def set_limit(self, limit: int) -> None:
+        with self.cond:
+            self.limit = limit
+            self.cond.notify_all()
+
+    def __enter__(self) -> "WriterGate":
+        with self.cond:
+            while self.active >= self.limit:
+                self.cond.wait()
+            self.active += 1
+        return self
+
+    def __exit__(self, *args) -> None:
+        with self.cond:
+            self.active -= 1
+            self.cond.notify()
+
+
+class NiceHours:
+    """
+        Hours of the day, e.g. 08:00-18:00, in which ingest keeps to at most `writers` writers
+        and `batch_size` lines per batch, leaving the database to Superset. The hours may span
+        midnight, e.g. 22:00-06:00.
+    """
+    def __init__(self, start: clock, end: clock, writers: int, batch_size: int = None):
+        self.start = start
+        self.end = end
+        self.writers = max(1, writers)
+        self.batch_size = batch_size
+
+    @classmethod
+    def parse(cls, hours: str, writers: int, batch_size: int = None) -> "NiceHours":
+        try:
+            start, end = (datetime.strptime(part.strip(), '%H:%M').time() for part in hours.split('-'))
+        except ValueError:
+            raise ValueError(f"Nice hours must look like 08:00-18:00, not '{hours}'.")
+        return cls(start, end, writers, batch_size)
+
+    def active(self, now: datetime = None) -> bool:
+        now = (now or datetime.now()).time()
+        if self.start <= self.end:
+            return self.start <= now < self.end
+        return now >= self.start or now < self.end
+
+    def __repr__(self) -> str:
+        ceiling = f"{self.writers} writers" + (f", {self.batch_size} lines per batch" if self.batch_size else "")
+        return f"{self.start:%H:%M}-{self.end:%H:%M} ({ceiling})"
+
+
+class IngestTuner:
+    """
+        Adjusts while logs are ingested how many writers insert batches at a time and how many
+        lines a batch has, to insert the most rows per second without using up the connections
+        or slowing down the database for everyone else.
+
+        Every `window` seconds of work, it compares the rows per second inserted with the mean
+        commit latency and the mean wait for a pool connection. One more writer or a bigger
+        batch is tried in turn and kept if throughput rose; a change that did not pay is undone
+        and not tried again for a while. When commits take `latency_factor` times longer than
+        the fastest seen, or writers wait `max_wait` seconds for connections, the writers are
+        halved, and at a single writer the batches too. During `nice` hours the ceiling is lower.
+    """
+    def __init__(self, database: DatabaseConnectionPool, writers: int, batch_size: int, nice: NiceHours = None, window: float = 5.0,
+                 latency_factor: float = 2.0, max_wait: float = 0.1, max_batch_size: int = None):
+        self.database = database
+        self.max_writers = max(1, min(writers, database.pool.max_conns))
+        self.min_batch_size = max(1, batch_size // 10)
+        self.max_batch_size = max(batch_size, max_batch_size or batch_size * 8)
+        self.batch_step = max(1, batch_size // 2)
+        self.nice = nice
+        self.window = window
+        self.latency_factor = latency_factor
+        self.max_wait = max_wait
+        # Half the writers to start with, leaving room to probe upwards.
+        self.writers = max(1, self.max_writers // 2)
+        self.batch_size = batch_size
+        self.gate = WriterGate(self.writers)
+        self.lock = threading.Lock()
+
+        # Fastest mean commit latency seen, rows per second of the last window and the best one.
+        self.baseline: Optional[float] = None
+        self.throughput: Optional[float] = None
+        self.best = 0.0
+        # The setting raised for the last window, if any, and the windows each setting is held for.
+        self.probe: Optional[str] = None
+        self.turn = 'writers'
+        self.held: Dict[str, int] = {'writers': 0, 'batch_size': 0}
+        self.adjustments = 0
+
+        # Work of the current window: rows inserted, seconds with batches in flight.
+        self.rows = 0
+        self.busy = 0.0
+        self.busy_since = 0.0
+        self.in_flight = 0
+        self.commits = metrics.STAGE_SECONDS.summary('commit')
+        stats = database.pool_stats()
+        self.waits = (stats['checkouts'], stats['wait_total'])
+        with self.lock:
+            self.keep_to_ceiling()
+        metrics.AUTOTUNE_WRITERS.set(self.writers)
+        metrics.AUTOTUNE_BATCH_SIZE.set(self.batch_size)
+
+    def size(self) -> int:
+        """Lines of the next batch; passed as the batch size of LogParser.read_log_batches."""
+        return self.batch_size
+
+    def run(self, rows: int, function: Callable, *args):
+        """Calls `function` with `args` to insert a batch of `rows` rows once the gate lets it."""
+        with self.gate:
+            self.started()
+            inserted = 0
+            try:
+                result = function(*args)
+                inserted = rows
+                return result
+            finally:
+                self.finished(inserted)
+
+    def started(self) -> None:
+        with self.lock:
+            if not self.in_flight:
+                self.busy_since = time.monotonic()
+            self.in_flight += 1
+            # Nice hours start while batches run, not only at the end of a window.
+            self.keep_to_ceiling()
+
+    def finished(self, rows: int) -> None:
+        with self.lock:
+            now = time.monotonic()
+            self.in_flight -= 1
+            self.rows += rows
+            if not self.in_flight:
+                self.busy += now - self.busy_since
+            busy = self.busy + (now - self.busy_since if self.in_flight else 0)
+            if busy >= self.window:
+                self.adjust(self.rows / busy)
+                self.rows, self.busy, self.busy_since = 0, 0.0, now
+
+    def ceiling(self) -> Tuple[int, int]:
+        if self.nice and self.nice.active():
+            return min(self.max_writers, self.nice.writers), min(self.max_batch_size, self.nice.batch_size or self.max_batch_size)
+        return self.max_writers, self.max_batch_size
+
+    def keep_to_ceiling(self) -> None:
+        writers, batch_size = self.ceiling()
+        if self.writers > writers or self.batch_size > batch_size:
+            self.probe = None
+            self.set(min(self.writers, writers), min(self.batch_size, batch_size), 'down', 'nice')
+
+    def window_latencies(self) -> Tuple[Optional[float], float]:
+        """The mean commit latency and the mean connection wait since the last window."""
+        count, total = metrics.STAGE_SECONDS.summary('commit')
+        commits = count - self.commits[0]
+        latency = (total - self.commits[1]) / commits if commits else None
+        self.commits = (count, total)
+        stats = self.database.pool_stats()
+        checkouts = stats['checkouts'] - self.waits[0]
+        wait = (stats['wait_total'] - self.waits[1]) / checkouts if checkouts else 0.0
+        self.waits = (stats['checkouts'], stats['wait_total'])
+        return latency, wait
+
+    def adjust(self, throughput: float) -> None:
+        """Decides the settings of the next window from the measures of the last one; called with the lock held."""
+        latency, wait = self.window_latencies()
+        if latency is not None:
+            # The baseline creeps up, so that a server slower for good is not taken for congested forever.
+            self.baseline = latency if self.baseline is None else min(latency, self.baseline * 1.05)
+        self.best = max(self.best, throughput)
+        for name in self.held:
+            self.held[name] = max(0, self.held[name] - 1)
+
+        writers, batch_size = self.ceiling()
+        if latency is not None and latency > max(self.latency_factor * self.baseline, MIN_SPIKE):
+            self.probe = None
+            # A single writer can only be eased with shorter transactions.
+            self.set(max(1, self.writers // 2), max(self.min_batch_size, self.batch_size // 2) if self.writers == 1 else self.batch_size, 'down', 'latency')
+        elif wait > self.max_wait:
+            self.probe = None
+            self.set(max(1, self.writers // 2), self.batch_size, 'down', 'pool_wait')
+        elif self.writers > writers or self.batch_size > batch_size:
+            self.keep_to_ceiling()
+        elif self.probe and self.throughput and throughput < self.throughput * (1 + MIN_GAIN):
+            self.held[self.probe] = HOLD_WINDOWS
+            if self.probe == 'writers':
+                self.set(self.writers - 1, self.batch_size, 'down', 'no_gain')
+            else:
+                self.set(self.writers, max(self.min_batch_size, self.batch_size - self.batch_step), 'down', 'no_gain')
+            self.probe = None
+        else:
+            self.probe = None
+            below = {'writers': self.writers < writers, 'batch_size': self.batch_size < batch_size}
+            options = [name for name in ('writers', 'batch_size') if below[name] and not self.held[name]]
+            if options:
+                name = self.turn if self.turn in options else options[0]
+                self.turn = 'batch_size' if name == 'writers' else 'writers'
+                if name == 'writers':
+                    self.set(self.writers + 1, self.batch_size, 'up', 'probe')
+                else:
+                    self.set(self.writers, min(batch_size, self.batch_size + self.batch_step), 'up', 'probe')
+                self.probe = name
+        self.throughput = throughput
+        applog.logger.debug(f"Autotune window: {throughput:.0f} rows/s, commit latency "
+                            f"{latency * 1000 if latency is not None else 0:.1f} ms, connection wait {wait * 1000:.1f} ms; "
+                            f"{self.writers} writers, {self.batch_size} lines per batch.")
+
+    def set(self, writers: int, batch_size: int, direction: str, reason: str) -> None:
+        if (writers, batch_size) == (self.writers, self.batch_size):
+            return
+        applog.logger.debug(f"Autotune {direction} ({reason}): {self.writers} -> {writers} writers, {self.batch_size} -> {batch_size} lines per batch.")
+        self.writers = writers
+        self.batch_size = batch_size
+        self.gate.set_limit(writers)
+        self.adjustments += 1
+        metrics.AUTOTUNE_WRITERS.set(writers)
+        metrics.AUTOTUNE_BATCH_SIZE.set(batch_size)
+        metrics.AUTOTUNE_ADJUSTMENTS.inc(direction, reason)
+
+    def __repr__(self) -> str:
+        nice = f", nice hours {self.nice}" if self.nice else ""
+        return (f"Autotune: {self.writers} of {self.max_writers} writers, {self.batch_size} lines per batch, "
+                f"best {self.best:.0f} rows/s, {self.adjustments} adjustments{nice}")
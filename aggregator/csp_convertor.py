@@ -1,71 +1,38 @@
-import json
-import pandas as pd
 import csv
+import os
 import sys
-
-def convert_to_tsv(input_file, output_file):
-    data_rows = []
-    header = [
-        '\"document_uri\"',
-        '\"referrer\"',
-        '\"violated_directive\"',
-        '\"effective_directive\"',
-        '\"original_policy\"',
-        '\"disposition\"',
-        '\"blocked_uri\"',
-        '\"status_code\"',
-        '\"source_file\"',
-        '\"line_number\"',
-        '\"column_number\"',
-        '\"script_sample\"',
-        '\"from_user\"',
-        '\"date\"',
-        '\"CLIENTID\"',
-        '\"USERNAME\"',
-        '\"handler\"'
-    ]
-
-    with open(input_file, 'r') as file:
-        # Skip the first line
-        next(file)
-
-        for line in file:
+import xml.etree.ElementTree as ET
+
+from jsonlog import json_splitter
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+log_structure_path = os.path.abspath(os.path.join(script_dir, '../etc/aggregator', 'log_structure.xml'))
+
+def convert_to_tsv(input_file, output_file, xml_file=log_structure_path):
+    """
+    Exports CSP reports, one JSON object per line, as TSV with a header of column names.
+
+    `main.py insert csp` reads the JSON reports directly; this export is kept for tools
+    that expect the TSV files. Reports are converted line by line, so memory use does
+    not grow with the size of the file. Only the schema is read, so no database driver
+    is needed.
+    """
+    columns = ET.parse(xml_file).getroot().find('csp').findall('column')
+    split = json_splitter([column.get('key') or column.get('name') for column in columns])
+
+    with open(input_file, 'r') as source, open(output_file, 'w', newline='') as target:
+        writer = csv.writer(target, delimiter='\t', lineterminator='\n')
+        writer.writerow(column.get('name') for column in columns)
+        # Skip the first line, as insert does.
+        next(source, None)
+        for line in source:
+            if not line.strip():
+                continue
             try:
-                # Parse the JSON data
-                entry = json.loads(line.strip())
-                csp_report = entry.get('csp-report', {})
-                from_info = entry.get('from', {})
-                info = entry.get('info', {})
-
-                # Create a row of data with quotes around values
-                data_row = {
-                    '\"document_uri\"': f'"{csp_report.get("document-uri", "-")}"',
-                    '\"referrer\"': f'"{csp_report.get("referrer", "-")}"',
-                    '\"violated_directive\"': f'"{csp_report.get("violated-directive", "-")}"',
-                    '\"effective_directive\"': f'"{csp_report.get("effective-directive", "-")}"',
-                    '\"original_policy\"': f'"{csp_report.get("original-policy", "-")}"',
-                    '\"disposition\"': f'"{csp_report.get("disposition", "-")}"',
-                    '\"blocked_uri\"': f'"{csp_report.get("blocked-uri", "-")}"',
-                    '\"status_code\"': int(csp_report.get("status-code", 0)),
-                    '\"source_file\"': f'"{csp_report.get("source-file", "-")}"',
-                    '\"line_number\"': int(csp_report.get("line-number", 0)),
-                    '\"column_number\"': int(csp_report.get("column-number", 0)),
-                    '\"script_sample\"': f'"{csp_report.get("script-sample", "-")}"',
-                    '\"from_user\"': f'"{from_info.get("user", "-")}"',
-                    '\"date\"': int(from_info.get("date", 0)),
-                    '\"CLIENTID\"': int(info.get("CLIENTID", 0)),
-                    '\"USERNAME\"': f'"{info.get("USERNAME", "-")}"',
-                    '\"handler\"': f'"{info.get("handler", "-")}"'
-                }
-
-                data_rows.append(data_row)
-            except json.JSONDecodeError as e:
+                writer.writerow(split(line))
+            except ValueError as e:
                 print(f"Error parsing JSON: {e}")
 
-    # Create a DataFrame and save as TSV
-    df = pd.DataFrame(data_rows, columns=header)
-    df.to_csv(output_file, sep='\t', index=False, quoting=csv.QUOTE_NONE, escapechar='\\')
-
 
 if __name__ == "__main__":
     if len(sys.argv) != 3:
@@ -74,5 +41,5 @@ if __name__ == "__main__":
 
     input_file = sys.argv[1]  # First command line argument
     output_file = sys.argv[2]  # Second command line argument
-    
+
     convert_to_tsv(input_file, output_file)
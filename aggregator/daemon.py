@@ -0,0 +1,163 @@
+import os
+import queue
+import signal
+import threading
+from glob import glob
+from typing import TYPE_CHECKING, Callable, Dict, Set, Tuple
+
+from log_parser import LogParser, is_log_file
+import applog
+
+if TYPE_CHECKING:
+    from autotune import IngestTuner
+    from sync import LogSync, SyncResult
+
+# Directory holding each log type in the directory of every proxy synced by sync.sh.
+LOG_DIRECTORIES = {'extended': 'extended', 'performance': 'performance', 'csp': 'csp'}
+
+class IngestLane(threading.Thread):
+    """
+        Ingests the files of one log type one at a time, with a parser whose schema is
+        loaded once. A file is queued at most once; it is taken off the queue before it
+        is ingested, so a file that grows meanwhile is queued again for its new bytes.
+        Lanes may share a `tuner`, which then shares out the writers among them.
+    """
+    def __init__(self, parser: LogParser, workers: int, mode: str, batch_size: int, processes: int = 0, tuner: "IngestTuner" = None):
+        super().__init__(name=f"lane-{parser.log_type}", daemon=True)
+        self.parser = parser
+        # Progress bars would only flood the service log.
+        self.parser.progress = False
+        self.workers = workers
+        self.mode = mode
+        self.batch_size = batch_size
+        self.processes = processes
+        self.tuner = tuner
+        self.files: "queue.Queue[str]" = queue.Queue()
+        self.queued: Set[str] = set()
+        self.lock = threading.Lock()
+        self.stopping = threading.Event()
+        self.ingested = 0
+        self.failed = 0
+
+    def submit(self, file_path: str) -> bool:
+        with self.lock:
+            if file_path in self.queued:
+                return False
+            self.queued.add(file_path)
+        self.files.put(file_path)
+        return True
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def run(self) -> None:
+        while not self.stopping.is_set():
+            try:
+                file_path = self.files.get(timeout=1)
+            except queue.Empty:
+                continue
+            with self.lock:
+                self.queued.discard(file_path)
+            try:
+                self.parser.insert_log_files([file_path], self.workers, self.mode, self.batch_size, self.processes, tuner=self.tuner)
+                self.ingested += 1
+            except Exception as e:
+                self.failed += 1
+                applog.logger.error(f"An error occurred while ingesting {file_path}: {e}")
+        # Between files the dedup filters are only saved every so often.
+        if self.parser.dedup:
+            self.parser.dedup.save()
+
+    def __repr__(self) -> str:
+        return f"{self.name}: {self.files.qsize()} queued, {self.ingested} ingested, {self.failed} failed"
+
+
+class IngestDaemon:
+    """
+        Watches the synced log directories and feeds new and appended files to one lane per log type.
+
+        Directories are polled every `interval` seconds; a file is queued when its size or
+        modification time changed since the last scan. Which bytes are new is left to the
+        ingest ledger, so every file is queued once at start-up and resumes where it stopped.
+        `export_metrics`, if given, is called after every scan and once more on shutdown.
+
+        With a `syncer`, the daemon pulls the logs itself: after the scan at start-up, every
+        interval syncs the proxies and queues exactly the files rsync reported, as each proxy
+        finishes, instead of polling the directories.
+    """
+    def __init__(self, root: str, lanes: Dict[str, IngestLane], interval: float = 10.0, export_metrics: Callable[[], None] = None,
+                 syncer: "LogSync" = None):
+        self.root = root
+        self.lanes = lanes
+        self.interval = interval
+        self.export_metrics = export_metrics
+        self.syncer = syncer
+        self.seen: Dict[str, Tuple[int, float]] = {}
+        self.stopping = threading.Event()
+
+    def scan(self) -> int:
+        """Queues the files that changed since the last scan and returns how many were queued."""
+        queued = 0
+        present = set()
+        for log_type, lane in self.lanes.items():
+            for file_path in sorted(glob(os.path.join(self.root, '*', LOG_DIRECTORIES[log_type], '*'))):
+                if not is_log_file(file_path):
+                    continue
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    # Rotated away since the directory was listed.
+                    continue
+                present.add(file_path)
+                signature = (stat.st_size, stat.st_mtime)
+                if self.seen.get(file_path) == signature:
+                    continue
+                self.seen[file_path] = signature
+                queued += lane.submit(file_path)
+        self.seen = {path: signature for path, signature in self.seen.items() if path in present}
+        return queued
+
+    def submit_synced(self, result: "SyncResult") -> int:
+        """Queues the files a sync of one proxy created or appended to and returns how many were queued."""
+        queued = 0
+        for log_type, file_path in result.files:
+            lane = self.lanes.get(log_type)
+            if lane and is_log_file(file_path):
+                queued += lane.submit(file_path)
+        if queued:
+            applog.logger.info(f"Queued {queued} files synced from {result.server}.")
+        return queued
+
+    def stop(self, *args) -> None:
+        self.stopping.set()
+
+    def serve(self) -> None:
+        """Scans until SIGTERM or SIGINT, then lets each lane finish the file it is ingesting."""
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        for lane in self.lanes.values():
+            lane.start()
+        action = f"Syncing {len(self.syncer.servers)} proxies" if self.syncer else f"Watching {self.root}"
+        applog.logger.info(f"{action} for {', '.join(self.lanes)} logs every {self.interval} seconds.")
+        scanned = False
+        while not self.stopping.is_set():
+            if self.syncer and scanned:
+                self.syncer.sync(self.submit_synced)
+            else:
+                queued = self.scan()
+                scanned = True
+                if queued:
+                    applog.logger.info(f"Queued {queued} files; {'; '.join(str(lane) for lane in self.lanes.values())}.")
+            # Lanes share the ledger; entries of files rotated away would otherwise pile up in it.
+            for ledger in {id(lane.parser.ledger): lane.parser.ledger for lane in self.lanes.values() if lane.parser.ledger}.values():
+                ledger.prune()
+            if self.export_metrics:
+                self.export_metrics()
+            self.stopping.wait(self.interval)
+        for lane in self.lanes.values():
+            lane.stop()
+        for lane in self.lanes.values():
+            lane.join()
+        if self.export_metrics:
+            self.export_metrics()
+        applog.logger.info("Ingest daemon stopped.")
@@ -1,43 +1,300 @@
 import configparser
 import logging
+import re
+import threading
 import time
-from typing import List, Tuple, Dict, Union
+from itertools import islice
+from typing import List, Tuple, Dict, Union, Iterable, Iterator, Callable
 import psycopg2
-from psycopg2 import pool, extras
-from psycopg2.extras import Json
+from psycopg2 import pool
 
 import applog
+import metrics
+
+# Index access methods a column of log_structure.xml may declare.
+INDEX_METHODS = ('btree', 'brin', 'gin')
 
 class TableColumn:
     """
         Represents a column in the table with name, datatype, and constraints. 
     """
-    def __init__(self, name: str, datatype: str, isArray:bool = False, isPrimary:bool = False, data_format: str = None, *args, **kwargs):
+    __slots__ = ('name', 'datatype', 'isArray', 'isPrimary', 'data_format', 'index')
+
+    def __init__(self, name: str, datatype: str, isArray:bool = False, isPrimary:bool = False, data_format: str = None, index: str = None, *args, **kwargs):
         self.name = name
         self.datatype = datatype
         self.isArray = isArray
         self.isPrimary = isPrimary
         self.data_format = data_format
+        self.index = index
 
     def __repr__(self) -> str:
         return f"{self.name} {self.datatype}{'[]' if self.isArray else ''}{' PRIMARY KEY' if self.isPrimary else ''}"
 
+def copy_escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+_copy_unescapes = {'\\\\': '\\', '\\t': '\t', '\\n': '\n', '\\r': '\r'}
+
+def copy_unescape(value: str) -> str:
+    return re.sub(r'\\[\\tnr]', lambda match: _copy_unescapes[match.group()], value) if '\\' in value else value
+
+def copy_array_literal(values: List) -> str:
+    items = ('"' + str(item).replace('\\', '\\\\').replace('"', '\\"') + '"' for item in values)
+    return '{' + ','.join(items) + '}'
+
+def copy_text(value) -> str:
+    # The TSV parser splits any field containing a comma; restore scalars.
+    return copy_escape(','.join(value) if isinstance(value, list) else str(value))
+
+# Row encoders by column types, see copy_encoder.
+_copy_encoders: Dict[Tuple[Tuple[str, bool], ...], Callable[[Tuple], str]] = {}
+
+def copy_encoder(columns: List[TableColumn]) -> Callable[[Tuple], str]:
+    """
+        Returns a function encoding a row as a line of COPY text, generated for the column
+        types, so that a row is encoded by a single call instead of a loop over the columns.
+    """
+    signature = tuple((col.datatype, col.isArray) for col in columns)
+    encoder = _copy_encoders.get(signature)
+    if encoder is not None:
+        return encoder
+    fields = []
+    for i, (datatype, is_array) in enumerate(signature):
+        if is_array:
+            value = f"escape(array_literal(v{i} if v{i}.__class__ is list else [v{i}]))"
+        elif datatype == "TEXT":
+            value = f"escape(v{i}) if v{i}.__class__ is str else text(v{i})"
+        else:
+            # Converted numbers, booleans and timestamps never need escaping.
+            value = f"str(v{i}) if v{i}.__class__ is not str else escape(v{i})"
+        fields.append(f"'\\\\N' if v{i} is None else {value}")
+    names = ', '.join(f"v{i}" for i in range(len(signature)))
+    source = (f"def encode_row(row):\n"
+              f"    {names}, = row\n"
+              f"    return '\\t'.join(({', '.join(f'({field})' for field in fields)},)) + '\\n'\n")
+    namespace = {'escape': copy_escape, 'array_literal': copy_array_literal, 'text': copy_text}
+    exec(source, namespace)
+    encoder = _copy_encoders[signature] = namespace['encode_row']
+    return encoder
+
+class CopyStream:
+    """
+        File-like object that feeds rows to COPY FROM STDIN in text format.
+
+        Rows are encoded lazily as psycopg2 reads from the stream, so a batch is
+        never materialised as one large string.
+    """
+    def __init__(self, columns: List[TableColumn], rows: Iterable[Tuple]):
+        self.columns = columns
+        self.rows: Iterator[Tuple] = iter(rows)
+        self.pending = ''
+        self.encode_row = copy_encoder(columns)
+
+    def read(self, size: int = -1) -> str:
+        chunks = [self.pending]
+        length = len(self.pending)
+        while size < 0 or length < size:
+            row = next(self.rows, None)
+            if row is None:
+                break
+            line = self.encode_row(row)
+            chunks.append(line)
+            length += len(line)
+        data = ''.join(chunks)
+        if size < 0:
+            self.pending = ''
+            return data
+        self.pending = data[size:]
+        return data[:size]
+
+# Connections left free on the server for Superset and administration.
+SERVER_HEADROOM = 10
+
+# Errors caused by the values of a row rather than by the connection or the statement.
+ROW_ERRORS = (psycopg2.DataError, psycopg2.IntegrityError)
+
+class BoundedConnectionPool:
+    """
+        Thread-safe pool of at most `max_conns` connections.
+
+        Checkout blocks on a condition variable until a connection is returned or the
+        timeout expires. Connections idle for longer than `validate_after` seconds are
+        checked with a round trip before reuse, and broken connections are replaced.
+        Wait times and a time-weighted utilization are tracked for tuning worker counts.
+    """
+    def __init__(self, conn_str: str, max_conns: int, min_conns: int = 1, validate_after: float = 30.0):
+        self.conn_str = conn_str
+        self.max_conns = max(1, max_conns)
+        self.validate_after = validate_after
+        self.cond = threading.Condition()
+        self.idle: List[Tuple[psycopg2.extensions.connection, float]] = []
+        self.size = 0
+        self.in_use = 0
+        self.closed = False
+
+        self.started = time.monotonic()
+        self.last_change = self.started
+        self.busy_time = 0.0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.replaced = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.peak_in_use = 0
+
+        for _ in range(min(min_conns, self.max_conns)):
+            self.idle.append((psycopg2.connect(self.conn_str), time.monotonic()))
+            self.size += 1
+
+    def account(self, delta: int) -> None:
+        """Updates the number of connections in use; must be called with the lock held."""
+        now = time.monotonic()
+        self.busy_time += self.in_use * (now - self.last_change)
+        self.last_change = now
+        self.in_use += delta
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+
+    def is_healthy(self, conn: psycopg2.extensions.connection, last_used: float) -> bool:
+        if conn.closed:
+            return False
+        if time.monotonic() - last_used < self.validate_after:
+            return True
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute('SELECT 1')
+            conn.rollback()
+            return True
+        except psycopg2.Error:
+            return False
+
+    def getconn(self, timeout: float = 10) -> psycopg2.extensions.connection:
+        start = time.monotonic()
+        deadline = start + timeout
+        with self.cond:
+            while True:
+                if self.closed:
+                    raise pool.PoolError("connection pool is closed")
+                if self.idle:
+                    conn, last_used = self.idle.pop()
+                    break
+                if self.size < self.max_conns:
+                    conn, last_used = None, None
+                    self.size += 1
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise Exception("Failed to obtain connection within timeout period")
+                self.cond.wait(remaining)
+
+        # Connecting and validating happen outside the lock so other threads are not held up.
+        try:
+            if conn is None:
+                conn = psycopg2.connect(self.conn_str)
+            elif not self.is_healthy(conn, last_used):
+                applog.logger.debug("Replacing broken database connection.")
+                if not conn.closed:
+                    conn.close()
+                conn = psycopg2.connect(self.conn_str)
+                self.replaced += 1
+        except Exception:
+            with self.cond:
+                self.size -= 1
+                self.cond.notify()
+            raise
+
+        waited = time.monotonic() - start
+        with self.cond:
+            self.account(1)
+            self.checkouts += 1
+            self.wait_total += waited
+            self.wait_max = max(self.wait_max, waited)
+        return conn
+
+    def putconn(self, conn: psycopg2.extensions.connection, close: bool = False) -> None:
+        status = conn.get_transaction_status() if not conn.closed else psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        if not close and status not in (psycopg2.extensions.TRANSACTION_STATUS_IDLE, psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN):
+            try:
+                conn.rollback()
+            except psycopg2.Error:
+                close = True
+        close = close or status == psycopg2.extensions.TRANSACTION_STATUS_UNKNOWN
+        with self.cond:
+            self.account(-1)
+            if close or self.closed:
+                self.size -= 1
+                if not conn.closed:
+                    conn.close()
+            else:
+                self.idle.append((conn, time.monotonic()))
+            self.cond.notify()
+
+    def closeall(self) -> None:
+        with self.cond:
+            self.closed = True
+            for conn, _ in self.idle:
+                if not conn.closed:
+                    conn.close()
+            self.size -= len(self.idle)
+            self.idle = []
+            self.cond.notify_all()
+
+    def stats(self) -> Dict[str, float]:
+        with self.cond:
+            self.account(0)
+            elapsed = max(time.monotonic() - self.started, 1e-9)
+            return {
+                'max_conns': self.max_conns,
+                'open': self.size,
+                'in_use': self.in_use,
+                'idle': len(self.idle),
+                'peak_in_use': self.peak_in_use,
+                'checkouts': self.checkouts,
+                'timeouts': self.timeouts,
+                'replaced': self.replaced,
+                'wait_total': self.wait_total,
+                'wait_max': self.wait_max,
+                'wait_mean': self.wait_total / self.checkouts if self.checkouts else 0.0,
+                'utilization': self.busy_time / (elapsed * self.max_conns),
+            }
+
 class DatabaseConnectionPool:
     def __init__(self, username: str, password: str, host: str, port: str, dbname: str, max_conns=1000):
         self.conn_str = f"postgres://{username}:{password}@{host}:{port}/{dbname}"
-        self.pool = pool.SimpleConnectionPool(1, max_conns, self.conn_str)
+        self.max_conns = int(max_conns)
+        # Connected on first use, so that commands without a database start without one.
+        self._pool: BoundedConnectionPool = None
+        self.pool_lock = threading.Lock()
+        # INSERT statements and VALUES templates by table and column names.
+        self.statements: Dict[Tuple, Tuple[str, str]] = {}
+        self.merge_hooks: Dict[str, Tuple[List[str], List[str]]] = {}
+
+    @property
+    def pool(self) -> BoundedConnectionPool:
+        if self._pool is None:
+            with self.pool_lock:
+                if self._pool is None:
+                    self._pool = BoundedConnectionPool(self.conn_str, self.max_conns)
+                    self._pool.max_conns = min(self._pool.max_conns, self.fetch_connection_limit())
+        return self._pool
 
     def get_connection(self, timeout=10) -> psycopg2.extensions.connection:
-        """Attempt to retrieve a connection from the pool with a timeout."""
-        for _ in range(timeout):
-            try:
-                conn = self.pool.getconn()
-                if conn:
-                    return conn
-            except pool.PoolError:
-                applog.logger.debug("Connection pool exhausted. Waiting to retry...")
-                time.sleep(1)
-        raise Exception("Failed to obtain connection within timeout period")
+        """Retrieve a connection from the pool, waiting up to `timeout` seconds for one to be released."""
+        with metrics.STAGE_SECONDS.time('checkout'):
+            return self.pool.getconn(timeout)
+
+    def fetch_connection_limit(self) -> int:
+        """Returns how many connections the server can give this pool, keeping SERVER_HEADROOM free."""
+        query = """
+        SELECT current_setting('max_connections')::int - current_setting('superuser_reserved_connections')::int
+        """
+        limit = self.execute_command(query)[0][0] - SERVER_HEADROOM
+        applog.logger.debug(f"Server allows {limit} pool connections.")
+        return max(1, limit)
+
+    def pool_stats(self) -> Dict[str, float]:
+        return self.pool.stats()
 
     def release_connection(self, conn: psycopg2.extensions.connection) -> None:
         self.pool.putconn(conn)
@@ -46,8 +303,9 @@ class DatabaseConnectionPool:
         conn = self.get_connection()
         with conn.cursor() as cursor:
             try:
-                cursor.execute('BEGIN;')
-                applog.logger.debug(cursor.mogrify(sql_commands, values).decode('utf-8'))
+                # psycopg2 opens the transaction itself; only render the query if it will be logged.
+                if applog.is_enabled('database', logging.DEBUG):
+                    applog.logger.debug(cursor.mogrify(sql_commands, values).decode('utf-8'))
 
                 # Convert Python lists to PostgreSQL arrays
                 cursor.execute(sql_commands, values)
@@ -56,13 +314,28 @@ class DatabaseConnectionPool:
                 conn.rollback()  # Rollback in case of error
                 raise e
             else:
-                conn.commit()  # Commit the transaction if all commands succeed
+                with metrics.STAGE_SECONDS.time('commit'):
+                    conn.commit()  # Commit the transaction if all commands succeed
             finally:
                 self.release_connection(conn)
         return result
 
+    def execute_autocommit(self, sql_command: str) -> None:
+        """Runs a statement outside a transaction block, as CREATE INDEX CONCURRENTLY requires."""
+        conn = self.get_connection()
+        conn.autocommit = True
+        try:
+            with conn.cursor() as cursor:
+                applog.logger.debug(sql_command)
+                cursor.execute(sql_command)
+        finally:
+            conn.autocommit = False
+            self.release_connection(conn)
+
     def close_connection(self) -> None:
-        self.pool.closeall()
+        if self._pool is None:
+            return
+        self._pool.closeall()
         applog.logger.debug("Database connection closed.")
     
     def __del__(self):
@@ -82,15 +355,36 @@ class DatabaseConnectionPool:
                 schema[table_name].append((column_name, data_type))
         return schema
 
-    def fetch_table_row_counts(self) -> Dict[str, int]:
+    def fetch_table_row_counts(self, exact: bool = False) -> Dict[str, int]:
+        """
+            Row counts of the public tables. By default they are the planner's estimates, kept by
+            ANALYZE and autovacuum, which cost nothing to read; `exact` counts every row instead,
+            scanning every table. A partitioned table is given the sum of its partitions.
+        """
+        if exact:
+            query = """
+            SELECT table_name, 
+                   (xpath('/row/c/text()', query_to_xml(format('SELECT COUNT(*) AS c FROM %s', table_name), false, true, '')))[1]::text::int AS row_count
+            FROM information_schema.tables
+            WHERE table_schema = 'public';
+            """
+            return {table_name: row_count for table_name, row_count in self.execute_command(query)}
+
+        # reltuples is -1 until a table is first analyzed; the statistics collector's count stands in.
         query = """
-        SELECT table_name, 
-               (xpath('/row/c/text()', query_to_xml(format('SELECT COUNT(*) AS c FROM %s', table_name), false, true, '')))[1]::text::int AS row_count
-        FROM information_schema.tables
-        WHERE table_schema = 'public';
-        """        
-        row_counts: Dict[str, int] = {table_name: row_count for table_name, row_count in self.execute_command(query)}
-        return row_counts
+        SELECT c.relname,
+               COALESCE((SELECT sum(CASE WHEN p.reltuples >= 0 THEN p.reltuples ELSE COALESCE(ps.n_live_tup, 0) END)
+                         FROM pg_inherits i
+                         JOIN pg_class p ON p.oid = i.inhrelid
+                         LEFT JOIN pg_stat_user_tables ps ON ps.relid = p.oid
+                         WHERE i.inhparent = c.oid),
+                        CASE WHEN c.reltuples >= 0 THEN c.reltuples ELSE s.n_live_tup END, 0)::bigint AS row_count
+        FROM pg_class c
+        JOIN pg_namespace n ON n.oid = c.relnamespace
+        LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p') AND NOT c.relispartition;
+        """
+        return {table_name: row_count for table_name, row_count in self.execute_command(query)}
 
     def clear_database(self, db_name:str=None) -> None:
         if db_name:
@@ -99,7 +393,8 @@ class DatabaseConnectionPool:
         else:
             table_names = self.fetch_table_names()
             for table_name in table_names:
-                self.execute_command(f"DROP TABLE {table_name} CASCADE")
+                # Partitions are dropped along with their parent table.
+                self.execute_command(f"DROP TABLE IF EXISTS {table_name} CASCADE")
             applog.logger.debug("All tables dropped successfully.")
 
     def fetch_table_names(self) -> List[str]:
@@ -119,37 +414,172 @@ class DatabaseConnectionPool:
         self.execute_command(query)
         applog.logger.debug(f"Table {table_name} created successfully.")
     
-    def insert_data(self, table_name: str, columns: List[TableColumn], values: Tuple) -> None:
+    def create_index(self, table_name: str, column: TableColumn, concurrently: bool = False, only: bool = False) -> str:
+        """
+            Creates the index declared for a column and returns its name.
+
+            A concurrent build does not block inserts but cannot run on a partitioned table;
+            `only` creates the index on a partitioned table alone, for partition indexes to be attached to.
+        """
+        index_name = f"{table_name}_{column.name}_idx"
+        target = f"ONLY {table_name}" if only else table_name
+        if concurrently:
+            # A concurrent build that failed leaves an invalid index behind, which IF NOT EXISTS would keep.
+            invalid = self.execute_command("SELECT 1 FROM pg_index WHERE indexrelid = to_regclass(%s) AND NOT indisvalid", (index_name,))
+            if invalid:
+                self.execute_autocommit(f"DROP INDEX CONCURRENTLY IF EXISTS {index_name}")
+            self.execute_autocommit(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {index_name} ON {target} USING {column.index} ({column.name})")
+        else:
+            self.execute_command(f"CREATE INDEX IF NOT EXISTS {index_name} ON {target} USING {column.index} ({column.name})")
+        applog.logger.debug(f"Index {index_name} created successfully.")
+        return index_name
+
+    def attach_index(self, parent_index: str, partition_index: str) -> None:
+        """Attaches the index of a partition to the matching index of its partitioned table."""
+        query = """
+        SELECT 1 FROM pg_inherits WHERE inhparent = to_regclass(%s) AND inhrelid = to_regclass(%s)
+        """
+        if not self.execute_command(query, (parent_index, partition_index)):
+            self.execute_command(f"ALTER INDEX {parent_index} ATTACH PARTITION {partition_index}")
+
+    def insert_data(self, table_name: str, columns: List[TableColumn], values: Tuple) -> int:
+        """
+            Inserts one row of values converted by LogParser, with a statement built once per
+            table and columns. Returns 1 if the row was inserted and 0 if it was already present.
+        """
         assert len(columns) == len(values), f"Number of columns ({len(columns)}) and values ({len(values)}) do not match"
-        
-        columns_str = ', '.join([col.name for col in columns])
-        placeholders = []
-        formatted_values = []
-        
-        for col, val in zip(columns, values):
-            if col.datatype == "TIMESTAMP":    
-                if col.data_format:
-                    placeholders.append(f"to_timestamp(%s, '{col.data_format}')")
-                    formatted_values.append(val)
-                else:
-                    placeholders.append(f"to_timestamp(%s)")
-                    formatted_values.append(val)
-            else:
-                placeholders.append('%s')
-                formatted_values.append(val if not col.isArray else [val])
-        
-        placeholders_str = ', '.join(placeholders)
-        query = f'INSERT INTO {table_name} ({columns_str}) VALUES ({placeholders_str}) ON CONFLICT DO NOTHING'
-        self.execute_command(query, formatted_values)
+        inserted = self.execute_command(self.row_statement(table_name, columns), values)[0][0]
+        self.count_rows(table_name, 1, inserted)
+        return inserted
+
+    def count_rows(self, table_name: str, rows: int, inserted: int) -> None:
+        metrics.ROWS_INSERTED.inc(table_name, amount=inserted)
+        metrics.ROWS_CONFLICTED.inc(table_name, amount=rows - inserted)
     
-    def __repr__(self) -> str:
+    def register_merge(self, table_name: str, returning: List[str], statements: List[str]) -> None:
+        """
+            Registers data-modifying CTEs to run with every insert into a table. They read the rows
+            the insert actually added, with the `returning` columns, from a CTE named `inserted`.
+        """
+        self.merge_hooks[table_name] = (returning, statements)
+        self.statements = {key: statement for key, statement in self.statements.items() if key[0] != table_name}
+
+    def merge_statement(self, table_name: str, insert_sql: str) -> str:
+        """Wraps an INSERT with the statements registered for the table; it then returns the number of rows inserted."""
+        hook = self.merge_hooks.get(table_name)
+        if hook is None:
+            return insert_sql
+        returning, statements = hook
+        return f"WITH inserted AS ({insert_sql} RETURNING {', '.join(returning)}), {', '.join(statements)} SELECT count(*) FROM inserted"
+
+    def insert_statement(self, table_name: str, columns: List[TableColumn]) -> Tuple[str, str]:
+        """Returns the cached multi-row INSERT statement and row template for `execute_values`."""
+        key = (table_name, tuple(col.name for col in columns))
+        statement = self.statements.get(key)
+        if statement is None:
+            columns_str = ', '.join(col.name for col in columns)
+            query = self.merge_statement(table_name, f'INSERT INTO {table_name} ({columns_str}) VALUES %s ON CONFLICT DO NOTHING')
+            # Arrays are cast explicitly so that empty lists get the column type.
+            template = '(' + ', '.join(f"%s::{col.datatype}[]" if col.isArray else '%s' for col in columns) + ')'
+            statement = self.statements[key] = (query, template)
+        return statement
+
+    def row_statement(self, table_name: str, columns: List[TableColumn]) -> str:
+        """Returns the cached single-row INSERT statement, which returns the number of rows inserted."""
+        key = (table_name, tuple(col.name for col in columns), 'row')
+        statement = self.statements.get(key)
+        if statement is None:
+            columns_str = ', '.join(col.name for col in columns)
+            _, template = self.insert_statement(table_name, columns)
+            insert_sql = f'INSERT INTO {table_name} ({columns_str}) VALUES {template} ON CONFLICT DO NOTHING'
+            if table_name in self.merge_hooks:
+                query = self.merge_statement(table_name, insert_sql)
+            else:
+                query = f"WITH inserted AS ({insert_sql} RETURNING 1) SELECT count(*) FROM inserted"
+            statement = self.statements[key] = (query, template)
+        return statement[0]
+
+    def insert_many(self, table_name: str, columns: List[TableColumn], rows: Iterable[Tuple], batch_size: int = 1000) -> int:
+        """
+            Inserts converted rows with multi-row INSERT ... VALUES statements of up to
+            `batch_size` rows, committing once per batch. Returns the number of rows actually inserted.
+        """
+        from psycopg2 import extras
+        query, template = self.insert_statement(table_name, columns)
+        rows = iter(rows)
+        inserted = 0
+        total = 0
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                while True:
+                    batch = list(islice(rows, batch_size))
+                    if not batch:
+                        break
+                    total += len(batch)
+                    if table_name in self.merge_hooks:
+                        inserted += sum(row[0] for row in extras.execute_values(cursor, query, batch, template=template, page_size=batch_size, fetch=True))
+                    else:
+                        extras.execute_values(cursor, query, batch, template=template, page_size=batch_size)
+                        inserted += cursor.rowcount
+                    with metrics.STAGE_SECONDS.time('commit'):
+                        conn.commit()
+        except Exception as e:
+            conn.rollback()
+            raise e
+        finally:
+            self.release_connection(conn)
+        self.count_rows(table_name, total, inserted)
+        applog.logger.debug(f"Inserted {inserted} rows into {table_name}.")
+        return inserted
+
+    def copy_data(self, table_name: str, columns: List[TableColumn], rows: Iterable[Tuple]) -> int:
+        """Bulk loads rows through a staging table. Returns the number of rows actually inserted."""
+        return self.copy_from(table_name, columns, CopyStream(columns, rows))
+
+    def copy_from(self, table_name: str, columns: List[TableColumn], stream) -> int:
+        """
+            Bulk loads COPY text from a file-like `stream` into a temporary staging table and
+            merges it into the table with the same conflict semantics as `insert_data`.
+
+            The staging table has the column types of the table, so values must already be
+            converted (see LogParser.parse_log_lines). Returns the number of rows actually inserted.
+        """
+        stage = f"{table_name}_stage"
+        columns_str = ', '.join(col.name for col in columns)
+
+        conn = self.get_connection()
+        try:
+            with conn.cursor() as cursor:
+                cursor.execute(f"CREATE TEMP TABLE {stage} (LIKE {table_name}) ON COMMIT DROP")
+                cursor.copy_expert(f"COPY {stage} ({columns_str}) FROM STDIN", stream)
+                copied = cursor.rowcount
+                cursor.execute(self.merge_statement(table_name, f"INSERT INTO {table_name} ({columns_str}) SELECT {columns_str} FROM {stage} ON CONFLICT DO NOTHING"))
+                inserted = cursor.fetchone()[0] if table_name in self.merge_hooks else cursor.rowcount
+        except Exception as e:
+            conn.rollback()
+            raise e
+        else:
+            with metrics.STAGE_SECONDS.time('commit'):
+                conn.commit()
+        finally:
+            self.release_connection(conn)
+        self.count_rows(table_name, copied, inserted)
+        applog.logger.debug(f"Copied {inserted} rows into {table_name}.")
+        return inserted
+
+    def describe(self, exact: bool = False) -> str:
+        """The schema of every table and its row count, estimated unless `exact`."""
         schema = self.fetch_table_schema()
-        row_counts = self.fetch_table_row_counts()
-        repr_str = "Database Schema and Row Counts:\n"
+        row_counts = self.fetch_table_row_counts(exact)
+        repr_str = f"Database Schema and {'Exact' if exact else 'Estimated'} Row Counts:\n"
         for table, columns in schema.items():
             repr_str += f"Table: {table}\n"
             for column_name, data_type in columns:
                 repr_str += f"  Column: {column_name}, Type: {data_type}\n"
             row_count = row_counts.get(table, 0)
             repr_str += f"  Row count: {row_count}\n\n"
-        return repr_str
\ No newline at end of file
+        return repr_str
+
+    def __repr__(self) -> str:
+        return self.describe()
@@ -0,0 +1,133 @@
+import re
+from datetime import datetime
+from typing import List, Tuple
+import xml.etree.ElementTree as ET
+
+from database import DatabaseConnectionPool, TableColumn
+from rollup import GRAINS
+import applog
+
+IDENTIFIER = re.compile(r'[A-Za-z_][A-Za-z0-9_]*')
+
+class ChartDataset:
+    """
+        A Superset chart dataset kept as a table, `{table}_chart_{name}`: the chart's expressions
+        over the columns of a log table, summed per time bucket of `grain` along with the count
+        of log rows, `samples`, so that a chart reads sum / samples per bucket.
+
+        Like a rollup, the table is updated by the statement that inserts a batch, from the rows
+        the batch added, so a dashboard reads a row per bucket instead of evaluating the
+        expressions over the whole log table on every load. `trim` removes the buckets older
+        than the rows left in the log table and `refresh` recomputes buckets from the log table.
+    """
+    def __init__(self, table: str, name: str, time_column: TableColumn, fields: List[Tuple[str, str]], columns: List[str], grain: str = 'minute'):
+        self.table = table
+        self.name = name
+        self.time_column = time_column
+        self.fields = fields
+        self.columns = columns
+        self.grain = grain
+
+    @classmethod
+    def from_element(cls, element: ET.Element, table: str, schema: List[TableColumn]) -> "ChartDataset":
+        """Builds a dataset from a <dataset> element of log_structure.xml."""
+        columns = {col.name: col for col in schema}
+        name = element.get('name')
+        time_column = columns.get(element.get('time'))
+        if time_column is None or time_column.datatype != 'TIMESTAMP':
+            raise ValueError(f"Dataset '{name}' needs a TIMESTAMP time column, not '{element.get('time')}'.")
+        grain = element.get('grain', 'minute')
+        if grain not in GRAINS:
+            raise ValueError(f"Dataset '{name}' has unknown grain '{grain}'; expected one of {', '.join(GRAINS)}.")
+
+        fields = []
+        referenced = []
+        for field in element.findall('field'):
+            field_name, expression = field.get('name'), field.get('expression')
+            if not field_name or not IDENTIFIER.fullmatch(field_name) or field_name.lower() in ('bucket', 'samples') or not expression:
+                raise ValueError(f"Dataset '{name}' has a field without a valid name and an expression.")
+            fields.append((field_name, expression))
+            referenced += [word for word in IDENTIFIER.findall(expression) if word in columns]
+        if not fields:
+            raise ValueError(f"Dataset '{name}' has no fields.")
+        return cls(table, name, time_column, fields, list(dict.fromkeys(referenced)), grain)
+
+    def table_name(self) -> str:
+        return f"{self.table}_chart_{self.name}"
+
+    def source_columns(self) -> List[str]:
+        """Columns of the log table the dataset is computed from."""
+        return list(dict.fromkeys([self.time_column.name] + self.columns))
+
+    def column_names(self) -> List[str]:
+        return ['bucket', 'samples'] + [name for name, _ in self.fields]
+
+    def bounds(self, column: str, since: datetime = None, until: datetime = None) -> str:
+        """Conditions keeping `column` from the bucket of %(since)s on and before the bucket of %(until)s."""
+        conditions = []
+        if since:
+            conditions.append(f"{column} >= date_trunc('{self.grain}', %(since)s::timestamp)")
+        if until:
+            conditions.append(f"{column} < date_trunc('{self.grain}', %(until)s::timestamp)")
+        return ''.join(f" AND {condition}" for condition in conditions)
+
+    def aggregate_query(self, source: str, since: datetime = None, until: datetime = None) -> str:
+        """Aggregates the rows of `source` per bucket, only those within the buckets of `since` and `until` if given."""
+        time_name = self.time_column.name
+        selected = [f"date_trunc('{self.grain}', {time_name})", "count(*)"] + [f"sum({expression})" for _, expression in self.fields]
+        return (f"SELECT {', '.join(selected)} FROM {source} "
+                f"WHERE {time_name} IS NOT NULL{self.bounds(time_name, since, until)} GROUP BY 1 ORDER BY 1")
+
+    def merge_query(self, source: str, since: datetime = None, until: datetime = None) -> str:
+        table = self.table_name()
+        updates = [f"samples = {table}.samples + EXCLUDED.samples"]
+        updates += [f"{name} = COALESCE({table}.{name}, 0) + COALESCE(EXCLUDED.{name}, 0)" for name, _ in self.fields]
+        return (f"INSERT INTO {table} ({', '.join(self.column_names())}) {self.aggregate_query(source, since, until)} "
+                f"ON CONFLICT (bucket) DO UPDATE SET {', '.join(updates)}")
+
+    def merge_statements(self, source: str) -> List[str]:
+        """A named data-modifying CTE merging the rows of `source` into the buckets of the dataset table."""
+        return [f"{self.table_name()}_merge AS ({self.merge_query(source)})"]
+
+    def create_table(self, database: DatabaseConnectionPool) -> None:
+        if database.execute_command("SELECT to_regclass(%s) IS NOT NULL", (self.table_name(),))[0][0] and not self.exists(database):
+            # A table of one row per log row, as first kept; it is only a cache of the log table.
+            database.execute_command(f"DROP TABLE {self.table_name()}")
+            applog.logger.info(f"Dropped the per-row dataset table {self.table_name()}; refresh the datasets to fill it again.")
+        columns = ['bucket TIMESTAMP PRIMARY KEY', 'samples BIGINT NOT NULL'] + [f"{name} DOUBLE PRECISION" for name, _ in self.fields]
+        database.execute_command(f"CREATE TABLE IF NOT EXISTS {self.table_name()} ({', '.join(columns)});")
+        applog.logger.debug(f"Dataset table {self.table_name()} created successfully.")
+
+    def refresh(self, database: DatabaseConnectionPool, since: datetime = None, until: datetime = None) -> int:
+        """
+            Recomputes from the log table the buckets from that of `since` on and before that of
+            `until`, or all of them; returns how many there are. Inserts wait for the refresh
+            rather than merge into buckets it is recomputing.
+        """
+        table = self.table_name()
+        result = database.execute_command(
+            f"LOCK TABLE {table} IN EXCLUSIVE MODE; DELETE FROM {table} WHERE TRUE{self.bounds('bucket', since, until)}; "
+            f"WITH added AS ({self.merge_query(self.table, since, until)} RETURNING 1) SELECT count(*) FROM added",
+            {'since': since, 'until': until})
+        applog.logger.debug(f"Dataset table {table} refreshed with {result[0][0]} buckets.")
+        return result[0][0]
+
+    def trim(self, database: DatabaseConnectionPool) -> int:
+        """Removes the buckets older than the oldest row of the log table, e.g. after its old rows were dropped or archived."""
+        time_name = self.time_column.name
+        oldest = f"(SELECT COALESCE(date_trunc('{self.grain}', min({time_name})), 'infinity') FROM {self.table})"
+        result = database.execute_command(f"WITH removed AS (DELETE FROM {self.table_name()} WHERE bucket < {oldest} RETURNING 1) SELECT count(*) FROM removed")
+        applog.logger.debug(f"Dataset table {self.table_name()} trimmed by {result[0][0]} buckets.")
+        return result[0][0]
+
+    def drop(self, database: DatabaseConnectionPool) -> None:
+        database.execute_command(f"DROP TABLE IF EXISTS {self.table_name()}")
+        applog.logger.debug(f"Dataset table {self.table_name()} dropped.")
+
+    def exists(self, database: DatabaseConnectionPool) -> bool:
+        """Whether the table exists with its buckets, rather than as one row per log row."""
+        query = "SELECT EXISTS (SELECT 1 FROM pg_attribute WHERE attrelid = to_regclass(%s) AND attname = 'bucket' AND NOT attisdropped)"
+        return database.execute_command(query, (self.table_name(),))[0][0]
+
+    def __repr__(self) -> str:
+        return f"Dataset {self.name} of {self.table} per {self.grain}: {', '.join(name for name, _ in self.fields)}"
@@ -0,0 +1,67 @@
+import gzip
+import json
+import os
+import threading
+import time
+from typing import Callable, List, Sequence, Tuple, TypeVar
+
+import applog
+
+T = TypeVar('T')
+
+class DeadLetterQueue:
+    """
+        Quarantines the log lines and rows that could not be ingested, with the reason.
+
+        Each source log file has its own gzip file of JSON lines, `{directory}/{log_type}/{source}.rejects.gz`,
+        where `source` is the path of the log file with '/' replaced by '_'. Every write appends a
+        gzip member, which zcat and gzip.open read back as one stream. Records hold either the
+        raw `line` that failed to parse or the COPY text `row` the database refused.
+    """
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = threading.Lock()
+
+    def path(self, log_type: str, source: str) -> str:
+        name = os.path.abspath(source).strip('/').replace('/', '_') if source else 'unknown'
+        return os.path.join(self.directory, log_type, f"{name}.rejects.gz")
+
+    def write(self, log_type: str, source: str, field: str, entries: Sequence[Tuple[str, str]]) -> None:
+        """Appends (value, reason) entries, where `field` names what the value is: 'line' or 'row'."""
+        if not entries:
+            return
+        now = time.strftime('%Y-%m-%dT%H:%M:%S')
+        records = ''.join(json.dumps({'time': now, 'source': source, 'reason': reason, field: value}) + '\n' for value, reason in entries)
+        file_path = self.path(log_type, source)
+        with self.lock:
+            os.makedirs(os.path.dirname(file_path), exist_ok=True)
+            with gzip.open(file_path, 'at', encoding='utf-8') as file:
+                file.write(records)
+        applog.logger.debug(f"Quarantined {len(entries)} {field}s of {source} in {file_path}.")
+
+
+def bisect_insert(insert: Callable[[List[T]], int], items: List[T], errors: Tuple[type, ...], reject: Callable[[T, Exception], None]) -> int:
+    """
+        Inserts `items` with a single call of `insert`. If it fails with one of `errors`, the items
+        are split in halves that are retried in bulk, recursively, so that only the items failing
+        on their own are passed to `reject`. With k bad items among n this takes O(k log n) calls
+        rather than n. Other errors, such as a lost connection, are raised. Returns the sum of
+        what the successful calls returned.
+    """
+    inserted = 0
+    pending = [items]
+    while pending:
+        chunk = pending.pop()
+        if not chunk:
+            continue
+        try:
+            inserted += insert(chunk)
+        except errors as e:
+            if len(chunk) == 1:
+                reject(chunk[0], e)
+                continue
+            middle = len(chunk) // 2
+            # Second half pushed first, so that items are retried in their order.
+            pending.append(chunk[middle:])
+            pending.append(chunk[:middle])
+    return inserted
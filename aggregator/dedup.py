@@ -0,0 +1,151 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import applog
+
+class BloomFilter:
+    """
+        A set of byte strings in `capacity * -log2(error_rate) / ln 2` bits. A key that was
+        added is always found; a key that was not is found with a probability of about
+        `error_rate`, as long as no more than `capacity` keys were added.
+    """
+    MAGIC = b'AGBF1'
+    HEADER = struct.Struct('<5sQIQ')
+
+    def __init__(self, capacity: int, error_rate: float = 0.001):
+        self.size = max(64, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, key: bytes) -> List[int]:
+        # Double hashing: k positions from the two halves of one digest.
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key: bytes) -> None:
+        bits = self.bits
+        for position in self.positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key: bytes) -> bool:
+        # positions() inlined, stopping at the first clear bit: most keys looked up are new.
+        digest = hashlib.blake2b(key, digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        bits, size = self.bits, self.size
+        for i in range(self.hashes):
+            position = (first + i * second) % size
+            if not bits[position >> 3] & (1 << (position & 7)):
+                return False
+        return True
+
+    def to_bytes(self) -> bytes:
+        return self.HEADER.pack(self.MAGIC, self.size, self.hashes, self.count) + bytes(self.bits)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> "BloomFilter":
+        magic, size, hashes, count = cls.HEADER.unpack_from(data)
+        if magic != cls.MAGIC or len(data) != cls.HEADER.size + (size + 7) // 8:
+            raise ValueError("not a Bloom filter file")
+        bloom = cls.__new__(cls)
+        bloom.size, bloom.hashes, bloom.count = size, hashes, count
+        bloom.bits = bytearray(data[cls.HEADER.size:])
+        return bloom
+
+
+class DedupIndex:
+    """
+        Remembers the keys of the rows inserted into a table, in one Bloom filter per day of the
+        rows, persisted as `{directory}/{table}/{YYYY-MM-DD}.bloom` between runs.
+
+        A key the filters do not know was certainly never inserted; a key they know probably was,
+        and is confirmed against the table before the row is dropped. Filters of days more than
+        `days` before the newest day seen are forgotten, as rsync no longer brings their rows.
+
+        A filter is megabytes, so `checkpoint` rewrites the changed ones at most every
+        `save_interval` seconds; the service calls `save` once more when it stops.
+    """
+    def __init__(self, directory: str, table: str, capacity: int = 4000000, error_rate: float = 0.001, days: int = 7, save_interval: float = 0.0):
+        self.directory = os.path.join(directory, table)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.days = days
+        self.save_interval = save_interval
+        self.saved = time.monotonic()
+        self.filters: Dict[str, BloomFilter] = {}
+        self.dirty: Set[str] = set()
+        self.lock = threading.Lock()
+
+    def path(self, day: str) -> str:
+        return os.path.join(self.directory, f"{day}.bloom")
+
+    def filter(self, day: str) -> BloomFilter:
+        """Returns the filter of a day, loading it from disk on first use. Call with the lock held."""
+        bloom = self.filters.get(day)
+        if bloom is None:
+            try:
+                with open(self.path(day), 'rb') as file:
+                    bloom = BloomFilter.from_bytes(file.read())
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError, struct.error) as e:
+                applog.logger.warning(f"Ignoring unreadable dedup filter {self.path(day)}: {e}")
+            self.filters[day] = bloom = bloom or BloomFilter(self.capacity, self.error_rate)
+        return bloom
+
+    def known(self, keys: Iterable[Tuple[str, bytes]]) -> List[bool]:
+        """Tells for each (day, key) whether it may have been inserted."""
+        with self.lock:
+            return [key in self.filter(day) for day, key in keys]
+
+    def add(self, keys: Iterable[Tuple[str, bytes]]) -> None:
+        with self.lock:
+            for day, key in keys:
+                self.filter(day).add(key)
+                self.dirty.add(day)
+
+    def checkpoint(self) -> None:
+        """Saves the filters if `save_interval` seconds passed since the last save."""
+        if time.monotonic() - self.saved >= self.save_interval:
+            self.save()
+
+    def save(self) -> None:
+        """Writes the filters changed since the last save and forgets those of expired days."""
+        with self.lock:
+            self.saved = time.monotonic()
+            cutoff = self.cutoff()
+            expired = [day for day in self.filters if cutoff and day < cutoff]
+            for day in expired:
+                del self.filters[day]
+                self.dirty.discard(day)
+            snapshots = {day: self.filters[day].to_bytes() for day in self.dirty}
+            self.dirty.clear()
+        os.makedirs(self.directory, exist_ok=True)
+        for day, data in snapshots.items():
+            temp_path = f"{self.path(day)}.tmp"
+            with open(temp_path, 'wb') as file:
+                file.write(data)
+            os.replace(temp_path, self.path(day))
+        for name in os.listdir(self.directory):
+            if name.endswith('.bloom') and cutoff and name[:-len('.bloom')] < cutoff:
+                os.remove(os.path.join(self.directory, name))
+        if snapshots:
+            applog.logger.debug(f"Saved dedup filters of {', '.join(sorted(snapshots))} in {self.directory}.")
+
+    def cutoff(self) -> Optional[str]:
+        days = [day for day in self.filters if len(day) == 10]
+        if not days:
+            return None
+        try:
+            newest = date.fromisoformat(max(days))
+        except ValueError:
+            return None
+        return (newest - timedelta(days=self.days)).isoformat()
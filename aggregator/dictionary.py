@@ -0,0 +1,200 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+
+from database import DatabaseConnectionPool, TableColumn, copy_unescape
+import applog
+import metrics
+
+# An item of an array literal written by copy_array_literal, and the escapes within it.
+ARRAY_ITEM = re.compile(r'"((?:[^"\\]|\\.)*)"')
+ARRAY_ESCAPE = re.compile(r'\\(.)')
+
+COPY_NULL = '\\N'
+
+class Dictionary:
+    """
+        Interns the values of a text column in a dimension table, `{table}_dict_{column}`, which
+        gives each distinct value an integer id.
+
+        The ids of the values used last are kept in an LRU cache of `cache_size` values, so that
+        only values not seen lately cost a round trip, one for all those of a batch.
+    """
+    def __init__(self, table: str, column: TableColumn, cache_size: int = 100000):
+        self.table = table
+        self.column = column
+        self.cache_size = cache_size
+        self.cache: "OrderedDict[str, int]" = OrderedDict()
+        self.lock = threading.Lock()
+
+    def table_name(self) -> str:
+        return f"{self.table}_dict_{self.column.name}"
+
+    def create_table(self, database: DatabaseConnectionPool) -> None:
+        database.execute_command(f"CREATE TABLE IF NOT EXISTS {self.table_name()} (id INTEGER GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY, value TEXT NOT NULL UNIQUE)")
+        applog.logger.debug(f"Dictionary table {self.table_name()} created successfully.")
+
+    def ids(self, database: DatabaseConnectionPool, values: Set[str]) -> Dict[str, int]:
+        """Returns the ids of distinct values, adding the values the dictionary does not have yet."""
+        ids = {}
+        missing = []
+        with self.lock:
+            cache = self.cache
+            for value in values:
+                id = cache.get(value)
+                if id is None:
+                    missing.append(value)
+                else:
+                    cache.move_to_end(value)
+                    ids[value] = id
+        metrics.DICTIONARY_LOOKUPS.inc(self.table_name(), 'hit', amount=len(ids))
+        if not missing:
+            return ids
+        metrics.DICTIONARY_LOOKUPS.inc(self.table_name(), 'miss', amount=len(missing))
+        resolved = self.resolve(database, missing)
+        with self.lock:
+            cache.update(resolved)
+            while len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        ids.update(resolved)
+        return ids
+
+    def resolve(self, database: DatabaseConnectionPool, values: List[str]) -> Dict[str, int]:
+        # Values the table has are looked up first: ON CONFLICT would use up an id for each of them.
+        query = f"""
+        WITH v AS (SELECT unnest(%s::text[]) AS value),
+             found AS (SELECT d.id, d.value FROM {self.table_name()} d JOIN v USING (value)),
+             added AS (INSERT INTO {self.table_name()} (value) SELECT value FROM v WHERE value NOT IN (SELECT value FROM found)
+                       ON CONFLICT (value) DO NOTHING RETURNING id, value)
+        SELECT id, value FROM found UNION ALL SELECT id, value FROM added
+        """
+        resolved = {}
+        for _ in range(3):
+            resolved.update({value: id for id, value in database.execute_command(query, (values,))})
+            # A value another writer was adding is neither found nor added; it is found once committed.
+            values = [value for value in values if value not in resolved]
+            if not values:
+                return resolved
+        raise RuntimeError(f"Could not intern {len(values)} values in {self.table_name()}, first {values[0]!r}.")
+
+    def encode_fields(self, database: DatabaseConnectionPool, fields: Set[str]) -> Dict[str, str]:
+        """Maps distinct fields of COPY text, a value or the array literal of values, to the same with ids."""
+        encoded = {COPY_NULL: COPY_NULL}
+        fields.discard(COPY_NULL)
+        if self.column.isArray:
+            items = {field: [ARRAY_ESCAPE.sub(r'\1', item) for item in ARRAY_ITEM.findall(copy_unescape(field))] for field in fields}
+            ids = self.ids(database, {value for values in items.values() for value in values})
+            encoded.update({field: '{' + ','.join([str(ids[value]) for value in values]) + '}' for field, values in items.items()})
+        else:
+            values = {field: copy_unescape(field) for field in fields}
+            ids = self.ids(database, set(values.values()))
+            encoded.update({field: str(ids[value]) for field, value in values.items()})
+        return encoded
+
+    def encode_values(self, database: DatabaseConnectionPool, values: List) -> List:
+        """Replaces converted values, as LogParser.parse_log_lines makes them, by their ids."""
+        if self.column.isArray:
+            items = [None if value is None else [str(item) for item in value] if value.__class__ is list else [str(value)] for value in values]
+            ids = self.ids(database, {item for value in items if value is not None for item in value})
+            return [None if value is None else [ids[item] for item in value] for value in items]
+        # The TSV parser splits any field containing a comma; restore scalars.
+        texts = [None if value is None else ','.join(value) if value.__class__ is list else str(value) for value in values]
+        ids = self.ids(database, {text for text in texts if text is not None})
+        return [None if text is None else ids[text] for text in texts]
+
+
+class DictionaryEncoding:
+    """
+        Stores a log table with its repetitive text columns replaced by the ids of their values in
+        dictionaries. The rows go to `{table}_encoded`, where such a column is an INTEGER, or an
+        INTEGER[] for an array, and a view named after the log table joins the values back in, so
+        that Superset and the rollups query the columns of the log schema as before.
+    """
+    def __init__(self, table: str, schema: List[TableColumn], columns: List[str], cache_size: int = 100000):
+        self.table = table
+        self.schema = schema
+        names = [col.name for col in schema]
+        self.dictionaries: Dict[int, Dictionary] = {names.index(name): Dictionary(table, schema[names.index(name)], cache_size) for name in columns}
+        self.storage_schema = [TableColumn(col.name, 'INTEGER', col.isArray, col.isPrimary, None, col.index) if i in self.dictionaries else col
+                               for i, col in enumerate(schema)]
+
+    @classmethod
+    def load(cls, database: DatabaseConnectionPool, table: str, schema: List[TableColumn]) -> Optional["DictionaryEncoding"]:
+        """Returns the encoding of a log table created with one, or None if the table stores its values as is."""
+        query = """
+        SELECT attname FROM pg_attribute
+        WHERE attrelid = to_regclass(%s) AND attnum > 0 AND NOT attisdropped
+          AND atttypid IN ('integer'::regtype, 'integer[]'::regtype)
+        """
+        encoded = {name for name, in database.execute_command(query, (f"{table}_encoded",))}
+        if not encoded:
+            return None
+        return cls(table, schema, [col.name for col in schema if col.datatype == 'TEXT' and col.name in encoded])
+
+    @staticmethod
+    def drop(database: DatabaseConnectionPool, table: str) -> bool:
+        """Drops an encoded log table, its view and its dictionaries; returns False if the table is not encoded."""
+        if database.execute_command("SELECT to_regclass(%s) IS NULL", (f"{table}_encoded",))[0][0]:
+            return False
+        database.execute_command(f"DROP TABLE {table}_encoded CASCADE")
+        dictionaries = database.execute_command("SELECT tablename FROM pg_tables WHERE schemaname = 'public' AND tablename LIKE %s", (f"{table}\\_dict\\_%",))
+        for name, in dictionaries:
+            database.execute_command(f"DROP TABLE IF EXISTS {name}")
+        applog.logger.debug(f"Encoded table {table}_encoded and {len(dictionaries)} dictionaries dropped successfully.")
+        return True
+
+    def storage_table(self) -> str:
+        return f"{self.table}_encoded"
+
+    def create_dictionaries(self, database: DatabaseConnectionPool) -> None:
+        for dictionary in self.dictionaries.values():
+            dictionary.create_table(database)
+
+    def decode_query(self, source: str, columns: List[str] = None) -> str:
+        """A SELECT of the `columns` (all by default) of the encoded rows of `source`, with the values in place of the ids."""
+        selected = []
+        joins = []
+        for i, col in enumerate(self.schema):
+            if columns is not None and col.name not in columns:
+                continue
+            dictionary = self.dictionaries.get(i)
+            if dictionary is None:
+                selected.append(f"t.{col.name}")
+            elif col.isArray:
+                # Decoded row by row, so a filter on the view cannot use an index of the id array.
+                selected.append(f"CASE WHEN t.{col.name} IS NULL THEN NULL ELSE ARRAY(SELECT d.value FROM unnest(t.{col.name}) WITH ORDINALITY AS u(id, n) "
+                                f"JOIN {dictionary.table_name()} d ON d.id = u.id ORDER BY u.n) END AS {col.name}")
+            else:
+                selected.append(f"d{i}.value AS {col.name}")
+                joins.append(f" LEFT JOIN {dictionary.table_name()} d{i} ON d{i}.id = t.{col.name}")
+        return f"SELECT {', '.join(selected)} FROM {source} t{''.join(joins)}"
+
+    def create_view(self, database: DatabaseConnectionPool) -> None:
+        database.execute_command(f"CREATE OR REPLACE VIEW {self.table} AS {self.decode_query(self.storage_table())}")
+        applog.logger.debug(f"View {self.table} over {self.storage_table()} created successfully.")
+
+    def decode_statement(self, columns: List[str], name: str = 'decoded') -> str:
+        """A CTE decoding the `columns` the insert of a batch returns, for merge statements to read instead of `inserted`."""
+        return f"{name} AS ({self.decode_query('inserted', columns)})"
+
+    def encode_payload(self, database: DatabaseConnectionPool, payload: str) -> str:
+        """Replaces the values of the dictionary columns in COPY text by their ids."""
+        rows = [line.split('\t') for line in payload.split('\n')[:-1]]
+        for index, dictionary in self.dictionaries.items():
+            encoded = dictionary.encode_fields(database, {row[index] for row in rows})
+            for row in rows:
+                row[index] = encoded[row[index]]
+        return ''.join(['\t'.join(row) + '\n' for row in rows])
+
+    def encode_rows(self, database: DatabaseConnectionPool, rows: List[tuple]) -> List[tuple]:
+        """Replaces the values of the dictionary columns in converted rows by their ids."""
+        if not rows:
+            return rows
+        columns = [list(column) for column in zip(*rows)]
+        for index, dictionary in self.dictionaries.items():
+            columns[index] = dictionary.encode_values(database, columns[index])
+        return list(zip(*columns))
+
+    def __repr__(self) -> str:
+        return f"Dictionary encoding of {self.table}: {', '.join(dictionary.column.name for dictionary in self.dictionaries.values())}"
@@ -0,0 +1,257 @@
+from functools import lru_cache
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+import xml.etree.ElementTree as ET
+
+import metrics
+
+# Second-level labels under which country code domains are registered, e.g. example.co.uk.
+SECOND_LEVEL_LABELS = frozenset(('ac', 'co', 'com', 'edu', 'gov', 'net', 'org', 'or', 'ne', 'go', 'gen', 'ind', 'mil', 'nic', 'res', 'firm'))
+
+def url_host(url: str) -> Optional[str]:
+    """The host of a URL, or of CONNECT's host:port, in lower case without user, port or trailing dot."""
+    if not url or url == '-':
+        return None
+    rest = url.split('://', 1)[1] if '://' in url else url
+    authority = rest.split('/', 1)[0].split('?', 1)[0].split('#', 1)[0].rsplit('@', 1)[-1]
+    if authority.startswith('['):
+        # An IPv6 literal, e.g. [::1]:443.
+        host = authority[1:authority.find(']')] if ']' in authority else ''
+    else:
+        host = authority.split(':', 1)[0]
+    return host.rstrip('.').lower() or None
+
+def is_ip_address(host: str) -> bool:
+    return ':' in host or host.replace('.', '').isdigit()
+
+def host_tld(host: str) -> Optional[str]:
+    """The last label of a host name, e.g. 'com'; None for an IP address."""
+    if not host or host == '-' or is_ip_address(host):
+        return None
+    return host.rstrip('.').rsplit('.', 1)[-1].lower()
+
+def registrable_domain(host: str) -> Optional[str]:
+    """
+        The domain a host name was registered under, e.g. 'google.com' for 'mail.google.com' or
+        'bbc.co.uk' for 'www.bbc.co.uk'. Country code second levels are recognised by their usual
+        labels rather than the full public suffix list; an IP address is its own domain.
+    """
+    if not host or host == '-':
+        return None
+    host = host.rstrip('.').lower()
+    if is_ip_address(host):
+        return host
+    labels = host.split('.')
+    if len(labels) > 2 and len(labels[-1]) == 2 and labels[-2] in SECOND_LEVEL_LABELS:
+        return '.'.join(labels[-3:])
+    return '.'.join(labels[-2:])
+
+def status_class(status: int) -> Optional[str]:
+    """'2xx' for a 200 and so on; 'other' outside the HTTP status range."""
+    if status is None:
+        return None
+    return f"{status // 100}xx" if 100 <= status < 600 else 'other'
+
+MIME_SUBTYPES = {'html': 'html', 'xhtml+xml': 'html', 'css': 'style', 'javascript': 'script', 'ecmascript': 'script',
+                 'x-javascript': 'script', 'json': 'json', 'xml': 'xml', 'pdf': 'document', 'msword': 'document',
+                 'zip': 'archive', 'gzip': 'archive', 'x-7z-compressed': 'archive', 'x-rar-compressed': 'archive',
+                 'octet-stream': 'binary', 'x-msdownload': 'executable', 'vnd.microsoft.portable-executable': 'executable'}
+
+def mime_class(mime: str) -> Optional[str]:
+    """A coarse class of a MIME type for reports: html, script, image, video, document, archive..."""
+    if not mime or mime == '-':
+        return None
+    main, _, sub = mime.split(';', 1)[0].strip().lower().partition('/')
+    if main in ('image', 'video', 'audio', 'font'):
+        return main
+    if sub in MIME_SUBTYPES:
+        return MIME_SUBTYPES[sub]
+    if sub.endswith('+json'):
+        return 'json'
+    if sub.endswith('+xml'):
+        return 'xml'
+    if sub.startswith('vnd.openxmlformats') or sub.startswith('vnd.ms-') or sub.startswith('vnd.oasis'):
+        return 'document'
+    return 'text' if main == 'text' else 'other'
+
+# Enrichment functions by the name <enrich function="..."> gives; register_enricher adds more.
+ENRICHERS: Dict[str, Callable] = {
+    'host': url_host,
+    'tld': host_tld,
+    'domain': registrable_domain,
+    'status_class': status_class,
+    'mime_class': mime_class,
+}
+
+MODES = ('replace', 'fill', 'verify')
+
+def register_enricher(name: str, function: Callable) -> None:
+    """Makes a function of one raw value available to <enrich> elements as `name`."""
+    ENRICHERS[name] = function
+
+def is_missing(value) -> bool:
+    return value is None or value == '-' or value == ''
+
+class Enricher:
+    """
+        Derives the values of a column from those of a source column, a whole column of a batch at
+        a time. `mode` decides what happens to a value the log line already has: 'replace' it,
+        'fill' it only when missing, or 'verify' it, keeping it and counting disagreements.
+
+        The function is memoized in an LRU cache of `cache_size` raw values: hosts, statuses and
+        MIME types repeat so much that nearly every value is a cache hit. URLs hardly repeat, so
+        functions of them are better left uncached, with a `cache_size` of 0.
+    """
+    def __init__(self, column: str, source: str, function: str, mode: str = 'replace', cache_size: int = 65536):
+        if function not in ENRICHERS:
+            raise ValueError(f"Unknown enrichment function '{function}' for column '{column}'; expected one of {', '.join(ENRICHERS)}.")
+        if mode not in MODES:
+            raise ValueError(f"Unknown enrichment mode '{mode}' for column '{column}'; expected one of {', '.join(MODES)}.")
+        self.column = column
+        self.source = source
+        self.function = function
+        self.mode = mode
+        self.cache_size = cache_size
+        self.compute = self.memoize()
+        # Cache hits and misses already added to the metrics.
+        self.reported = (0, 0)
+
+    def memoize(self) -> Callable:
+        function = ENRICHERS[self.function]
+        return lru_cache(maxsize=self.cache_size)(function) if self.cache_size else function
+
+    def __getstate__(self) -> Dict:
+        # The cache goes to parse worker processes empty; each process fills its own.
+        state = self.__dict__.copy()
+        state['compute'] = None
+        state['reported'] = (0, 0)
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self.compute = self.memoize()
+
+    def derive(self, values: Sequence) -> List:
+        compute = self.compute
+        try:
+            return list(map(compute, values))
+        except TypeError:
+            # The TSV parser splits any field containing a comma; restore scalars.
+            return [compute(','.join(value) if value.__class__ is list else value) for value in values]
+
+    def apply(self, target: Optional[Sequence], source: Sequence) -> List:
+        """Returns the enriched column given the source column; `target` is None for a column the log lines do not have."""
+        if target is None or self.mode == 'replace':
+            return self.derive(source)
+        if self.mode == 'fill':
+            values = list(target)
+            missing = [row for row, value in enumerate(values) if is_missing(value)]
+            for row, derived in zip(missing, self.derive([source[row] for row in missing])):
+                if derived is not None:
+                    values[row] = derived
+            return values
+        derived = self.derive(source)
+        mismatches = sum(1 for value, expected in zip(target, derived) if expected is not None and not is_missing(value) and value != expected)
+        if mismatches:
+            metrics.ENRICHMENT_MISMATCHES.inc(self.column, amount=mismatches)
+        return target
+
+    def apply_value(self, target, source, absent: bool = False):
+        """Returns the enriched value of a single row, as `apply` does for a column; `absent` for a column the log lines do not have."""
+        if source.__class__ is list:
+            source = ','.join(source)
+        if absent or self.mode == 'replace':
+            return self.compute(source)
+        if self.mode == 'fill':
+            if not is_missing(target):
+                return target
+            derived = self.compute(source)
+            return target if derived is None else derived
+        derived = self.compute(source)
+        if derived is not None and not is_missing(target) and target != derived:
+            metrics.ENRICHMENT_MISMATCHES.inc(self.column)
+        return target
+
+    def report(self, log_type: str) -> None:
+        """Adds the cache hits and misses since the last report to the metrics."""
+        if not self.cache_size:
+            return
+        info = self.compute.cache_info()
+        hits, misses = info.hits - self.reported[0], info.misses - self.reported[1]
+        self.reported = (info.hits, info.misses)
+        if hits:
+            metrics.ENRICHMENT_LOOKUPS.inc(log_type, self.column, 'hit', amount=hits)
+        if misses:
+            metrics.ENRICHMENT_LOOKUPS.inc(log_type, self.column, 'miss', amount=misses)
+
+    def __repr__(self) -> str:
+        return f"{self.column} = {self.function}({self.source}) [{self.mode}]"
+
+
+class Enrichment:
+    """
+        The <enrich> elements of a log type, applied in order to every parsed batch before it is
+        written, so that an enricher may read the column an earlier one derived. An <enrich>
+        whose column is not a column of the log lines declares a new column of the table, with
+        its `datatype` (TEXT by default).
+    """
+    def __init__(self, log_type: str, enrichers: List[Enricher], columns: List[str], derived: List[Tuple[str, str]]):
+        self.log_type = log_type
+        self.enrichers = enrichers
+        # Derived columns follow the columns of the log lines.
+        self.derived = derived
+        names = columns + [name for name, _ in derived]
+        self.declared = len(columns)
+        self.width = len(names)
+        self.indexes = [(names.index(enricher.column), names.index(enricher.source)) for enricher in enrichers]
+
+    @classmethod
+    def from_element(cls, log_type: str, element: ET.Element, columns: List[str]) -> Optional["Enrichment"]:
+        """Builds the enrichment of a log type element of log_structure.xml, or returns None if it has none."""
+        enrichers = []
+        derived = []
+        for enrich in element.findall('enrich'):
+            column, source = enrich.get('column'), enrich.get('source')
+            known = columns + [name for name, _ in derived]
+            if source not in known:
+                raise ValueError(f"Column '{column}' is enriched from '{source}', which is not a column declared before it.")
+            if column not in known:
+                derived.append((column, enrich.get('datatype', 'TEXT')))
+            cache_size = int(enrich.get('cache', 65536))
+            enrichers.append(Enricher(column, source, enrich.get('function'), enrich.get('mode', 'replace'), cache_size))
+        return cls(log_type, enrichers, columns, derived) if enrichers else None
+
+    def enrich_columns(self, columns: List) -> List:
+        """Enriches the columns of a batch, appending the derived ones."""
+        columns = list(columns) + [None] * (self.width - len(columns))
+        with metrics.STAGE_SECONDS.time('enrich'):
+            for enricher, (target, source) in zip(self.enrichers, self.indexes):
+                columns[target] = enricher.apply(columns[target], columns[source])
+        self.report()
+        return columns
+
+    def enrich_row(self, row: Tuple) -> Tuple:
+        """
+            Enriches a single row, appending the derived values. Rows are enriched one by one
+            when lines are inserted one at a time, so neither timed nor reported here: the
+            caller calls `report` once it is done with a batch of lines.
+        """
+        values = list(row) + [None] * (self.width - len(row))
+        for enricher, (target, source) in zip(self.enrichers, self.indexes):
+            values[target] = enricher.apply_value(values[target], values[source], target >= self.declared)
+        return tuple(values)
+
+    def report(self) -> None:
+        """Adds the cache hits and misses of every enricher since the last report to the metrics."""
+        for enricher in self.enrichers:
+            enricher.report(self.log_type)
+
+    def __repr__(self) -> str:
+        rates = []
+        for enricher in self.enrichers:
+            hits = metrics.ENRICHMENT_LOOKUPS.value(self.log_type, enricher.column, 'hit')
+            misses = metrics.ENRICHMENT_LOOKUPS.value(self.log_type, enricher.column, 'miss')
+            if not enricher.cache_size:
+                rates.append(f"{enricher.column} uncached")
+            else:
+                rates.append(f"{enricher.column} {hits / (hits + misses):.1%}" if hits + misses else f"{enricher.column} -")
+        return f"Enrichment cache hit rates of {self.log_type}: {', '.join(rates)}"
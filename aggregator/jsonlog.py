@@ -0,0 +1,39 @@
+import json
+from typing import Callable, List
+
+try:
+    import orjson
+    json_loads = orjson.loads
+except ImportError:
+    json_loads = json.loads
+
+def json_splitter(keys: List[str]) -> Callable[[str], List[str]]:
+    """
+        Returns a function extracting the fields of a JSON log line along the dotted `keys` of
+        the columns, e.g. 'csp-report.document-uri'. Fields come out as the strings a TSV line
+        would hold; missing and null values as '-'.
+    """
+    paths = [key.split('.') for key in keys]
+
+    def split(line: str) -> List[str]:
+        try:
+            entry = json_loads(line)
+        except ValueError as e:
+            raise ValueError(f"invalid JSON: {e}")
+        if not isinstance(entry, dict):
+            raise ValueError("not a JSON object")
+        fields = []
+        for path in paths:
+            value = entry
+            for key in path:
+                value = value.get(key) if isinstance(value, dict) else None
+            if value is None:
+                fields.append('-')
+            elif isinstance(value, str):
+                fields.append(value)
+            elif isinstance(value, bool):
+                fields.append('true' if value else 'false')
+            else:
+                fields.append(str(value))
+        return fields
+    return split
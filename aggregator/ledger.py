@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import applog
+
+HEAD_LENGTH = 4096
+# Seconds after its last change that the entry of a file gone from its path is kept, for rotation to rename it meanwhile.
+PRUNE_AGE = 7 * 86400
+
+class FileIdentity:
+    """
+        Identifies a log file independently of its path: device/inode plus a hash of its first bytes.
+
+        rsync --append grows files in place and log_rotate.sh renames them, so neither the
+        size nor the path can be used on their own to tell whether a file was seen before.
+    """
+    def __init__(self, path: str, device: int, inode: int, size: int, mtime: float, head_hash: str, head_length: int):
+        self.path = path
+        self.device = device
+        self.inode = inode
+        self.size = size
+        self.mtime = mtime
+        self.head_hash = head_hash
+        self.head_length = head_length
+
+    @staticmethod
+    def hash_head(file_path: str, head_length: int) -> Tuple[str, int]:
+        with open(file_path, 'rb') as file:
+            head = file.read(head_length)
+        return hashlib.sha1(head).hexdigest(), len(head)
+
+    @classmethod
+    def from_file(cls, file_path: str) -> "FileIdentity":
+        stat = os.stat(file_path)
+        head_hash, head_length = cls.hash_head(file_path, HEAD_LENGTH)
+        return cls(file_path, stat.st_dev, stat.st_ino, stat.st_size, stat.st_mtime, head_hash, head_length)
+
+    def matches(self, entry: Dict) -> bool:
+        """Checks whether a ledger entry was recorded for this file."""
+        if (entry.get('device'), entry.get('inode')) != (self.device, self.inode):
+            return False
+        if entry.get('head_length') == self.head_length:
+            return entry.get('head_hash') == self.head_hash
+        if entry.get('head_length', 0) > self.head_length:
+            return False
+        # The file was shorter than HEAD_LENGTH when recorded; compare the recorded prefix only.
+        return self.hash_head(self.path, entry['head_length'])[0] == entry.get('head_hash')
+
+    def __repr__(self) -> str:
+        return f"{self.device}:{self.inode} size={self.size} mtime={self.mtime} head={self.head_hash[:12]}"
+
+
+class IngestLedger:
+    """
+        Sidecar file recording, per log file, the byte offset committed to the database.
+
+        Offsets are positions in the decompressed stream, so gzip files are resumed by
+        skipping ahead. Batches may commit out of order; ranges committed beyond the
+        contiguous offset are kept in `done` and skipped on resume.
+
+        Committed batches and newly registered files are written to the file at most every
+        `save_interval` seconds and by `flush` once a file is done. Batches committed after the
+        last save are read again after a crash, and ON CONFLICT and the dedup filters drop their
+        rows. `prune` drops the entries of files that are gone for good.
+    """
+    def __init__(self, path: str, save_interval: float = 5.0):
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.files: Dict[str, Dict] = {}
+        if os.path.exists(path):
+            with open(path, 'r') as file:
+                self.files = json.load(file).get('files', {})
+        # Paths by device and inode, to find the entry of a renamed file.
+        self.paths: Dict[Tuple[int, int], str] = {(entry.get('device'), entry.get('inode')): path for path, entry in self.files.items()}
+        self.dirty = False
+        self.saved = time.monotonic()
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as file:
+            json.dump({'files': self.files}, file)
+        os.replace(tmp_path, self.path)
+        self.dirty = False
+        self.saved = time.monotonic()
+
+    def flush(self) -> None:
+        """Writes the batches committed since the last save."""
+        with self.lock:
+            if self.dirty:
+                self.save()
+
+    def set_entry(self, file_path: str, entry: Dict) -> None:
+        self.files[file_path] = entry
+        self.paths[(entry['device'], entry['inode'])] = file_path
+
+    def pop_entry(self, file_path: str) -> Optional[Dict]:
+        entry = self.files.pop(file_path, None)
+        if entry is not None and self.paths.get((entry.get('device'), entry.get('inode'))) == file_path:
+            del self.paths[(entry.get('device'), entry.get('inode'))]
+        return entry
+
+    def find_entry(self, file_path: str, identity: FileIdentity) -> Optional[Dict]:
+        entry = self.files.get(file_path)
+        if entry is not None and identity.matches(entry):
+            return entry
+        # The file may have been renamed by log rotation since it was last ingested.
+        other_path = self.paths.get((identity.device, identity.inode))
+        if other_path is not None and other_path != file_path and other_path in self.files and identity.matches(self.files[other_path]):
+            applog.logger.debug(f"Ledger entry for {other_path} carried over to renamed file {file_path}.")
+            return self.pop_entry(other_path)
+        return None
+
+    def resume(self, file_path: str, log_type: str) -> Tuple[int, List[List[int]]]:
+        """
+            Returns the committed offset and the committed ranges beyond it for a file,
+            registering the file in the ledger if it has not been seen before.
+        """
+        file_path = os.path.abspath(file_path)
+        identity = FileIdentity.from_file(file_path)
+        with self.lock:
+            entry = self.find_entry(file_path, identity)
+            if entry is None or (not file_path.endswith('.gz') and identity.size < entry['offset']):
+                entry = {'offset': 0, 'done': []}
+            entry.update({
+                'log_type': log_type,
+                'device': identity.device,
+                'inode': identity.inode,
+                'size': identity.size,
+                'mtime': identity.mtime,
+                'head_hash': identity.head_hash,
+                'head_length': identity.head_length,
+            })
+            self.set_entry(file_path, entry)
+            self.dirty = True
+            if time.monotonic() - self.saved >= self.save_interval:
+                self.save()
+            return entry['offset'], [list(r) for r in entry['done']]
+
+    def committed(self, file_path: str) -> int:
+        """Returns the committed offset of a file without registering it; 0 for a new or truncated file."""
+        file_path = os.path.abspath(file_path)
+        identity = FileIdentity.from_file(file_path)
+        with self.lock:
+            entry = self.find_entry(file_path, identity)
+            if entry is None or (not file_path.endswith('.gz') and identity.size < entry['offset']):
+                return 0
+            return entry['offset']
+
+    def commit(self, file_path: str, start: int, end: int) -> None:
+        """Records the byte range [start, end) of a file as committed to the database."""
+        file_path = os.path.abspath(file_path)
+        with self.lock:
+            entry = self.files[file_path]
+            done = sorted(entry['done'] + [[start, end]])
+            offset = entry['offset']
+            merged: List[List[int]] = []
+            for range_start, range_end in done:
+                if range_start <= offset:
+                    offset = max(offset, range_end)
+                elif merged and range_start <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], range_end)
+                else:
+                    merged.append([range_start, range_end])
+            entry['offset'] = offset
+            entry['done'] = merged
+            self.dirty = True
+            if time.monotonic() - self.saved >= self.save_interval:
+                self.save()
+
+    def prune(self, max_age: float = PRUNE_AGE) -> int:
+        """
+            Drops the entries of files no longer at their path that last changed more than
+            `max_age` seconds ago; returns how many. A file renamed by rotation keeps its entry
+            until it is resumed under its new path, as long as that happens within `max_age`.
+        """
+        now = time.time()
+        with self.lock:
+            gone = [path for path, entry in self.files.items() if now - entry.get('mtime', 0) > max_age and not os.path.exists(path)]
+            for path in gone:
+                self.pop_entry(path)
+            if gone:
+                self.save()
+        if gone:
+            applog.logger.debug(f"Dropped the ledger entries of {len(gone)} files no longer present.")
+        return len(gone)
+
+    def forget(self, file_path: str) -> None:
+        with self.lock:
+            if self.pop_entry(os.path.abspath(file_path)) is not None:
+                self.save()
+
+    def reset(self, log_type: str = None) -> None:
+        """Drops the entries of a log type, or all entries, e.g. after its table was cleared."""
+        with self.lock:
+            self.files = {path: entry for path, entry in self.files.items() if log_type and entry.get('log_type') != log_type}
+            self.paths = {(entry.get('device'), entry.get('inode')): path for path, entry in self.files.items()}
+            self.save()
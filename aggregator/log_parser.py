@@ -1,30 +1,376 @@
+import gc
 import logging
-from typing import List, Tuple
-from concurrent.futures import ThreadPoolExecutor, as_completed
-from tqdm import tqdm
+import os
+import sys
+import queue
+from typing import TYPE_CHECKING, List, Tuple, Dict, Iterator, Callable, Optional, Set, Union
+from datetime import date, datetime, timezone
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor, Future, wait, as_completed, FIRST_COMPLETED
+from contextlib import ExitStack
+from itertools import repeat
 import csv
 from io import StringIO
 from abc import ABC, abstractmethod
 import xml.etree.ElementTree as ET
 import gzip
 
-from database import DatabaseConnectionPool, TableColumn
+from database import DatabaseConnectionPool, TableColumn, CopyStream, INDEX_METHODS, ROW_ERRORS, copy_encoder, copy_unescape
+from ledger import IngestLedger
+from deadletter import DeadLetterQueue, bisect_insert
+from dedup import DedupIndex
+from partitions import PartitionManager
+from rollup import Rollup, merge_hook
+from datasets import ChartDataset
+from dictionary import DictionaryEncoding
+from enrichment import Enrichment
+from jsonlog import json_splitter
 
 import applog
+import metrics
+
+if TYPE_CHECKING:
+    # Imported where they are used: tqdm only when a progress bar is shown, multiprocessing for parse workers.
+    import multiprocessing
+    from tqdm import tqdm
+    from autotune import IngestTuner
 
 class LogColumn:
     """
         Represents a column in the log table with name, datatype, and constraints. 
     """
-    def __init__(self, name: str, datatype: str, isArray:bool = False, isPrimary:bool = False, data_format:str = None, *args, **kwargs):
+    __slots__ = ('name', 'datatype', 'isArray', 'isPrimary', 'data_format', 'index', 'key')
+
+    def __init__(self, name: str, datatype: str, isArray:bool = False, isPrimary:bool = False, data_format:str = None, index: str = None, key: str = None, *args, **kwargs):
         self.name = name
         self.datatype = datatype
         self.isArray = isArray
         self.isPrimary = isPrimary
         self.data_format = data_format
+        self.index = index
+        # Dotted path of the value in a JSON log line, e.g. 'csp-report.document-uri'.
+        self.key = key or name
 
     def __repr__(self) -> str:
-        return f"{self.name} {self.datatype}{'[]' if self.isArray else ''}{f' {self.data_format}' if self.data_format else ''}{' PRIMARY KEY' if self.isPrimary else ''}"
+        return f"{self.name} {self.datatype}{'[]' if self.isArray else ''}{f' {self.data_format}' if self.data_format else ''}{' PRIMARY KEY' if self.isPrimary else ''}{f' INDEX {self.index}' if self.index else ''}"
+
+
+# Field values stored as NULL in non-text columns.
+NULL_VALUES = frozenset(('', '-'))
+TRUE_VALUES = frozenset(('true', 't', 'yes', 'y', 'on', '1'))
+FALSE_VALUES = frozenset(('false', 'f', 'no', 'n', 'off', '0'))
+
+# PostgreSQL to_timestamp() template patterns and their strptime() equivalents, longest first.
+PG_DATETIME_PATTERNS = [
+    ('HH24', '%H'), ('HH12', '%I'), ('YYYY', '%Y'), ('MONTH', '%B'), ('MON', '%b'), ('DAY', '%A'),
+    ('DY', '%a'), ('MS', '%f'), ('US', '%f'), ('AM', '%p'), ('PM', '%p'), ('YY', '%y'), ('MM', '%m'),
+    ('DD', '%d'), ('HH', '%I'), ('MI', '%M'), ('SS', '%S'),
+]
+
+def strptime_format(data_format: str) -> str:
+    """Translates a PostgreSQL to_timestamp() format, as used in log_structure.xml, to strptime()."""
+    result = []
+    i = 0
+    while i < len(data_format):
+        for pattern, directive in PG_DATETIME_PATTERNS:
+            if data_format[i:i + len(pattern)].upper() == pattern:
+                result.append(directive)
+                i += len(pattern)
+                break
+        else:
+            char = data_format[i]
+            if char.isalpha():
+                raise ValueError(f"Unsupported timestamp format '{data_format}' at '{data_format[i:]}'")
+            result.append('%%' if char == '%' else char)
+            i += 1
+    return ''.join(result)
+
+# Month abbreviations as written by the proxy, independent of the locale.
+MONTHS = {name: number for number, name in enumerate(('jan', 'feb', 'mar', 'apr', 'may', 'jun', 'jul', 'aug', 'sep', 'oct', 'nov', 'dec'), 1)}
+BOOLEANS = {**{value: True for value in TRUE_VALUES}, **{value: False for value in FALSE_VALUES},
+            'TRUE': True, 'True': True, 'FALSE': False, 'False': False}
+FIXED_WIDTH_FIELDS = {'%Y': 4, '%m': 2, '%d': 2, '%H': 2, '%M': 2, '%S': 2, '%b': 3}
+
+def to_integer(value: str) -> Optional[int]:
+    return None if value in NULL_VALUES else int(value)
+
+def to_float(value: str) -> Optional[float]:
+    return None if value in NULL_VALUES else float(value)
+
+def to_boolean(value: str) -> Optional[bool]:
+    lowered = value.strip().lower()
+    if lowered in TRUE_VALUES:
+        return True
+    if lowered in FALSE_VALUES:
+        return False
+    if lowered in NULL_VALUES:
+        return None
+    raise ValueError(f"invalid boolean {value!r}")
+
+def fixed_width_timestamp(fmt: str) -> Optional[Callable[[str], datetime]]:
+    """
+        Returns a parser slicing the fields out of timestamps whose strptime format only has
+        fixed width fields, e.g. '%Y%m%d%H%M%S'. This is several times faster than strptime.
+        Returns None for other formats.
+    """
+    slices: Dict[str, slice] = {}
+    position = 0
+    i = 0
+    while i < len(fmt):
+        if fmt[i] == '%':
+            directive = fmt[i:i + 2]
+            if directive not in FIXED_WIDTH_FIELDS or directive in slices:
+                return None
+            width = FIXED_WIDTH_FIELDS[directive]
+            slices[directive] = slice(position, position + width)
+            position += width
+            i += 2
+        else:
+            position += 1
+            i += 1
+    if not {'%Y', '%d'} <= slices.keys() or not {'%m', '%b'} & slices.keys():
+        return None
+    length = position
+    year, day = slices['%Y'], slices['%d']
+    hour, minute, second = slices.get('%H'), slices.get('%M'), slices.get('%S')
+    month = slices.get('%m')
+    month_name = slices.get('%b')
+
+    def parse(value: str) -> datetime:
+        if len(value) != length:
+            raise ValueError(f"time data {value!r} does not match format {fmt!r}")
+        return datetime(
+            int(value[year]),
+            int(value[month]) if month else MONTHS[value[month_name].lower()],
+            int(value[day]),
+            int(value[hour]) if hour else 0,
+            int(value[minute]) if minute else 0,
+            int(value[second]) if second else 0,
+        )
+    return parse
+
+def timestamp_converter(data_format: str) -> Callable[[str], Optional[datetime]]:
+    """
+        Returns a converter parsing timestamps client side, as to_timestamp() would in UTC.
+        Log lines share timestamps heavily, so parsed values are memoized.
+    """
+    if data_format:
+        fmt = strptime_format(data_format)
+        parse = fixed_width_timestamp(fmt) or (lambda value: datetime.strptime(value, fmt))
+        def convert(value: str) -> Optional[datetime]:
+            if value in NULL_VALUES:
+                return None
+            try:
+                return parse(value)
+            except KeyError:
+                raise ValueError(f"time data {value!r} does not match format {fmt!r}")
+    else:
+        def convert(value: str) -> Optional[datetime]:
+            return None if value in NULL_VALUES else datetime.fromtimestamp(float(value), timezone.utc).replace(tzinfo=None)
+    return lru_cache(maxsize=65536)(convert)
+
+def integer_column(values: List[str]) -> List[Optional[int]]:
+    try:
+        return list(map(int, values))
+    except ValueError:
+        return list(map(to_integer, values))
+
+def float_column(values: List[str]) -> List[Optional[float]]:
+    try:
+        return list(map(float, values))
+    except ValueError:
+        return list(map(to_float, values))
+
+def boolean_column(values: List[str]) -> List[Optional[bool]]:
+    try:
+        return list(map(BOOLEANS.__getitem__, values))
+    except KeyError:
+        return list(map(to_boolean, values))
+
+def split_array(value: str) -> List[str]:
+    return value.split(',')
+
+def array_column(values: List[str]) -> List[List[str]]:
+    return list(map(str.split, values, repeat(',', len(values))))
+
+def column_converter(column: "LogColumn") -> Optional[Tuple[Callable[[List[str]], List], Callable[[str], object]]]:
+    """
+        Returns the functions converting a whole column of raw fields and a single field,
+        or None if the column is kept as text. The single field converter is used to find
+        the offending rows when converting the column fails.
+    """
+    if column.isArray:
+        return array_column, split_array
+    if column.datatype == "INTEGER":
+        return integer_column, to_integer
+    if column.datatype == "FLOAT":
+        return float_column, to_float
+    if column.datatype == "BOOLEAN":
+        return boolean_column, to_boolean
+    if column.datatype == "TIMESTAMP":
+        convert = timestamp_converter(column.data_format)
+        return (lambda values: list(map(convert, values))), convert
+    return None
+
+def row_converter(schema: List["LogColumn"]) -> Callable[[List[str]], Tuple]:
+    """
+        Generates a function converting the raw fields of one log line to a row of typed
+        values, with the converter of every column inlined, so that converting a row is a
+        single call rather than a loop over the schema. Raises ValueError for a malformed row.
+    """
+    namespace = {}
+    values = []
+    for i, column in enumerate(schema):
+        converter = column_converter(column)
+        if converter is None:
+            values.append(f"f{i}")
+        else:
+            namespace[f"convert{i}"] = converter[1]
+            values.append(f"convert{i}(f{i})")
+    width = len(schema)
+    source = (f"def convert_row(fields):\n"
+              f"    if len(fields) != {width}:\n"
+              f"        raise ValueError('expected {width} fields, found ' + str(len(fields)))\n"
+              f"    {', '.join(f'f{i}' for i in range(width))}, = fields\n"
+              f"    return ({', '.join(values)},)\n")
+    exec(source, namespace)
+    return namespace['convert_row']
+
+
+class ColumnBatch:
+    """
+        Log lines parsed column by column and converted to the column types of the log schema.
+        Lines that could not be parsed are kept in `rejects` with the reason.
+    """
+    def __init__(self, columns: List[List], rejects: List[Tuple[str, str]]):
+        self.columns = columns
+        self.rejects = rejects
+
+    def __len__(self) -> int:
+        return len(self.columns[0]) if self.columns else 0
+
+    def rows(self) -> Iterator[Tuple]:
+        return zip(*self.columns)
+
+
+class NullProgress:
+    """Stands in for a tqdm progress bar that is not shown."""
+    def __init__(self, total: int):
+        self.total = total
+        self.n = 0
+
+    def update(self, n: int) -> None:
+        self.n += n
+
+    def __enter__(self) -> "NullProgress":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+
+def progress_bar(total: int, enabled: bool):
+    """A progress bar in bytes; tqdm is only imported when the bar is shown."""
+    if not enabled:
+        return NullProgress(total)
+    from tqdm import tqdm
+    return tqdm(total=total, unit='B', unit_scale=True, desc="Inserting log lines")
+
+
+class LogBatch:
+    """
+        A batch of parsed log lines encoded as COPY text, with the [start, end) range it
+        covers in the decompressed file, the bytes of the file on disk it consumed, the
+        table partitions its rows fall into, the lines that failed to parse and the metrics
+        the worker recorded for it.
+    """
+    def __init__(self, file_path: str, start: int, end: int, consumed: int, payload: str, rows: int, periods: Set[date] = None, rejects: List[Tuple[str, str]] = None, counts: Dict = None):
+        self.file_path = file_path
+        self.start = start
+        self.end = end
+        self.consumed = consumed
+        self.payload = payload
+        self.rows = rows
+        self.periods = periods or set()
+        self.rejects = rejects or []
+        self.counts = counts or {}
+
+    def __repr__(self) -> str:
+        return f"{self.file_path} [{self.start}, {self.end}) {self.rows} rows"
+
+
+# Parse stage state of a worker process, set by init_parse_worker.
+_worker_parser: "LogParser" = None
+_worker_results: "multiprocessing.Queue" = None
+
+def init_parse_worker(parser: "LogParser", results: "multiprocessing.Queue") -> None:
+    global _worker_parser, _worker_results
+    _worker_parser = parser
+    _worker_results = results
+    # Forked workers start with a copy of the parent's counts, which the parent already has.
+    metrics.registry.reset()
+
+def parse_log_shard(shard_id: int, file_path: str, start: int, end: int, skip: List[List[int]], batch_size: int) -> int:
+    """
+        Parses the byte range [start, end) of a log file in a worker process and puts the
+        encoded batches on the results queue, followed by `shard_id` once the shard is done.
+    """
+    count = 0
+    try:
+        # Plain shards report progress in file offsets, gzip shards in compressed bytes read.
+        position = start if end is not None else 0
+        for lines, raw_position, batch_start, batch_end in _worker_parser.read_log_batches(file_path, batch_size, start, skip, end):
+            payload, rows, periods, rejects = _worker_parser.encode_logs(lines)
+            consumed = batch_end - batch_start if end is not None else raw_position - position
+            position = batch_end if end is not None else raw_position
+            _worker_results.put(LogBatch(file_path, batch_start, batch_end, consumed, payload, rows, periods, rejects, metrics.registry.take()))
+            count += 1
+    finally:
+        _worker_results.put(shard_id)
+    return count
+
+
+def is_log_file(file_path: str) -> bool:
+    """Checks whether a file is a plain or gzip log file by its name."""
+    return file_path.endswith('.log') or file_path.endswith('.log.gz')
+
+
+def insert_sources(sources: List[Tuple["LogParser", str]], workers: int = 10, mode: str = "row", batch_size: int = 5000,
+                   readers: int = None, progress: bool = True, tuner: "IngestTuner" = None) -> None:
+    """
+        Inserts log files, each with its parser, so possibly of several log types, concurrently.
+
+        Up to `readers` files (default `workers`) are read at a time, those with the most unread
+        bytes first so that the largest file does not start last and finish alone. Their batches
+        share one pool of `workers` writer threads, and each file keeps its share of them busy,
+        so that a backlog of many files drains with all the writers and connections in use.
+        A file that fails does not stop the others; the first error is raised once all are done.
+        With a `tuner`, the batch size and how many of the writers insert at a time vary as it decides.
+    """
+    if not sources:
+        return
+    sources = sorted(sources, key=lambda source: source[0].pending_bytes(source[1]), reverse=True)
+    readers = max(1, min(readers or workers, len(sources)))
+    share = max(1, workers // readers)
+    total = sum(os.path.getsize(file_path) for _, file_path in sources)
+    with ThreadPoolExecutor(max_workers=workers) as writers, ThreadPoolExecutor(max_workers=readers, thread_name_prefix='reader') as reading:
+        with progress_bar(total, progress) as pbar:
+            futures = {reading.submit(parser.insert_log_file, file_path, share, mode, batch_size, writers, pbar, tuner): file_path for parser, file_path in sources}
+            errors = []
+            for future in as_completed(futures):
+                try:
+                    future.result()
+                    applog.logger.debug(f"Log file {futures[future]} inserted successfully.")
+                except Exception as e:
+                    applog.logger.error(f"An error occurred while inserting {futures[future]}: {e}")
+                    errors.append(e)
+    for parser in {id(parser): parser for parser, _ in sources}.values():
+        if parser.ledger:
+            parser.ledger.flush()
+        if parser.dedup:
+            parser.dedup.checkpoint()
+    if errors:
+        raise errors[0]
 
 
 class LogParser:
@@ -32,12 +378,63 @@ class LogParser:
         self.database = database
         self.log_schema: List[LogColumn] = []
         self.file_type = ftype
+        self.log_type: str = None
+        self.ledger: IngestLedger = None
+        self.partitions: PartitionManager = None
+        # Progress bars only on a terminal, not when run from scripts.
+        self.progress = sys.stderr.isatty()
+        self.converters: List[Optional[Tuple[Callable, Callable]]] = []
+        self.convert_row: Callable[[List[str]], Tuple] = None
+        # Extracts the fields of a JSON log line, see load_log_schema.
+        self.split_json: Callable[[str], List[str]] = None
+        self.dead_letters: DeadLetterQueue = None
+        self.dedup: DedupIndex = None
+        self.dictionaries: DictionaryEncoding = None
+        self.enrichment: Enrichment = None
+        # Whether parse_log_lines converts line by line rather than column by column, see load_log_schema.
+        self.parse_by_row = False
 
     def create_tables(self) -> None:
         raise NotImplementedError("Method 'create_tables' must be implemented by a subclass.")
 
-    def insert_log(self, log_data: Tuple) -> None:
+    def insert_log(self, log_line: str, source: str = None) -> None:
         raise NotImplementedError("Method 'insert_log' must be implemented by a subclass.")
+
+    def insert_logs(self, log_lines: List[str], source: str = None) -> None:
+        raise NotImplementedError("Method 'insert_logs' must be implemented by a subclass.")
+
+    def insert_rows(self, log_lines: List[str], source: str = None) -> None:
+        raise NotImplementedError("Method 'insert_rows' must be implemented by a subclass.")
+
+    def encode_logs(self, log_lines: List[str]) -> Tuple[str, int, Set[date], List[Tuple[str, str]]]:
+        raise NotImplementedError("Method 'encode_logs' must be implemented by a subclass.")
+
+    def insert_payload(self, payload: str, periods: Set[date] = None, source: str = None) -> None:
+        raise NotImplementedError("Method 'insert_payload' must be implemented by a subclass.")
+
+    def quarantine(self, source: str, field: str, entries: List[Tuple[str, str]]) -> None:
+        """Sets aside log lines that failed to parse ('line') or rows the database refused ('row')."""
+        if entries and self.dead_letters:
+            self.dead_letters.write(self.log_type, source, field, entries)
+
+    def __getstate__(self) -> Dict:
+        # Parsers are shipped to parse worker processes without their connections and ledger.
+        state = self.__dict__.copy()
+        state['database'] = None
+        state['ledger'] = None
+        state['dead_letters'] = None
+        state['dedup'] = None
+        state['dictionaries'] = None
+        state['converters'] = None
+        state['convert_row'] = None
+        state['split_json'] = None
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self.converters = [column_converter(column) for column in self.log_schema]
+        self.convert_row = row_converter(self.log_schema)
+        self.split_json = self.json_splitter()
     
     def load_log_schema(self, log_type: str, xml_file: str) -> None:
         # Parse the XML file
@@ -50,8 +447,16 @@ class LogParser:
         if log_schema is None:
             raise ValueError(f"Log type '{log_type}' not found in XML schema.")
         
+        self.log_type = log_type
+
         # Retrieve the type attribute from the log type element
         self.file_type = log_schema.get('type')
+        # Whole columns convert faster than lines for the bundled log types; parse_bench
+        # tells which mode suits another schema.
+        parse = log_schema.get('parse', 'columns')
+        if parse not in ('rows', 'columns'):
+            raise ValueError(f"Log type '{log_type}' has unknown parse mode '{parse}'; expected rows or columns.")
+        self.parse_by_row = parse == 'rows'
         
         # Convert the schema to a list of LogColumn objects
         for column in log_schema.findall('column'):
@@ -60,39 +465,242 @@ class LogParser:
             isArray = column.get('array') == 'true'
             isPrimary = column.get('primaryKey') == 'true'
             data_format = column.get('format')
+            index = column.get('index')
+            key = column.get('key')
+            if index is not None and index not in INDEX_METHODS:
+                raise ValueError(f"Column '{name}' has unknown index type '{index}'; expected one of {', '.join(INDEX_METHODS)}.")
+            if index == 'gin' and not isArray:
+                raise ValueError(f"Column '{name}' can only have a gin index if it is an array.")
             
-            self.log_schema.append(LogColumn(name, datatype, isArray, isPrimary, data_format))
+            self.log_schema.append(LogColumn(name, datatype, isArray, isPrimary, data_format, index, key))
+
+        self.enrichment = Enrichment.from_element(log_type, log_schema, [column.name for column in self.log_schema])
+        self.converters = [column_converter(column) for column in self.log_schema]
+        self.convert_row = row_converter(self.log_schema)
+        self.split_json = self.json_splitter()
+
+    def read_log_batches(self, file_path: str, batch_size: Union[int, Callable[[], int]], offset: int = 0, skip: List[List[int]] = None, end: int = None) -> Iterator[Tuple[List[str], int, int, int]]:
+        """
+            Lazily reads a plain or gzip log file in batches of lines.
 
-    def insert_log_file(self, file_path: str, max_workers: int = 10) -> None:
+            Yields each batch with the number of bytes of the file on disk consumed so far
+            and the [start, end) range of the batch in the decompressed stream. Reading
+            starts at `offset`, stops at the first line boundary at or after `end` and jumps
+            over the ranges in `skip`. A trailing line without
+            a newline in a plain file is left for the next run, as rsync may still be appending it.
+            `batch_size` may be a function, called for the size of each batch.
+        """
+        skip = sorted(skip or [])
+        is_gzip = file_path.endswith('.gz')
+        with open(file_path, 'rb') as raw:
+            stream = gzip.GzipFile(fileobj=raw) if is_gzip else raw
+
+            # The first batch of a new file covers the header too, so its range starts at 0.
+            start = offset
+            if offset:
+                stream.seek(offset)
+            else:
+                # Skip the header line
+                offset = len(stream.readline())
+
+            while True:
+                while skip and skip[0][0] <= offset:
+                    _, skip_end = skip.pop(0)
+                    if skip_end > offset:
+                        stream.seek(skip_end)
+                        offset = start = skip_end
+                if end is not None and offset >= end:
+                    break
+                stop = min(skip[0][0], end or skip[0][0]) if skip else end
+                size = batch_size() if callable(batch_size) else batch_size
+
+                lines = []
+                for line in stream:
+                    if not is_gzip and not line.endswith(b'\n'):
+                        break
+                    lines.append(line.decode('utf-8', errors='replace'))
+                    offset += len(line)
+                    if len(lines) >= size or (stop is not None and offset >= stop):
+                        break
+                if not lines:
+                    break
+                metrics.LINES_READ.inc(self.log_type, amount=len(lines))
+                metrics.BYTES_READ.inc(self.log_type, amount=offset - start)
+                yield lines, raw.tell(), start, offset
+                start = offset
+
+    def insert_log_lines(self, log_lines: List[str], source: str = None) -> None:
+        for line in log_lines:
+            line = line.strip()
+            if not line:
+                continue
+            self.insert_log(line, source)
+        if self.enrichment:
+            self.enrichment.report()
+
+    def pending_bytes(self, file_path: str) -> int:
+        """Bytes of a log file not yet committed; a gzip file counts whole, as its offset is in decompressed bytes."""
+        size = os.path.getsize(file_path)
+        if not self.ledger or file_path.endswith('.gz'):
+            return size
+        return max(size - self.ledger.committed(file_path), 0)
+
+    def insert_log_file(self, file_path: str, max_workers: int = 10, mode: str = "row", batch_size: int = 5000,
+                        executor: ThreadPoolExecutor = None, pbar: "tqdm" = None, tuner: "IngestTuner" = None) -> None:
+        """
+            Streams a log file into the database batch by batch.
+
+            At most `2 * max_workers` batches are read ahead of the workers, so memory use
+            is bounded by the batch size rather than by the size of the file. When a ledger
+            is set, only the bytes not yet committed are read and every batch inserted is recorded;
+            a batch that failed, e.g. because the connection was lost, is read again by the next run.
+            Files read at the same time pass a shared `executor` of writers and `pbar`, and
+            possibly a `tuner` deciding the batch size and how many writers insert at a time.
+        """
+        insert_batch = {"copy": self.insert_logs, "values": self.insert_rows}.get(mode, self.insert_log_lines)
+        max_pending = 2 * max_workers
+        pending: Dict[Future, Tuple[int, int, int]] = {}
+
+        offset, skip = self.ledger.resume(file_path, self.log_type) if self.ledger else (0, [])
+        if offset and not file_path.endswith('.gz') and offset >= os.path.getsize(file_path):
+            applog.logger.debug(f"Log file {file_path} has no new data since offset {offset}.")
+            return
+
+        def collect(futures) -> None:
+            for future in futures:
+                batch_len, start, end = pending.pop(future)
+                try:
+                    future.result()
+                except Exception as e:
+                    applog.logger.warning(f"An error occurred while inserting a batch of {batch_len} log lines: {e}")
+                    continue
+                if self.ledger:
+                    self.ledger.commit(file_path, start, end)
+
+        with ExitStack() as stack:
+            if executor is None:
+                executor = stack.enter_context(ThreadPoolExecutor(max_workers=max_workers))
+            if pbar is None:
+                pbar = stack.enter_context(progress_bar(os.path.getsize(file_path), self.progress))
+            read = 0
+            for lines, position, start, end in self.read_log_batches(file_path, tuner.size if tuner else batch_size, offset, skip):
+                if len(pending) >= max_pending:
+                    done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+                if tuner:
+                    future = executor.submit(tuner.run, len(lines), insert_batch, lines, file_path)
+                else:
+                    future = executor.submit(insert_batch, lines, file_path)
+                pending[future] = (len(lines), start, end)
+                pbar.update(position - read)
+                read = position
+            collect(list(pending))
+            pbar.update(max(os.path.getsize(file_path) - read, 0))
+        if self.ledger:
+            self.ledger.flush()
+
+    def split_log_file(self, file_path: str, offset: int, skip: List[List[int]], range_size: int) -> List[Tuple[str, int, int, List[List[int]]]]:
+        """
+            Splits the unread part of a plain log file into line-aligned byte ranges.
+            A gzip file cannot be split and is returned as a single shard.
+        """
         if file_path.endswith('.gz'):
-            open_func = gzip.open
-            mode = 'rt'  # Read text mode for gzip
-        else:
-            open_func = open
-            mode = 'r'
+            return [(file_path, offset, None, skip)]
+        size = os.path.getsize(file_path)
+        shards = []
+        start = offset
+        with open(file_path, 'rb') as file:
+            while start < size:
+                end = start + range_size
+                if end < size:
+                    file.seek(end)
+                    file.readline()
+                    end = file.tell()
+                else:
+                    end = size
+                shards.append((file_path, start, end, [r for r in skip if r[0] < end and r[1] > start]))
+                start = end
+        return shards
 
-        with open_func(file_path, mode) as file:
-            lines = file.readlines()
-        
-        # Skip the header line
-        lines = lines[1:]
-        
-        with ThreadPoolExecutor(max_workers=max_workers) as executor:
-            with tqdm(total=len(lines), desc="Inserting log lines") as pbar:
-                futures = {executor.submit(self.insert_log, line.strip()): line.strip() for line in lines if line.strip()}
-                for future in as_completed(futures):
-                    try:
-                        future.result()
-                    except Exception as e:
-                        line = futures[future]
-                        applog.logger.warning(f"An error occurred while inserting the log line {line}: {e}")
-                    finally:
-                        pbar.update(1)
-    
-    def insert_log_files(self, log_files: List[str], workers:int = 10) -> None:
-        for log_file in log_files:
-            self.insert_log_file(log_file, workers)
-            applog.logger.debug(f"Log file {log_file} inserted successfully.")
+    def insert_log_files_parallel(self, log_files: List[str], processes: int, writers: int, batch_size: int, range_size: int = 32 * 1024 * 1024,
+                                  tuner: "IngestTuner" = None) -> None:
+        """
+            Parses log files in a pool of processes and loads the batches with a pool of writer threads.
+
+            Plain files are split into line-aligned byte ranges and every file is a shard of its
+            own, so all files given are parsed concurrently. Workers encode their rows as COPY text
+            and block on a bounded queue when the writers fall behind. A `tuner` decides how many
+            writers insert at a time; the batch size of the workers is fixed when they start.
+        """
+        shards = []
+        # Largest first, so that the ranges of a big file are not the last ones left to parse.
+        for log_file in sorted(log_files, key=self.pending_bytes, reverse=True):
+            offset, skip = self.ledger.resume(log_file, self.log_type) if self.ledger else (0, [])
+            shards.extend(self.split_log_file(log_file, offset, skip, range_size))
+        if not shards:
+            return
+        total = sum(os.path.getsize(shard[0]) - shard[1] if shard[2] is not None else os.path.getsize(shard[0]) for shard in shards)
+
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+        results = multiprocessing.Queue(maxsize=2 * writers)
+        remaining = set(range(len(shards)))
+        pending: Dict[Future, LogBatch] = {}
+
+        def collect(futures) -> None:
+            for future in futures:
+                batch = pending.pop(future)
+                pbar.update(batch.consumed)
+                try:
+                    future.result()
+                except Exception as e:
+                    applog.logger.warning(f"An error occurred while inserting a batch of {batch.rows} log lines from {batch.file_path}: {e}")
+                    continue
+                if self.ledger:
+                    self.ledger.commit(batch.file_path, batch.start, batch.end)
+
+        with ProcessPoolExecutor(max_workers=processes, initializer=init_parse_worker, initargs=(self, results)) as parsers:
+            with ThreadPoolExecutor(max_workers=writers) as executor:
+                with progress_bar(total, self.progress) as pbar:
+                    parse_futures = [parsers.submit(parse_log_shard, shard_id, *shard, batch_size) for shard_id, shard in enumerate(shards)]
+                    while remaining:
+                        try:
+                            item = results.get(timeout=1)
+                        except queue.Empty:
+                            if all(future.done() for future in parse_futures) and any(future.exception() for future in parse_futures):
+                                # A worker died without reporting its shard; stop waiting for it.
+                                break
+                            continue
+                        if isinstance(item, int):
+                            remaining.discard(item)
+                            continue
+                        metrics.registry.merge(item.counts)
+                        self.quarantine(item.file_path, 'line', item.rejects)
+                        if len(pending) >= 2 * writers:
+                            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                            collect(done)
+                        if tuner:
+                            future = executor.submit(tuner.run, item.rows, self.insert_payload, item.payload, item.periods, item.file_path)
+                        else:
+                            future = executor.submit(self.insert_payload, item.payload, item.periods, item.file_path)
+                        pending[future] = item
+                    collect(list(pending))
+            if self.ledger:
+                self.ledger.flush()
+
+            for shard, future in zip(shards, parse_futures):
+                if future.exception():
+                    applog.logger.warning(f"An error occurred while parsing {shard[0]} from offset {shard[1]}: {future.exception()}")
+        if self.dedup:
+            self.dedup.checkpoint()
+
+    def insert_log_files(self, log_files: List[str], workers:int = 10, mode: str = "row", batch_size: int = 5000, processes: int = 0, readers: int = None,
+                         tuner: "IngestTuner" = None) -> None:
+        if processes:
+            self.insert_log_files_parallel(log_files, processes, workers, tuner.size() if tuner else batch_size, tuner=tuner)
+            applog.logger.debug(f"Log files {log_files} inserted successfully.")
+            return
+        insert_sources([(self, log_file) for log_file in log_files], workers, mode, batch_size, readers, self.progress, tuner)
 
     def parse_log_line(self, log_line: str) -> Tuple:
         try:
@@ -110,6 +718,8 @@ class LogParser:
                 reader = csv.reader(f)
                 fields = next(reader)
                 processed_fields = fields
+            elif self.file_type == "json":
+                processed_fields = self.split_json(log_line)
             else:
                 raise ValueError(f"Log file type '{type}' not supported.")
         except Exception as e:
@@ -117,6 +727,143 @@ class LogParser:
             return None
         return tuple(processed_fields)
 
+    def parse_log_lines(self, log_lines: List[str]) -> ColumnBatch:
+        """
+            Parses a block of log lines into a ColumnBatch.
+
+            Lines are split with str.split, and only lines containing a quote go through
+            csv.reader. Array columns are split on ',' and INTEGER, FLOAT, BOOLEAN and
+            TIMESTAMP columns are converted one whole column at a time, or line by line
+            with the row converter for log types declared parse="rows".
+        """
+        # The batch keeps a lot of new, acyclic objects alive; collecting while it
+        # is built only re-scans them, so the cyclic collector is paused meanwhile.
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            with metrics.STAGE_SECONDS.time('parse'):
+                batch = self.parse_row_block(log_lines) if self.parse_by_row else self.parse_log_block(log_lines)
+        finally:
+            if gc_enabled:
+                gc.enable()
+        if self.enrichment:
+            batch.columns = self.enrichment.enrich_columns(batch.columns)
+        if batch.rejects:
+            # Bad lines tend to come in runs, so they are counted and only sampled into the log.
+            metrics.PARSE_FAILURES.inc(self.log_type, amount=len(batch.rejects))
+            line, reason = batch.rejects[0]
+            applog.log_sampled(logging.WARNING, 'parse', f"Rejected {len(batch.rejects)} of {len(log_lines)} log lines, first {line}: {reason}")
+        return batch
+
+    def parse_row(self, log_line: str) -> Tuple:
+        """Parses a single log line into a row of typed values; raises ValueError for a malformed line."""
+        line = log_line.rstrip('\r\n')
+        if self.file_type == "json":
+            fields = self.split_json(line)
+        elif self.file_type in ("tsv", "csv"):
+            delimiter = '\t' if self.file_type == "tsv" else ','
+            fields = next(csv.reader((line,), delimiter=delimiter)) if '"' in line else line.split(delimiter)
+        else:
+            raise ValueError(f"Log file type '{self.file_type}' not supported.")
+        try:
+            row = self.convert_row(fields)
+        except (TypeError, OverflowError) as e:
+            raise ValueError(str(e))
+        return self.enrichment.enrich_row(row) if self.enrichment else row
+
+    def json_splitter(self) -> Optional[Callable[[str], List[str]]]:
+        """Returns a function extracting the fields of a JSON log line along the column keys, see jsonlog.json_splitter; None for other logs."""
+        if self.file_type != "json":
+            return None
+        return json_splitter([column.key for column in self.log_schema])
+
+    def parse_row_block(self, log_lines: List[str]) -> ColumnBatch:
+        split_json = None
+        if self.file_type == "tsv":
+            delimiter = '\t'
+        elif self.file_type == "csv":
+            delimiter = ','
+        elif self.file_type == "json":
+            split_json = self.split_json
+        else:
+            raise ValueError(f"Log file type '{self.file_type}' not supported.")
+
+        convert_row = self.convert_row
+        rows = []
+        rejects: List[Tuple[str, str]] = []
+        for line in log_lines:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            try:
+                if split_json:
+                    fields = split_json(line)
+                else:
+                    fields = next(csv.reader((line,), delimiter=delimiter)) if '"' in line else line.split(delimiter)
+                rows.append(convert_row(fields))
+            except (ValueError, TypeError, OverflowError) as e:
+                rejects.append((line, str(e)))
+        columns = list(zip(*rows)) if rows else [() for _ in self.log_schema]
+        return ColumnBatch(columns, rejects)
+
+    def parse_log_block(self, log_lines: List[str]) -> ColumnBatch:
+        split_json = None
+        if self.file_type == "tsv":
+            delimiter = '\t'
+        elif self.file_type == "csv":
+            delimiter = ','
+        elif self.file_type == "json":
+            split_json = self.split_json
+        else:
+            raise ValueError(f"Log file type '{self.file_type}' not supported.")
+
+        width = len(self.log_schema)
+        rows = []
+        lines = []
+        rejects: List[Tuple[str, str]] = []
+        for line in log_lines:
+            line = line.rstrip('\r\n')
+            if not line.strip():
+                continue
+            if split_json:
+                try:
+                    fields = split_json(line)
+                except ValueError as e:
+                    rejects.append((line, str(e)))
+                    continue
+            else:
+                fields = next(csv.reader((line,), delimiter=delimiter)) if '"' in line else line.split(delimiter)
+            if len(fields) != width:
+                rejects.append((line, f"expected {width} fields, found {len(fields)}"))
+                continue
+            rows.append(fields)
+            lines.append(line)
+
+        columns = list(zip(*rows)) if rows else [() for _ in self.log_schema]
+        failed: Dict[int, str] = {}
+        for index, converter in enumerate(self.converters):
+            if converter is None:
+                continue
+            convert_column, convert = converter
+            try:
+                columns[index] = convert_column(columns[index])
+            except (ValueError, TypeError, OverflowError):
+                # Convert value by value to find the offending rows.
+                converted = []
+                for row, value in enumerate(columns[index]):
+                    try:
+                        converted.append(convert(value))
+                    except (ValueError, TypeError, OverflowError) as e:
+                        converted.append(None)
+                        failed.setdefault(row, f"{self.log_schema[index].name}: {e}")
+                columns[index] = converted
+
+        if failed:
+            keep = [row for row in range(len(rows)) if row not in failed]
+            columns = [[column[row] for row in keep] for column in columns]
+            rejects.extend((lines[row], reason) for row, reason in failed.items())
+        return ColumnBatch(columns, rejects)
+
     def __repr__(self) -> str:
         str_logparser = f"Database: {self.database}\n"
         str_logparser += f"Log Schema:\n"
@@ -131,31 +878,322 @@ class BasicLogParser(LogParser):
         super().__init__(database, *args, **kwargs)
         self.main_table = main_table
         self.table_schema: List[TableColumn] = []
+        self.rollups: List[Rollup] = []
+        self.datasets: List[ChartDataset] = []
+        # Text columns that may be stored as ids in dictionaries, see create_tables.
+        self.dictionary_columns: List[str] = []
+        # Positions of the key columns and of the day column in a row, see load_dedup.
+        self.dedup_columns: Tuple[List[int], int] = None
 
     def load_log_schema(self, log_type: str, xml_file: str) -> None:
         super().load_log_schema(log_type, xml_file)
         self.set_table_schema()
         for col in self.table_schema:
             applog.logger.debug(col)
+        log_schema = ET.parse(xml_file).getroot().find(log_type)
+        self.rollups = [Rollup.from_element(element, self.main_table, self.table_schema) for element in log_schema.findall('rollup')]
+        for rollup in self.rollups:
+            applog.logger.debug(rollup)
+        self.datasets = [ChartDataset.from_element(element, self.main_table, self.table_schema) for element in log_schema.findall('dataset')]
+        for dataset in self.datasets:
+            applog.logger.debug(dataset)
+        self.dictionary_columns = [element.get('name') for element in log_schema.findall('column') if element.get('dictionary') == 'true']
+        self.dictionary_columns += [element.get('column') for element in log_schema.findall('enrich') if element.get('dictionary') == 'true']
+        for col in self.table_schema:
+            if col.name in self.dictionary_columns and (col.datatype != 'TEXT' or col.isPrimary):
+                raise ValueError(f"Column '{col.name}' can only be stored in a dictionary if it is a TEXT column outside the primary key.")
+            if col.name in self.dictionary_columns and col.isArray and col.index == 'gin':
+                # Filters read the decoded arrays of the view, which a GIN index of the ids cannot serve.
+                raise ValueError(f"Array column '{col.name}' has a GIN index for filters; keep it as text rather than in a dictionary.")
 
     def set_table_schema(self) -> None:
-        self.table_schema = [TableColumn(column.name, column.datatype, column.isArray, column.isPrimary, column.data_format) for column in self.log_schema]
-    
-    def create_tables(self) -> None:
-        self.database.create_table(self.main_table, self.table_schema)
+        self.table_schema = [TableColumn(column.name, column.datatype, column.isArray, column.isPrimary, column.data_format, column.index) for column in self.log_schema]
+        if self.enrichment:
+            self.table_schema += [TableColumn(name, datatype) for name, datatype in self.enrichment.derived]
+
+    def missing_derived_columns(self) -> List[TableColumn]:
+        """The columns enrichment derives that a log table created before they were declared lacks."""
+        if not self.enrichment or not self.enrichment.derived:
+            return []
+        existing = {name for name, in self.database.execute_command("SELECT column_name FROM information_schema.columns WHERE table_schema = 'public' AND table_name = %s", (self.storage()[0],))}
+        if not existing:
+            return []
+        derived = [name for name, _ in self.enrichment.derived]
+        return [col for col in self.table_schema if col.name in derived and col.name not in existing]
+
+    def add_derived_columns(self) -> List[str]:
+        """
+            Adds the columns enrichment derives to a log table created before they were declared;
+            returns their names. On a dictionary encoded table, those declared dictionary="true"
+            are stored as ids too, and the view is recreated with the new columns.
+        """
+        missing = [col.name for col in self.missing_derived_columns()]
+        if not missing:
+            return []
+        if self.dictionaries:
+            encoded = [dictionary.column.name for dictionary in self.dictionaries.dictionaries.values()]
+            self.dictionaries = DictionaryEncoding(self.main_table, self.table_schema, encoded + [name for name in missing if name in self.dictionary_columns])
+            self.dictionaries.create_dictionaries(self.database)
+        table, schema = self.storage()
+        self.database.execute_command(f"ALTER TABLE {table} {', '.join(f'ADD COLUMN IF NOT EXISTS {col}' for col in schema if col.name in missing)}")
+        if self.dictionaries:
+            self.dictionaries.create_view(self.database)
+        applog.logger.info(f"Added the derived columns {', '.join(missing)} to {table}.")
+        return missing
+
+    def storage(self) -> Tuple[str, List[TableColumn]]:
+        """The table rows are written to and its columns: the log table, or the encoded table behind it."""
+        if self.dictionaries:
+            return self.dictionaries.storage_table(), self.dictionaries.storage_schema
+        return self.main_table, self.table_schema
+
+    def create_tables(self, partition: str = None, defer_indexes: bool = False, dictionary: bool = False) -> None:
+        """
+            Creates the log table, range-partitioned on its first timestamp column if `partition` is
+            'daily' or 'monthly', and the indexes declared in the log schema unless they are deferred.
+            With `dictionary`, the columns declared dictionary="true" are stored as ids, see DictionaryEncoding.
+        """
+        if dictionary:
+            if not self.dictionary_columns:
+                raise ValueError(f"Log type '{self.log_type}' has no column declared dictionary=\"true\".")
+            self.dictionaries = DictionaryEncoding(self.main_table, self.table_schema, self.dictionary_columns)
+            self.dictionaries.create_dictionaries(self.database)
+        table, schema = self.storage()
+        if not partition:
+            self.database.create_table(table, schema)
+        else:
+            timestamps = [col.name for col in self.table_schema if col.datatype == "TIMESTAMP"]
+            if not timestamps:
+                raise ValueError(f"Log type '{self.log_type}' has no TIMESTAMP column to partition on.")
+            PartitionManager(self.database, table, timestamps[0], partition).create_table(schema)
+        if not defer_indexes:
+            for column in schema:
+                if column.index:
+                    self.database.create_index(table, column)
+        if self.dictionaries:
+            self.dictionaries.create_view(self.database)
+        for rollup in self.rollups:
+            rollup.create_tables(self.database)
+        for dataset in self.datasets:
+            dataset.create_table(self.database)
+
+    def load_rollups(self) -> None:
+        """Makes every insert into the log table also update the rollups whose tables exist and the chart datasets, creating their missing tables."""
+        targets = []
+        for rollup in self.rollups:
+            if rollup.exists(self.database):
+                targets.append(rollup)
+            else:
+                applog.logger.warning(f"Tables of rollup {rollup.name} do not exist; run rebuild-rollups {self.log_type} to create them.")
+        for dataset in self.datasets:
+            if not dataset.exists(self.database):
+                # Charts select from the table, so it must exist even before it is refreshed.
+                dataset.create_table(self.database)
+                applog.logger.warning(f"Created the table of dataset {dataset.name}; run refresh-datasets {self.log_type} to add the rows inserted before.")
+            targets.append(dataset)
+        if not targets:
+            return
+        if self.dictionaries:
+            # The merge statements read the values of the batch, not their ids.
+            returning, statements = merge_hook(targets, 'decoded')
+            statements = [self.dictionaries.decode_statement(returning, 'decoded')] + statements
+        else:
+            returning, statements = merge_hook(targets)
+        self.database.register_merge(self.storage()[0], returning, statements)
+
+    def refresh_datasets(self, since: datetime = None, until: datetime = None) -> List[Tuple[str, int]]:
+        """Creates missing dataset tables and recomputes their buckets, all or those from `since` until `until`; returns the buckets per table."""
+        refreshed = []
+        for dataset in self.datasets:
+            dataset.create_table(self.database)
+            refreshed.append((dataset.table_name(), dataset.refresh(self.database, since, until)))
+        return refreshed
+
+    def trim_datasets(self) -> None:
+        """Removes the dataset buckets older than the rows left in the log table, after rows were dropped, detached or archived."""
+        for dataset in self.datasets:
+            if dataset.exists(self.database):
+                dataset.trim(self.database)
 
-    def insert_log(self, log_line: str) -> None:
-        # Parse the TSV string
+    def drop_datasets(self) -> None:
+        for dataset in self.datasets:
+            dataset.drop(self.database)
+
+    def rebuild_rollups(self) -> None:
+        """Creates missing rollup tables and recomputes all rollups from the log table."""
+        for rollup in self.rollups:
+            rollup.create_tables(self.database)
+            rollup.rebuild(self.database)
+
+    def create_indexes(self) -> None:
+        """Builds the indexes declared in the log schema without blocking inserts, e.g. after a bulk load."""
+        self.load_partitions()
+        table, schema = self.storage()
+        for column in schema:
+            if not column.index:
+                continue
+            if self.partitions:
+                self.partitions.create_index(column)
+            else:
+                self.database.create_index(table, column, concurrently=True)
+
+    def load_partitions(self) -> None:
+        """
+            Looks up how the log table is stored, dictionary encoded or not and partitioned or not,
+            so that ingest writes to the right table and creates the partitions it needs.
+        """
+        self.dictionaries = DictionaryEncoding.load(self.database, self.main_table, self.table_schema)
+        if self.dictionaries:
+            applog.logger.debug(self.dictionaries)
+        self.partitions = PartitionManager.load(self.database, self.storage()[0])
+
+    def load_dedup(self, directory: str, capacity: int = 4000000, days: int = 7, save_interval: float = 0.0) -> None:
+        """
+            Drops rows already inserted before they are copied, when the table has a primary key.
+            A row is keyed by its primary key, and the partition column if the table is partitioned,
+            and filed under the day of its partition column or first timestamp column.
+        """
+        names = [col.name for col in self.table_schema]
+        key = [name for name, col in zip(names, self.table_schema) if col.isPrimary]
+        timestamps = [col.name for col in self.table_schema if col.datatype.upper().startswith('TIMESTAMP') and not col.isArray]
+        day = self.partitions.column if self.partitions else timestamps[0] if timestamps else None
+        if not key or day is None:
+            applog.logger.debug(f"Not deduplicating {self.main_table}: it has no primary key or no timestamp column.")
+            return
+        if self.partitions and self.partitions.column not in key:
+            key.append(self.partitions.column)
+        self.dedup_columns = ([names.index(name) for name in key], names.index(day))
+        self.dedup = DedupIndex(directory, self.main_table, capacity, days=days, save_interval=save_interval)
+
+    def drop_known_rows(self, payload: str) -> Tuple[str, List[Tuple[str, bytes]]]:
+        """
+            Drops the rows of a COPY payload that were already inserted and returns the rest, with
+            the (day, key) of each row left for `dedup.add` once they are committed. Only the rows
+            the dedup filters know are looked up in the table, all with one query.
+        """
+        key_indexes, day_index = self.dedup_columns
+        splits = max(key_indexes + [day_index]) + 1
+        rows = payload.split('\n')[:-1]
+        fields = [row.split('\t', splits) for row in rows]
+        # Rows without a timestamp are left to ON CONFLICT.
+        keys = [(values[day_index][:10], '\t'.join([values[i] for i in key_indexes]).encode()) if values[day_index][4:5] == '-' else None for values in fields]
+        known = iter(self.dedup.known(key for key in keys if key))
+        candidates = [n for n, key in enumerate(keys) if key and next(known)]
+        if candidates:
+            columns = [self.table_schema[i] for i in key_indexes]
+            names = ', '.join(f"k{n}" for n in range(len(columns)))
+            match = ' AND '.join(f"t.{col.name} = k.k{n}::{col.datatype}" for n, col in enumerate(columns))
+            arrays = tuple([copy_unescape(fields[row][i]) for row in candidates] for i in key_indexes)
+            found = self.database.execute_command(
+                f"SELECT k.i FROM unnest({', '.join(['%s::text[]'] * len(columns))}) WITH ORDINALITY AS k({names}, i) "
+                f"WHERE EXISTS (SELECT 1 FROM {self.storage()[0]} t WHERE {match})", arrays)
+            present = {candidates[i - 1] for i, in found}
+            if present:
+                metrics.ROWS_DEDUPLICATED.inc(self.main_table, amount=len(present))
+                rows = [row for n, row in enumerate(rows) if n not in present]
+                keys = [key for n, key in enumerate(keys) if n not in present]
+                payload = ''.join(row + '\n' for row in rows)
+        return payload, [key for key in keys if key]
+
+    def batch_periods(self, batch: ColumnBatch) -> Set[date]:
+        if self.partitions is None or not len(batch):
+            return set()
+        index = [col.name for col in self.table_schema].index(self.partitions.column)
+        return self.partitions.periods(batch.columns[index])
+
+    def insert_log(self, log_line: str, source: str = None) -> None:
         try:
-            log_data = self.parse_log_line(log_line)
-        except Exception as e:
-            applog.logger.warning(f"Error parsing TSV: {e}")
+            log_data = self.parse_row(log_line)
+        except ValueError as e:
+            metrics.PARSE_FAILURES.inc(self.log_type)
+            applog.log_sampled(logging.WARNING, 'parse', f"Error parsing log line {log_line}: {e}")
+            self.quarantine(source, 'line', [(log_line, str(e))])
             return None
+        if self.partitions:
+            index = [col.name for col in self.table_schema].index(self.partitions.column)
+            self.partitions.ensure(self.partitions.periods([log_data[index]]))
+        table, schema = self.storage()
+        if self.dictionaries:
+            log_data = self.dictionaries.encode_rows(self.database, [log_data])[0]
         try:
             # Insert log entry
-            self.database.insert_data(self.main_table, self.table_schema, log_data)
-        except Exception as e:
-            applog.logger.warning(f"Error inserting log: {e}")
+            self.database.insert_data(table, schema, log_data)
+        except ROW_ERRORS as e:
+            self.reject_rows(source, [(copy_encoder(self.table_schema)(log_data), e)])
+
+    def reject_rows(self, source: str, rejected: List[Tuple[str, Exception]]) -> None:
+        """Counts and quarantines rows, encoded as COPY text, that the database refused."""
+        if not rejected:
+            return
+        metrics.ROWS_FAILED.inc(self.main_table, amount=len(rejected))
+        row, error = rejected[0]
+        applog.log_sampled(logging.WARNING, 'insert_row', f"Database refused {len(rejected)} rows of {source}, first {row.rstrip()}: {error}")
+        self.quarantine(source, 'row', [(row.rstrip('\n'), str(error).strip()) for row, error in rejected])
+
+    def encode_logs(self, log_lines: List[str]) -> Tuple[str, int, Set[date], List[Tuple[str, str]]]:
+        """Parses log lines and encodes the rows as COPY text, along with the partitions they need and the rejected lines."""
+        batch = self.parse_log_lines(log_lines)
+        return CopyStream(self.table_schema, batch.rows()).read(), len(batch), self.batch_periods(batch), batch.rejects
+
+    def copy_rows(self, rows: List[str]) -> int:
+        return self.database.copy_from(*self.storage(), StringIO(''.join(rows)))
+
+    def insert_payload(self, payload: str, periods: Set[date] = None, source: str = None) -> None:
+        if not payload:
+            return
+        keys = []
+        if self.dedup:
+            payload, keys = self.drop_known_rows(payload)
+            if not payload:
+                return
+        if self.partitions:
+            self.partitions.ensure(periods or ())
+        encoded = self.dictionaries.encode_payload(self.database, payload) if self.dictionaries else payload
+        try:
+            self.database.copy_from(*self.storage(), StringIO(encoded))
+            if keys:
+                self.dedup.add(keys)
+            return
+        except ROW_ERRORS as e:
+            # One bad row aborts the whole COPY; bisect the batch to copy the other rows in bulk.
+            applog.log_sampled(logging.WARNING, 'bisect', f"Error copying batch of logs from {source}, isolating the bad rows: {e}")
+        # COPY text escapes newlines inside values, so each line is exactly one row.
+        rows = [line + '\n' for line in encoded.split('\n')[:-1]]
+        # Rejected rows are quarantined with their values rather than their ids.
+        originals = dict(zip(rows, [line + '\n' for line in payload.split('\n')[:-1]]))
+        rejected = []
+        middle = len(rows) // 2
+        for half in (rows[:middle], rows[middle:]):
+            bisect_insert(self.copy_rows, half, ROW_ERRORS, lambda row, error: rejected.append((originals[row], error)))
+        self.reject_rows(source, rejected)
+        if keys:
+            # Keys of the rejected rows too; should they come again, the lookup finds them missing.
+            self.dedup.add(keys)
+
+    def insert_logs(self, log_lines: List[str], source: str = None) -> None:
+        payload, _, periods, rejects = self.encode_logs(log_lines)
+        self.quarantine(source, 'line', rejects)
+        self.insert_payload(payload, periods, source)
+
+    def insert_rows(self, log_lines: List[str], source: str = None) -> None:
+        batch = self.parse_log_lines(log_lines)
+        self.quarantine(source, 'line', batch.rejects)
+        rows = list(batch.rows())
+        if not rows:
+            return
+        if self.partitions:
+            self.partitions.ensure(self.batch_periods(batch))
+        # One bad row fails the whole statement; bisecting inserts the other rows in bulk.
+        rejected = []
+        encode_row = copy_encoder(self.table_schema)
+        table, schema = self.storage()
+        # Rows are inserted with the ids of their dictionary values, and quarantined with the values.
+        encoded = self.dictionaries.encode_rows(self.database, rows) if self.dictionaries else rows
+
+        def insert(chunk: List[Tuple[Tuple, Tuple]]) -> int:
+            return self.database.insert_many(table, schema, [row for row, _ in chunk], len(chunk))
+        bisect_insert(insert, list(zip(encoded, rows)), ROW_ERRORS, lambda pair, error: rejected.append((encode_row(pair[1]), error)))
+        self.reject_rows(source, rejected)
 
     def __repr__(self) -> str:
         str_basiclogparser = super().__repr__()
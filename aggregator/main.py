@@ -1,31 +1,182 @@
 import os
+import shutil
+import time
 import click
 import configparser
-from database import DatabaseConnectionPool as Database
-from log_parser import LogParser, BasicLogParser
+from glob import glob
+from datetime import timedelta
+from typing import TYPE_CHECKING, Dict, List
 import applog
+import metrics
+
+if TYPE_CHECKING:
+    # The commands import these where they need them: psycopg2 alone takes tens of milliseconds to import.
+    from database import DatabaseConnectionPool as Database
+    from log_parser import LogParser
+    from ledger import IngestLedger
+    from autotune import IngestTuner
+    from sync import LogSync
+
+# Partition granularities of partitions.GRANULARITIES, which is not imported for the option alone.
+GRANULARITIES = ('daily', 'monthly')
 
 script_dir = os.path.dirname(os.path.abspath(__file__))
 config_path = os.path.abspath(os.path.join(script_dir,'../etc/aggregator', 'config.ini'))
 log_structure_path = os.path.abspath(os.path.join(script_dir,'../etc/aggregator', 'log_structure.xml'))
 applog_path = os.path.join(script_dir, '/var/log/aggregator.log')
+ledger_path = '/var/lib/aggregator/ingest_ledger.json'
+deadletter_path = '/var/lib/aggregator/deadletter'
+dedup_path = '/var/lib/aggregator/dedup'
+archive_path = '/var/lib/aggregator/archive'
+sync_root = '/var/log/aggregator/safesquid'
+sync_log_path = '/var/log/sync.log'
 
 class AppContext:
     def __init__(self):
-        self.db_manager: Database = None
-        self.parser: LogParser = None
+        self.db_settings: tuple = None
+        self._db_manager: "Database" = None
+        self.parser: "LogParser" = None
+        self.metrics_path: str = None
+        self.metrics_port: int = 0
+        self.sync_config: configparser.SectionProxy = None
+        self.dedup_config: configparser.SectionProxy = None
+        self.autotune_config: configparser.SectionProxy = None
 
     def configure_logging(self, log_file:str):
         """Configure logging to log errors to console and exceptions/warnings to file."""
         applog.set_logger(__name__, log_file)
         applog.set_logger_level('DEBUG')
         # applog.track_module('database')
+        applog.track_module('main')
         applog.track_module('log_parser')
+        applog.track_module('ledger')
+        applog.track_module('partitions')
+        applog.track_module('rollup')
+        applog.track_module('daemon')
+        applog.track_module('metrics')
+        applog.track_module('deadletter')
+        applog.track_module('sync')
+        applog.track_module('dedup')
+        applog.track_module('datasets')
+        applog.track_module('dictionary')
+        applog.track_module('archive')
+        applog.track_module('autotune')
+
+    @property
+    def db_manager(self) -> "Database":
+        """The connection pool, created on first use so that commands without a database do not import psycopg2."""
+        if self._db_manager is None:
+            from database import DatabaseConnectionPool
+            self._db_manager = DatabaseConnectionPool(*self.db_settings)
+        return self._db_manager
+
+    def create_parser(self, log_type: str) -> "LogParser":
+        """Create the appropriate log parser based on log type."""
+        from log_parser import BasicLogParser
+        parser = BasicLogParser(self.db_manager, f"{log_type}_logs")
+        parser.load_log_schema(log_type, log_structure_path)
+        return parser
 
     def load_parser(self, log_type: str):
         """Load the appropriate log parser based on log type."""
-        self.parser = BasicLogParser(self.db_manager, f"{log_type}_logs")
-        self.parser.load_log_schema(log_type, log_structure_path)
+        self.parser = self.create_parser(log_type)
+
+    def create_ingest_parser(self, log_type: str, ledger: "IngestLedger", dedup_save_interval: float = 0.0) -> "LogParser":
+        """
+        Create a parser ready to insert logs: aware of the table's partitions and rollups, recording to the ledger, quarantining rejects and dropping duplicates.
+        The dedup filters are saved after every run of files, or at most every `dedup_save_interval` seconds.
+        """
+        parser = self.create_parser(log_type)
+        parser.load_partitions()
+        # Every batch would fail on the missing columns and be read again, forever.
+        missing = parser.missing_derived_columns()
+        if missing:
+            raise click.ClickException(f"Table {log_type}_logs lacks the derived columns {', '.join(col.name for col in missing)}; run add-derived-columns {log_type} to add them.")
+        parser.load_rollups()
+        parser.ledger = ledger
+        from deadletter import DeadLetterQueue
+        parser.dead_letters = DeadLetterQueue(deadletter_path)
+        if self.dedup_config.getboolean('enabled', True):
+            parser.load_dedup(dedup_path, self.dedup_config.getint('capacity', 4000000), self.dedup_config.getint('days', 7), dedup_save_interval)
+        return parser
+
+    def create_syncer(self, concurrency: int = None, timeout: float = None) -> "LogSync":
+        """Create a LogSync for the proxies in servers.list, with the settings of the [sync] section of config.ini."""
+        from sync import LogSync
+        config = self.sync_config
+        return LogSync(LogSync.read_servers(config.get('servers', '/opt/aggregator/servers.list')), sync_root,
+                       config.get('key', '/root/.ssh/id_rsa'), config.get('user', 'root'),
+                       concurrency or config.getint('concurrency', 8), timeout or config.getfloat('timeout', 600))
+
+    def create_tuner(self, workers: int, batch_size: int, nice_hours: str = None, nice_writers: int = None) -> "IngestTuner":
+        """Create an IngestTuner for up to `workers` writers, with the settings of the [autotune] section of config.ini."""
+        from autotune import IngestTuner, NiceHours
+        config = self.autotune_config
+        nice_hours = nice_hours or config.get('nice_hours', None)
+        nice = None
+        if nice_hours:
+            try:
+                nice = NiceHours.parse(nice_hours, nice_writers or config.getint('nice_writers', 2), config.getint('nice_batch_size', None))
+            except ValueError as e:
+                raise click.ClickException(str(e))
+        return IngestTuner(self.db_manager, workers, batch_size, nice, config.getfloat('window', 5.0), config.getfloat('latency_factor', 2.0),
+                           config.getfloat('max_wait', 0.1), config.getint('max_batch_size', None))
+
+    def insert_files(self, files_by_type: Dict[str, List[str]], ledger: "IngestLedger", workers: int, mode: str, batch_size: int,
+                     processes: int = 0, readers: int = None, tuner: "IngestTuner" = None):
+        """
+        Insert log files of one or more log types and print the aggregate throughput.
+        Parsing in the workers, the files of all types share the writers; parsing in processes,
+        the log types are inserted one after the other, each with all the processes.
+        """
+        from log_parser import insert_sources
+        sources = [(self.create_ingest_parser(log_type, ledger), log_files) for log_type, log_files in files_by_type.items() if log_files]
+        if not sources:
+            return
+        lines, rows = metrics.LINES_READ.total(), metrics.ROWS_INSERTED.total()
+        size = sum(parser.pending_bytes(log_file) for parser, log_files in sources for log_file in log_files)
+        start = time.perf_counter()
+        if processes:
+            for parser, log_files in sources:
+                parser.insert_log_files(log_files, workers, mode, batch_size, processes, tuner=tuner)
+        else:
+            insert_sources([(parser, log_file) for parser, log_files in sources for log_file in log_files], workers, mode, batch_size, readers, tuner=tuner)
+        seconds = max(time.perf_counter() - start, 1e-6)
+        lines, rows = metrics.LINES_READ.total() - lines, metrics.ROWS_INSERTED.total() - rows
+        print(f"Read {lines:.0f} lines ({size / 1e6:.1f} MB) from {sum(len(log_files) for _, log_files in sources)} files in {seconds:.1f} s: "
+              f"{lines / seconds:.0f} lines/s, {size / 1e6 / seconds:.1f} MB/s, {rows:.0f} rows inserted.")
+        for parser, _ in sources:
+            if parser.enrichment:
+                print(parser.enrichment)
+        if tuner:
+            print(tuner)
+
+    def export_metrics(self):
+        """Write the metrics to the textfile configured in config.ini, if any."""
+        if not self.metrics_path:
+            return
+        try:
+            metrics.registry.write_textfile(self.metrics_path)
+        except OSError as e:
+            applog.logger.warning(f"Could not write metrics to {self.metrics_path}: {e}")
+
+    def print_pool_stats(self):
+        stats = self.db_manager.pool_stats()
+        print(f"Connection pool: peak {stats['peak_in_use']}/{stats['max_conns']} in use, "
+              f"utilization {stats['utilization']:.0%}, mean wait {stats['wait_mean'] * 1000:.1f} ms, "
+              f"max wait {stats['wait_max'] * 1000:.1f} ms, {stats['timeouts']} timeouts, {stats['replaced']} replaced.")
+
+def find_log_files(paths: List[str]) -> List[str]:
+    """Expand files, directories and glob patterns into the log files they hold, in order and without duplicates."""
+    from log_parser import is_log_file
+    log_files = []
+    for pattern in paths:
+        for path in sorted(glob(pattern)) if any(char in pattern for char in '*?[') else [pattern]:
+            if os.path.isdir(path):
+                log_files.extend(os.path.join(path, file) for file in sorted(os.listdir(path)) if is_log_file(file))
+            elif is_log_file(path) and os.path.isfile(path):
+                log_files.append(path)
+    return list(dict.fromkeys(log_files))
 
 pass_context = click.make_pass_decorator(AppContext, ensure=True)
 
@@ -40,72 +191,337 @@ def cli(ctx: AppContext):
     host = config['database']['host']
     port = config['database']['port']  # Port remains as a string
     dbname = config['database']['dbname']
-    maxconns = config['database']['maxconns']
-    ctx.db_manager = Database(username, password, host, port, dbname, maxconns)
+    maxconns = config['database'].getint('maxconns', fallback=20)
+    ctx.db_settings = (username, password, host, port, dbname, maxconns)
+    ctx.metrics_path = config.get('metrics', 'textfile', fallback=None)
+    ctx.metrics_port = config.getint('metrics', 'port', fallback=0)
+    for section in ('sync', 'dedup', 'autotune'):
+        if not config.has_section(section):
+            config.add_section(section)
+    ctx.sync_config = config['sync']
+    ctx.dedup_config = config['dedup']
+    ctx.autotune_config = config['autotune']
 
     ctx.configure_logging(applog_path)
 
 @cli.command()
+@click.option('--exact', is_flag=True, default=False, help='Count the rows of every table instead of reading the planner\'s estimates; scans every table.')
 @pass_context
-def analyse_database(ctx: AppContext):
+def analyse_database(ctx: AppContext, exact: bool):
     """Analyze logs in the database."""
-    print(ctx.db_manager)  # Placeholder for actual analysis logic
+    print(ctx.db_manager.describe(exact))  # Placeholder for actual analysis logic
 
 @cli.command()
 @click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=False)
 @pass_context
 def clear_database(ctx: AppContext, log_type: str):
     """Clear database and drop all tables."""
-    ctx.db_manager.clear_database(log_type)
+    from dictionary import DictionaryEncoding
+    from ledger import IngestLedger
+    # A dictionary encoded log table is a view, dropped along with the table it reads.
+    if not log_type or not DictionaryEncoding.drop(ctx.db_manager, f"{log_type}_logs"):
+        ctx.db_manager.clear_database(log_type)
+    if log_type:
+        # Chart datasets would otherwise count the rows again once they are re-ingested.
+        ctx.load_parser(log_type)
+        ctx.parser.drop_datasets()
+    # Dropped rows must be re-ingested from the start of their files.
+    IngestLedger(ledger_path).reset(log_type)
+    shutil.rmtree(os.path.join(dedup_path, f"{log_type}_logs") if log_type else dedup_path, ignore_errors=True)
 
 @cli.command()
 @click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@click.option('--partition', type=click.Choice(GRANULARITIES, case_sensitive=False), default=None, help='Partition the table daily or monthly on its timestamp column.')
+@click.option('--defer-indexes', is_flag=True, default=False, help='Do not create the indexes declared in log_structure.xml; build them later with create-indexes.')
+@click.option('--dictionary', is_flag=True, default=False, help='Store the columns declared dictionary="true" in log_structure.xml as ids of their values.')
 @pass_context
-def create_database(ctx: AppContext, log_type: str):
+def create_database(ctx: AppContext, log_type: str, partition: str, defer_indexes: bool, dictionary: bool):
     """
     Create database and tables for log type.
     
     log_type: Type of log to create database for. Choices are 'extended', 'csp' or 'performance'.
+    partition: Create the table partitioned by day or month; partitions are then created during insert.
+    defer_indexes: Leave out the indexes so that a bulk load is not slowed down by maintaining them.
+    dictionary: Keep the values of repetitive text columns in dictionary tables, behind a view with the usual columns.
+    """
+    ctx.load_parser(log_type)
+    ctx.parser.create_tables(partition.lower() if partition else None, defer_indexes, dictionary)
+
+@cli.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@pass_context
+def create_indexes(ctx: AppContext, log_type: str):
+    """
+    Build the indexes declared in log_structure.xml concurrently, without blocking inserts.
+
+    log_type: Type of log whose table to index.
+    """
+    ctx.load_parser(log_type)
+    ctx.parser.create_indexes()
+    print(f"Indexes of {log_type}_logs created successfully.")
+
+@cli.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@pass_context
+def add_derived_columns(ctx: AppContext, log_type: str):
+    """
+    Add the columns derived by the <enrich> elements of log_structure.xml to a log table created before them.
+
+    log_type: Type of log whose table to extend. Run it while no logs of this type are being inserted;
+    the rows already in the table keep NULL in the new columns.
+    """
+    ctx.load_parser(log_type)
+    ctx.parser.load_partitions()
+    added = ctx.parser.add_derived_columns()
+    print(f"Added {', '.join(added)} to {log_type}_logs." if added else f"Table {log_type}_logs has all derived columns.")
+
+@cli.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@pass_context
+def rebuild_rollups(ctx: AppContext, log_type: str):
+    """
+    Create the rollup tables declared in log_structure.xml and recompute them from the log table.
+
+    log_type: Type of log whose rollups to rebuild. Run it while no logs of this type are being inserted.
+    """
+    ctx.load_parser(log_type)
+    ctx.parser.rebuild_rollups()
+    print(f"Rebuilt {len(ctx.parser.rollups)} rollups of {log_type}_logs.")
+
+@cli.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d', '%Y-%m-%d %H:%M']), default=None, help='Only recompute the buckets from this time on.')
+@pass_context
+def refresh_datasets(ctx: AppContext, log_type: str, since):
+    """
+    Create the chart dataset tables declared in log_structure.xml and recompute them from the log table.
+
+    log_type: Type of log whose datasets to refresh. Inserts keep the tables up to date; refresh
+    them after creating them on a table that already has rows, after changing one, or with
+    --since after rows of that time were loaded or fixed without going through insert.
+    """
+    ctx.load_parser(log_type)
+    for table_name, buckets in ctx.parser.refresh_datasets(since):
+        print(f"{table_name}: {buckets} buckets.")
+
+@cli.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@click.option('--older-than', type=click.IntRange(0), required=True, help='Retention window in days.')
+@click.option('--detach', is_flag=True, default=False, help='Detach the partitions, keeping them as tables, instead of dropping them.')
+@pass_context
+def drop_partitions(ctx: AppContext, log_type: str, older_than: int, detach: bool):
+    """
+    Drop or detach the partitions of a log table older than the retention window.
+
+    log_type: Type of log whose table was created with --partition.
+    older_than: Partitions whose whole period ended more than this many days ago are removed.
+    detach: Detach the partitions instead of dropping them.
+    """
+    # The partitions of a dictionary encoded table are those of the table behind its view.
+    ctx.load_parser(log_type)
+    ctx.parser.load_partitions()
+    partitions = ctx.parser.partitions
+    if partitions is None:
+        print(f"Table {log_type}_logs is not partitioned.")
+        return
+    expired = partitions.expire(older_than, detach)
+    ctx.parser.trim_datasets()
+    print(f"{'Detached' if detach else 'Dropped'} {len(expired)} partitions: {', '.join(expired) or 'none'}.")
+
+@cli.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@click.option('--older-than', type=click.IntRange(1), required=True, help='Retention window in days.')
+@click.option('--directory', type=click.Path(file_okay=False), default=archive_path, help='Directory of the Parquet archive.')
+@click.option('--chunk-size', type=click.IntRange(1000), default=50000, help='Rows fetched at a time and written as one row group.')
+@pass_context
+def archive(ctx: AppContext, log_type: str, older_than: int, directory: str, chunk_size: int):
+    """
+    Move the rows of a log table older than the retention window to Parquet files, one per day.
+
+    log_type: Type of log whose table to archive.
+    older_than: Days older than this many days are archived, then deleted, or their partitions dropped.
+    """
+    # Imported here: pyarrow takes long to import and only this command and restore need it.
+    from archive import LogArchive
+    ctx.load_parser(log_type)
+    ctx.parser.load_partitions()
+    archived = LogArchive(ctx.parser, directory, chunk_size).archive(older_than)
+    ctx.parser.trim_datasets()
+    print(f"Archived {sum(rows for _, rows in archived)} rows of {len(archived)} days of {log_type}_logs to {os.path.join(directory, log_type)}.")
+
+@cli.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), required=True)
+@click.option('--since', type=click.DateTime(formats=['%Y-%m-%d']), required=True, help='First day to restore.')
+@click.option('--until', type=click.DateTime(formats=['%Y-%m-%d']), default=None, help='Last day to restore; the first day by default.')
+@click.option('--directory', type=click.Path(file_okay=False), default=archive_path, help='Directory of the Parquet archive.')
+@pass_context
+def restore(ctx: AppContext, log_type: str, since, until, directory: str):
+    """
+    Load archived days back into a log table, e.g. for an investigation.
+
+    log_type: Type of log whose archive to restore. Rollups are left as they are: they kept the archived rows.
+    Chart datasets, trimmed with the log table, are recomputed for the restored days.
     """
+    from archive import LogArchive
     ctx.load_parser(log_type)
-    ctx.parser.create_tables()
+    ctx.parser.load_partitions()
+    restored = LogArchive(ctx.parser, directory).restore(since.date(), (until or since).date())
+    ctx.parser.refresh_datasets(since, (until or since) + timedelta(days=1))
+    for path, rows in restored:
+        print(f"{path}: {rows} rows.")
+    print(f"Restored {sum(rows for _, rows in restored)} rows from {len(restored)} files into {log_type}_logs.")
 
 @cli.command()
-@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), default='extended')
-@click.argument('path', type=click.Path(exists=True))
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp', 'auto'], case_sensitive=False), default='extended')
+@click.argument('paths', nargs=-1, required=True)
 @click.option('--workers', type=click.IntRange(1, 100), default=10, help='Number of workers to use for insertion.')
+@click.option('--mode', type=click.Choice(['row', 'values', 'copy'], case_sensitive=False), default='row', help='Insert rows one at a time, in multi-row INSERT statements, or bulk load batches with COPY.')
+@click.option('--batch-size', type=click.IntRange(1), default=5000, help='Number of log lines per batch.')
+@click.option('--resume/--no-resume', default=True, help='Only insert data not yet recorded in the ingest ledger.')
+@click.option('--processes', type=click.IntRange(0, os.cpu_count()), default=0, help='Number of processes parsing log files in copy mode (0 parses in the worker threads).')
+@click.option('--readers', type=click.IntRange(1, 100), default=None, help='Number of files read at a time when parsing in the workers; defaults to --workers.')
+@click.option('--autotune', is_flag=True, default=False, help='Vary the batch size and the number of workers writing at a time, up to --workers, for the best throughput.')
+@click.option('--nice-hours', default=None, help='Hours, e.g. 08:00-18:00, in which --autotune keeps to --nice-writers; defaults to nice_hours in config.ini.')
+@click.option('--nice-writers', type=click.IntRange(1, 100), default=None, help='Most workers writing at a time during --nice-hours; defaults to nice_writers in config.ini, else 2.')
 @pass_context
-def insert(ctx: AppContext, log_type: str, path: str, workers: int):
+def insert(ctx: AppContext, log_type: str, paths: List[str], workers: int, mode: str, batch_size: int, resume: bool, processes: int, readers: int,
+           autotune: bool, nice_hours: str, nice_writers: int):
     """
-    Insert log entries from a file into the database.
+    Insert log entries from files into the database.
     
-    log_type: Type of log to insert. Choices are 'extended', 'csp' or 'performance'.
-    path: Path to the log file or directory containing log files.
+    log_type: Type of log to insert. Choices are 'extended', 'csp', 'performance', or 'auto' to
+              take the type of each file from the name of its directory, as synced by sync.sh.
+    paths: Log files, directories containing log files, or quoted glob patterns of either,
+           e.g. '/var/log/aggregator/safesquid/*/extended'. The files are inserted concurrently,
+           largest first, sharing the workers.
     workers: Number of workers to use for insertion.
+    mode: 'row' inserts each line separately, 'values' inserts each batch with multi-row INSERT statements,
+          'copy' bulk loads batches through a staging table.
+    batch_size: Number of log lines per batch.
+    resume: Continue each file from the offset recorded in the ingest ledger instead of re-reading it.
+    processes: Number of processes parsing byte ranges of the log files; the workers then only write to the database.
+    readers: Number of files read at a time when not parsing in processes.
+    autotune: Measure throughput, commit latency and connection waits while inserting, and adjust the batch size
+              and the number of workers writing at a time to them; --workers and --batch-size are where it starts from.
     """
+    log_files = find_log_files(paths)
+    if not log_files:
+        print("No log files found. Please provide a log file, a directory of log files or a glob pattern matching them.")
+        return
 
-    def check_format(path:str):
-        if path.endswith('.log') or path.endswith('.log.gz'):
-            return True
-        else:
-            return False
-
-    # Check if path is a file or a directory
-    log_files = []
-    if os.path.isdir(path):
-        for file in os.listdir(path):
-            if check_format(file):
-                log_file = os.path.join(path, file)
-                log_files.append(log_file)
-    elif check_format(path):
-        log_files.append(path)
-    else:
-        print("Invalid log file format. Please provide a valid log file.")
+    if processes and mode.lower() != 'copy':
+        print("Parsing in processes requires --mode copy.")
         return
 
-    ctx.load_parser(log_type)
-    ctx.parser.insert_log_files(log_files, workers)
+    from daemon import LOG_DIRECTORIES
+    from ledger import IngestLedger
+    log_types_by_directory = {directory: log_type for log_type, directory in LOG_DIRECTORIES.items()}
+    files_by_type: Dict[str, List[str]] = {}
+    for log_file in log_files:
+        file_type = log_type.lower() if log_type.lower() != 'auto' else log_types_by_directory.get(os.path.basename(os.path.dirname(log_file)))
+        if file_type is None:
+            print(f"Skipping {log_file}: its directory is not named after a log type.")
+            continue
+        files_by_type.setdefault(file_type, []).append(log_file)
+
+    ledger = IngestLedger(ledger_path)
+    ledger.prune()
+    if not resume:
+        for log_file in log_files:
+            ledger.forget(log_file)
+    if workers > ctx.db_manager.pool.max_conns:
+        print(f"Note: {workers} workers share {ctx.db_manager.pool.max_conns} database connections; raise maxconns in config.ini to avoid waiting.")
+    tuner = ctx.create_tuner(workers, batch_size, nice_hours, nice_writers) if autotune else None
+    ctx.insert_files(files_by_type, ledger, workers, mode.lower(), batch_size, processes, readers, tuner)
     print("Logs inserted successfully.")
+    ctx.print_pool_stats()
+    ctx.export_metrics()
+
+@cli.command()
+@click.option('--concurrency', type=click.IntRange(1, 64), default=None, help='Number of proxies synced at a time; defaults to concurrency in config.ini, else 8.')
+@click.option('--timeout', type=click.FloatRange(1), default=None, help='Seconds an rsync may take, and may stall on I/O; defaults to timeout in config.ini, else 600.')
+@click.option('--insert', 'insert_synced', is_flag=True, default=False, help='Insert the files that were synced.')
+@click.option('--workers', type=click.IntRange(1, 100), default=4, help='Number of workers inserting batches with --insert.')
+@click.option('--mode', type=click.Choice(['row', 'values', 'copy'], case_sensitive=False), default='copy', help='How batches are inserted with --insert; see insert.')
+@click.option('--batch-size', type=click.IntRange(1), default=5000, help='Number of log lines per batch with --insert.')
+@click.option('--processes', type=click.IntRange(0, os.cpu_count()), default=0, help='Number of processes parsing log files with --insert in copy mode (0 parses in the worker threads).')
+@pass_context
+def sync(ctx: AppContext, concurrency: int, timeout: float, insert_synced: bool, workers: int, mode: str, batch_size: int, processes: int):
+    """
+    Pull the logs of the proxies in servers.list with rsync over ssh, several proxies at a time.
+
+    Each proxy's log types are synced over one ssh connection. Prints the time, bytes and files
+    of every proxy; with --insert, the files rsync created or appended to are inserted right away,
+    with the same defaults as serve.
+    """
+    if insert_synced and processes and mode.lower() != 'copy':
+        print("Parsing in processes requires --mode copy.")
+        return
+    with open(sync_log_path, 'a') as file:
+        # monit restarts the sync when this file goes stale.
+        file.write(time.strftime('%a %b %d %H:%M:%S %Z %Y') + '\n')
+    syncer = ctx.create_syncer(concurrency, timeout)
+    results = syncer.sync(lambda result: print(result))
+    failed = [result.server for result in results if result.errors]
+    print(f"Synced {len(results) - len(failed)} of {len(results)} proxies, {sum(result.bytes for result in results)} bytes.")
+    if insert_synced:
+        from log_parser import is_log_file
+        from ledger import IngestLedger
+        files_by_type: Dict[str, List[str]] = {}
+        for result in results:
+            for log_type, file_path in result.files:
+                if is_log_file(file_path) and file_path not in files_by_type.setdefault(log_type, []):
+                    files_by_type[log_type].append(file_path)
+        ctx.insert_files(files_by_type, IngestLedger(ledger_path), workers, mode.lower(), batch_size, processes)
+    ctx.export_metrics()
+    if failed:
+        raise click.ClickException(f"Sync failed for {', '.join(failed)}.")
+
+@cli.command()
+@click.option('--root', type=click.Path(exists=True, file_okay=False), default=sync_root, help='Directory holding one directory of logs per proxy.')
+@click.option('--log-type', 'log_types', type=click.Choice(['extended', 'performance', 'csp'], case_sensitive=False), multiple=True, default=['extended', 'performance', 'csp'], help='Log types to ingest; may be repeated.')
+@click.option('--interval', type=click.FloatRange(1), default=10.0, help='Seconds between scans of the log directories.')
+@click.option('--workers', type=click.IntRange(1, 100), default=4, help='Number of workers inserting batches, per log type.')
+@click.option('--mode', type=click.Choice(['row', 'values', 'copy'], case_sensitive=False), default='copy', help='How batches are inserted; see insert.')
+@click.option('--batch-size', type=click.IntRange(1), default=5000, help='Number of log lines per batch.')
+@click.option('--processes', type=click.IntRange(0, os.cpu_count()), default=0, help='Number of processes parsing each file; 0 parses in the workers.')
+@click.option('--sync', 'sync_logs', is_flag=True, default=False, help='Sync the proxies every interval and queue the files rsync reports, instead of scanning.')
+@click.option('--autotune', is_flag=True, default=False, help='Vary the batch size and the number of workers writing at a time, shared by all lanes; see insert.')
+@click.option('--nice-hours', default=None, help='Hours, e.g. 08:00-18:00, in which --autotune keeps to --nice-writers; defaults to nice_hours in config.ini.')
+@click.option('--nice-writers', type=click.IntRange(1, 100), default=None, help='Most workers writing at a time during --nice-hours; defaults to nice_writers in config.ini, else 2.')
+@pass_context
+def serve(ctx: AppContext, root: str, log_types: List[str], interval: float, workers: int, mode: str, batch_size: int, processes: int, sync_logs: bool,
+          autotune: bool, nice_hours: str, nice_writers: int):
+    """
+    Run as a daemon that ingests new and appended log files as they are synced.
+
+    Each log type has a lane ingesting its files one at a time, sharing one connection pool
+    and the ingest ledger. Stop it with SIGTERM or Ctrl-C; lanes finish their current file first.
+    """
+    if processes and mode.lower() != 'copy':
+        print("Parsing in processes requires --mode copy.")
+        return
+
+    from daemon import IngestDaemon, IngestLane
+    from ledger import IngestLedger
+    ledger = IngestLedger(ledger_path)
+    log_types = list(dict.fromkeys(log_type.lower() for log_type in log_types))
+    tuner = ctx.create_tuner(len(log_types) * workers, batch_size, nice_hours, nice_writers) if autotune else None
+    lanes = {}
+    for log_type in log_types:
+        # Filters are megabytes: rewriting them after every file would cost more than ingesting small appends.
+        parser = ctx.create_ingest_parser(log_type, ledger, ctx.dedup_config.getfloat('save_interval', 300))
+        lanes[log_type] = IngestLane(parser, workers, mode.lower(), batch_size, processes, tuner)
+    if len(lanes) * workers > ctx.db_manager.pool.max_conns:
+        print(f"Note: {len(lanes) * workers} workers share {ctx.db_manager.pool.max_conns} database connections; raise maxconns in config.ini to avoid waiting.")
+
+    if ctx.metrics_port:
+        metrics.registry.serve(ctx.metrics_port)
+    syncer = ctx.create_syncer() if sync_logs else None
+    IngestDaemon(root, lanes, interval, ctx.export_metrics, syncer).serve()
+    if tuner:
+        print(tuner)
+    ctx.print_pool_stats()
 
 if __name__ == "__main__":
     cli()
@@ -0,0 +1,255 @@
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import TYPE_CHECKING, Dict, Iterator, List, Tuple
+
+import applog
+
+if TYPE_CHECKING:
+    from http.server import ThreadingHTTPServer
+
+# Upper bounds in seconds of the buckets of the stage duration histograms.
+STAGE_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = '') -> str:
+    pairs = [f'{name}="{value}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+def format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+class Counter:
+    """
+        A monotonically increasing count, one per combination of label values.
+    """
+    kind = 'counter'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def inc(self, *labels: str, amount: float = 1) -> None:
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def value(self, *labels: str) -> float:
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def total(self) -> float:
+        """Returns the sum over all label values."""
+        with self.lock:
+            return sum(self.values.values())
+
+    def take(self) -> Dict:
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values: Dict) -> None:
+        with self.lock:
+            for labels, value in values.items():
+                self.values[labels] = self.values.get(labels, 0) + value
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}" for labels, value in sorted(values.items())]
+
+class Histogram:
+    """
+        Counts of observed durations in cumulative buckets, with their sum, one per combination of label values.
+    """
+    kind = 'histogram'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = STAGE_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(buckets) + (float('inf'),)
+        # Per label values: count of each bucket (not cumulative), then the sum of the observations.
+        self.values: Dict[Tuple[str, ...], List[float]] = {}
+        self.lock = threading.Lock()
+
+    def observe(self, value: float, *labels: str) -> None:
+        index = next(i for i, bound in enumerate(self.buckets) if value <= bound)
+        with self.lock:
+            counts = self.values.get(labels)
+            if counts is None:
+                counts = self.values[labels] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            counts[-1] += value
+
+    @contextmanager
+    def time(self, *labels: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, *labels)
+
+    def summary(self, *labels: str) -> Tuple[int, float]:
+        """Returns the number and the sum of the observations so far."""
+        with self.lock:
+            counts = self.values.get(labels)
+            return (sum(counts[:-1]), counts[-1]) if counts else (0, 0.0)
+
+    def take(self) -> Dict:
+        with self.lock:
+            values, self.values = self.values, {}
+        return values
+
+    def merge(self, values: Dict) -> None:
+        with self.lock:
+            for labels, counts in values.items():
+                current = self.values.setdefault(labels, [0] * (len(self.buckets) + 1))
+                for i, count in enumerate(counts):
+                    current[i] += count
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = {labels: list(counts) for labels, counts in self.values.items()}
+        lines = []
+        for labels, counts in sorted(values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                le = f'le="{format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{format_labels(self.labels, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(self.labels, labels)} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{format_labels(self.labels, labels)} {cumulative}")
+        return lines
+
+class Gauge:
+    """
+        A value that goes up and down, one per combination of label values. Only the parent
+        process sets gauges, so worker processes have nothing to hand over.
+    """
+    kind = 'gauge'
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[Tuple[str, ...], float] = {}
+        self.lock = threading.Lock()
+
+    def set(self, value: float, *labels: str) -> None:
+        with self.lock:
+            self.values[labels] = value
+
+    def value(self, *labels: str) -> float:
+        with self.lock:
+            return self.values.get(labels, 0)
+
+    def take(self) -> Dict:
+        return {}
+
+    def merge(self, values: Dict) -> None:
+        with self.lock:
+            self.values.update(values)
+
+    def render(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        return [f"{self.name}{format_labels(self.labels, labels)} {format_value(value)}" for labels, value in sorted(values.items())]
+
+class MetricsRegistry:
+    """
+        The metrics of the process, rendered in the Prometheus text exposition format.
+
+        Parse worker processes count into their own copy of the registry; `take` hands their
+        counts over with each batch and the parent process adds them up with `merge`.
+    """
+    def __init__(self):
+        self.metrics: Dict[str, object] = {}
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, help, labels))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = STAGE_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, labels, buckets))
+
+    def reset(self) -> None:
+        self.take()
+
+    def take(self) -> Dict[str, Dict]:
+        """Returns the counts recorded since the last call and starts counting from zero."""
+        return {name: values for name, values in ((name, metric.take()) for name, metric in self.metrics.items()) if values}
+
+    def merge(self, counts: Dict[str, Dict]) -> None:
+        for name, values in counts.items():
+            self.metrics[name].merge(values)
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+    def write_textfile(self, file_path: str) -> None:
+        """Writes the metrics to a file atomically, for node_exporter's textfile collector or monit to read."""
+        os.makedirs(os.path.dirname(os.path.abspath(file_path)), exist_ok=True)
+        temp_path = f"{file_path}.tmp"
+        with open(temp_path, 'w') as file:
+            file.write(self.render())
+        os.replace(temp_path, file_path)
+
+    def serve(self, port: int, host: str = '127.0.0.1') -> "ThreadingHTTPServer":
+        """Serves the metrics at http://host:port/metrics from a background thread."""
+        # Imported here: only the service serves metrics, and http.server is slow to import.
+        from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] not in ('/', '/metrics'):
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+        applog.logger.info(f"Serving metrics at http://{host}:{server.server_address[1]}/metrics.")
+        return server
+
+registry = MetricsRegistry()
+
+LINES_READ = registry.counter('aggregator_lines_read_total', 'Log lines read from log files.', ('log_type',))
+BYTES_READ = registry.counter('aggregator_bytes_read_total', 'Bytes of log data read, after decompression.', ('log_type',))
+PARSE_FAILURES = registry.counter('aggregator_parse_failures_total', 'Log lines rejected by the parser.', ('log_type',))
+ROWS_INSERTED = registry.counter('aggregator_rows_inserted_total', 'Rows inserted into a table.', ('table',))
+ROWS_CONFLICTED = registry.counter('aggregator_rows_conflicted_total', 'Rows dropped by ON CONFLICT DO NOTHING as already present.', ('table',))
+ROWS_DEDUPLICATED = registry.counter('aggregator_rows_deduplicated_total', 'Rows dropped before COPY because the dedup filters and the table already had them.', ('table',))
+ROWS_FAILED = registry.counter('aggregator_rows_failed_total', 'Rows the database refused, even when inserted one at a time.', ('table',))
+STAGE_SECONDS = registry.histogram('aggregator_stage_seconds', 'Duration of ingest stages: sync of a proxy, parse of a batch, checkout of a connection and commit of a transaction.', ('stage',))
+SYNC_BYTES = registry.counter('aggregator_sync_bytes_total', 'Bytes rsync transferred from a proxy.', ('server',))
+SYNC_FILES = registry.counter('aggregator_sync_files_total', 'Log files rsync created or appended to.', ('server',))
+SYNC_FAILURES = registry.counter('aggregator_sync_failures_total', 'Syncs of a proxy in which an rsync failed.', ('server',))
+DICTIONARY_LOOKUPS = registry.counter('aggregator_dictionary_lookups_total', 'Distinct values of a batch looked up in a dictionary, by whether their id was cached.', ('table', 'result'))
+ENRICHMENT_LOOKUPS = registry.counter('aggregator_enrichment_lookups_total', 'Values an enrichment function was applied to, by whether its result was cached.', ('log_type', 'column', 'result'))
+ENRICHMENT_MISMATCHES = registry.counter('aggregator_enrichment_mismatches_total', 'Logged values that differ from the value enrichment derives, for columns it verifies.', ('column',))
+AUTOTUNE_WRITERS = registry.gauge('aggregator_autotune_writers', 'Writers the ingest autotuner lets insert batches at a time.')
+AUTOTUNE_BATCH_SIZE = registry.gauge('aggregator_autotune_batch_size', 'Log lines per batch the ingest autotuner reads.')
+AUTOTUNE_ADJUSTMENTS = registry.counter('aggregator_autotune_adjustments_total', 'Changes the ingest autotuner made, by direction and reason.', ('direction', 'reason'))
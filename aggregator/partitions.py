@@ -0,0 +1,155 @@
+import threading
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from database import DatabaseConnectionPool, TableColumn
+import applog
+
+GRANULARITIES = ('daily', 'monthly')
+NAME_FORMATS = {'daily': '%Y%m%d', 'monthly': '%Y%m'}
+
+def period_start(value: date, granularity: str) -> date:
+    if granularity == 'daily':
+        return date(value.year, value.month, value.day)
+    return date(value.year, value.month, 1)
+
+def period_end(start: date, granularity: str) -> date:
+    if granularity == 'daily':
+        return start + timedelta(days=1)
+    return date(start.year + start.month // 12, start.month % 12 + 1, 1)
+
+class PartitionManager:
+    """
+        Keeps a log table range-partitioned on its timestamp column.
+
+        Partitions are named `{table}_pYYYYMMDD` (daily) or `{table}_pYYYYMM` (monthly)
+        and are created on demand, each in its own short transaction, before a batch
+        touching them is inserted. Rows without a timestamp go to `{table}_default`.
+        Expiring a partition drops or detaches it as a whole instead of deleting rows.
+    """
+    def __init__(self, database: DatabaseConnectionPool, table: str, column: str, granularity: str):
+        if granularity not in GRANULARITIES:
+            raise ValueError(f"Partition granularity must be one of {', '.join(GRANULARITIES)}, not '{granularity}'.")
+        self.database = database
+        self.table = table
+        self.column = column
+        self.granularity = granularity
+        self.known: Set[date] = set()
+        self.lock = threading.Lock()
+
+    def __getstate__(self) -> Dict:
+        # Parse worker processes only compute the periods of a batch.
+        state = self.__dict__.copy()
+        state['database'] = None
+        state['lock'] = None
+        return state
+
+    @classmethod
+    def load(cls, database: DatabaseConnectionPool, table: str) -> Optional["PartitionManager"]:
+        """Returns the manager of a partitioned table, or None if the table is not partitioned."""
+        query = """
+        SELECT a.attname, obj_description(c.oid, 'pg_class')
+        FROM pg_partitioned_table p
+        JOIN pg_class c ON c.oid = p.partrelid
+        JOIN pg_attribute a ON a.attrelid = c.oid AND a.attnum = p.partattrs[0]
+        WHERE c.relname = %s
+        """
+        result = database.execute_command(query, (table,))
+        if not result:
+            return None
+        column, comment = result[0]
+        granularity = (comment or '').partition('partition=')[2] or 'daily'
+        manager = cls(database, table, column, granularity)
+        manager.known = {start for _, start, _ in manager.list_partitions()}
+        applog.logger.debug(f"Table {table} is partitioned {granularity} on {column} with {len(manager.known)} partitions.")
+        return manager
+
+    def partition_name(self, start: date) -> str:
+        return f"{self.table}_p{start.strftime(NAME_FORMATS[self.granularity])}"
+
+    def create_table(self, schema: List[TableColumn]) -> None:
+        """Creates the partitioned table; the partition column is added to the primary key."""
+        if self.column not in [col.name for col in schema]:
+            raise ValueError(f"Partition column '{self.column}' is not a column of {self.table}.")
+        primary = [col.name for col in schema if col.isPrimary]
+        columns = [str(TableColumn(col.name, col.datatype, col.isArray)) for col in schema]
+        if primary:
+            columns.append(f"PRIMARY KEY ({', '.join(primary + [self.column] if self.column not in primary else primary)})")
+        self.database.execute_command(f"CREATE TABLE {self.table} ({', '.join(columns)}) PARTITION BY RANGE ({self.column});")
+        self.database.execute_command(f"COMMENT ON TABLE {self.table} IS 'partition={self.granularity}';")
+        self.database.execute_command(f"CREATE TABLE {self.table}_default PARTITION OF {self.table} DEFAULT;")
+        applog.logger.debug(f"Table {self.table} created with {self.granularity} partitions on {self.column}.")
+
+    def periods(self, values: Iterable[datetime]) -> Set[date]:
+        """Returns the start of every partition period the timestamps fall into."""
+        days = {value.date() for value in values if value is not None}
+        return {period_start(day, self.granularity) for day in days}
+
+    def ensure(self, starts: Iterable[date]) -> None:
+        """Creates the partitions starting at `starts` that do not exist yet."""
+        missing = set(starts) - self.known
+        if not missing:
+            return
+        with self.lock:
+            for start in sorted(missing - self.known):
+                end = period_end(start, self.granularity)
+                name = self.partition_name(start)
+                try:
+                    self.database.execute_command(
+                        f"CREATE TABLE IF NOT EXISTS {name} PARTITION OF {self.table} FOR VALUES FROM ('{start}') TO ('{end}');")
+                    applog.logger.debug(f"Partition {name} created.")
+                except Exception as e:
+                    # Another ingest may have created it, or rows of this period already sit in the
+                    # default partition; either way the rows still have a partition to go to.
+                    applog.logger.warning(f"Could not create partition {name}: {e}")
+                self.known.add(start)
+
+    def list_partitions(self) -> List[Tuple[str, date, date]]:
+        """Returns the name and [start, end) range of every period partition, oldest first."""
+        query = """
+        SELECT child.relname
+        FROM pg_inherits
+        JOIN pg_class parent ON parent.oid = pg_inherits.inhparent
+        JOIN pg_class child ON child.oid = pg_inherits.inhrelid
+        WHERE parent.relname = %s
+        """
+        partitions = []
+        prefix = f"{self.table}_p"
+        for (name,) in self.database.execute_command(query, (self.table,)):
+            if not name.startswith(prefix):
+                continue
+            try:
+                start = datetime.strptime(name[len(prefix):], NAME_FORMATS[self.granularity]).date()
+            except ValueError:
+                continue
+            partitions.append((name, start, period_end(start, self.granularity)))
+        return sorted(partitions, key=lambda partition: partition[1])
+
+    def create_index(self, column: TableColumn) -> None:
+        """
+            Builds an index on every partition concurrently, then attaches them to an index on
+            the partitioned table, which becomes valid once all partitions have theirs.
+        """
+        parent_index = self.database.create_index(self.table, column, only=True)
+        for name in [f"{self.table}_default"] + [name for name, _, _ in self.list_partitions()]:
+            partition_index = self.database.create_index(name, column, concurrently=True)
+            self.database.attach_index(parent_index, partition_index)
+
+    def expire(self, days: int, detach: bool = False) -> List[str]:
+        """
+            Drops, or only detaches, the partitions whose whole period is older than `days` days.
+            Detached partitions remain as ordinary tables for archiving.
+        """
+        cutoff = date.today() - timedelta(days=days)
+        expired = []
+        for name, start, end in self.list_partitions():
+            if end > cutoff:
+                continue
+            if detach:
+                self.database.execute_command(f"ALTER TABLE {self.table} DETACH PARTITION {name};")
+            else:
+                self.database.execute_command(f"DROP TABLE {name};")
+            self.known.discard(start)
+            expired.append(name)
+            applog.logger.debug(f"Partition {name} {'detached' if detach else 'dropped'}.")
+        return expired
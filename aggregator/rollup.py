@@ -0,0 +1,167 @@
+from typing import List, Tuple
+import xml.etree.ElementTree as ET
+
+from database import DatabaseConnectionPool, TableColumn
+import applog
+
+GRAINS = ('minute', 'hour', 'day')
+FUNCTIONS = ('count', 'sum', 'min', 'max')
+
+# How the measure of a rollup row is combined with the measure of newly inserted rows.
+MERGE_EXPRESSIONS = {
+    'count': '{table}.{name} + EXCLUDED.{name}',
+    'sum': 'COALESCE({table}.{name}, 0) + COALESCE(EXCLUDED.{name}, 0)',
+    'min': 'LEAST({table}.{name}, EXCLUDED.{name})',
+    'max': 'GREATEST({table}.{name}, EXCLUDED.{name})',
+}
+
+# Dimension values stored instead of NULL, which a primary key cannot hold.
+MISSING_VALUES = {'TEXT': "'-'", 'INTEGER': '-1'}
+
+class RollupMeasure:
+    """
+        An aggregate of a rollup: count of rows, or sum, min or max of a column.
+    """
+    def __init__(self, name: str, function: str, column: TableColumn = None):
+        self.name = name
+        self.function = function
+        self.column = column
+
+    @property
+    def datatype(self) -> str:
+        if self.function == 'count' or (self.function == 'sum' and self.column.datatype == 'INTEGER'):
+            return 'BIGINT'
+        if self.function == 'sum':
+            return 'DOUBLE PRECISION'
+        return self.column.datatype
+
+    def __repr__(self) -> str:
+        return f"{self.name} {self.function}({self.column.name if self.column else '*'})"
+
+class Rollup:
+    """
+        Pre-aggregated summary of a log table per time bucket and dimension values.
+
+        A rollup is kept in one table per grain, `{table}_{name}_{grain}`, and is updated by
+        the statement that inserts a batch of rows: the rows it inserted are aggregated and
+        merged into every grain table in the same transaction (see `merge_statements`).
+        Array dimensions are unnested, so a row counts once for each of its values.
+    """
+    def __init__(self, table: str, name: str, time_column: TableColumn, dimensions: List[TableColumn], measures: List[RollupMeasure], grains: List[str]):
+        self.table = table
+        self.name = name
+        self.time_column = time_column
+        self.dimensions = dimensions
+        self.measures = measures
+        self.grains = grains
+
+    @classmethod
+    def from_element(cls, element: ET.Element, table: str, schema: List[TableColumn]) -> "Rollup":
+        """Builds a rollup from a <rollup> element of log_structure.xml."""
+        columns = {col.name: col for col in schema}
+        name = element.get('name')
+
+        def column(column_name: str) -> TableColumn:
+            if column_name not in columns:
+                raise ValueError(f"Rollup '{name}' refers to unknown column '{column_name}'.")
+            return columns[column_name]
+
+        time_column = column(element.get('time'))
+        if time_column.datatype != 'TIMESTAMP':
+            raise ValueError(f"Rollup '{name}' needs a TIMESTAMP time column, not '{time_column.name}'.")
+        grains = [grain.strip() for grain in element.get('grains', ','.join(GRAINS)).split(',')]
+        for grain in grains:
+            if grain not in GRAINS:
+                raise ValueError(f"Rollup '{name}' has unknown grain '{grain}'; expected one of {', '.join(GRAINS)}.")
+
+        dimensions = []
+        for dimension in element.findall('dimension'):
+            col = column(dimension.get('column'))
+            if col.datatype not in MISSING_VALUES:
+                raise ValueError(f"Rollup '{name}' cannot group by {col.datatype} column '{col.name}'.")
+            dimensions.append(col)
+
+        measures = []
+        for measure in element.findall('measure'):
+            function = measure.get('function')
+            if function not in FUNCTIONS:
+                raise ValueError(f"Rollup '{name}' has unknown function '{function}'; expected one of {', '.join(FUNCTIONS)}.")
+            col = column(measure.get('column')) if function != 'count' else None
+            measures.append(RollupMeasure(measure.get('name'), function, col))
+        return cls(table, name, time_column, dimensions, measures, grains)
+
+    def table_name(self, grain: str) -> str:
+        return f"{self.table}_{self.name}_{grain}"
+
+    def source_columns(self) -> List[str]:
+        """Columns of the log table the rollup is computed from."""
+        names = [self.time_column.name] + [col.name for col in self.dimensions]
+        names += [measure.column.name for measure in self.measures if measure.column]
+        return list(dict.fromkeys(names))
+
+    def create_tables(self, database: DatabaseConnectionPool) -> None:
+        for grain in self.grains:
+            columns = ['bucket TIMESTAMP NOT NULL']
+            columns += [f"{col.name} {col.datatype} NOT NULL" for col in self.dimensions]
+            columns += [f"{measure.name} {measure.datatype}" for measure in self.measures]
+            key = ', '.join(['bucket'] + [col.name for col in self.dimensions])
+            database.execute_command(f"CREATE TABLE IF NOT EXISTS {self.table_name(grain)} ({', '.join(columns)}, PRIMARY KEY ({key}));")
+            applog.logger.debug(f"Rollup table {self.table_name(grain)} created successfully.")
+
+    def aggregate_query(self, grain: str, source: str) -> str:
+        """Aggregates the rows of `source` into rows of the grain table."""
+        selected = [f"date_trunc('{grain}', {self.time_column.name}) AS bucket"]
+        for col in self.dimensions:
+            # Rows with no array values are kept under the missing value rather than dropped by unnest.
+            value = f"unnest(COALESCE(NULLIF({col.name}, '{{}}'), ARRAY[NULL]::{col.datatype}[]))" if col.isArray else col.name
+            selected.append(f"{value} AS {col.name}")
+        dimension_names = [col.name for col in self.dimensions]
+        selected += list(dict.fromkeys(measure.column.name for measure in self.measures if measure.column and measure.column.name not in dimension_names))
+
+        keys = ['bucket'] + [f"COALESCE({col.name}, {MISSING_VALUES[col.datatype]})" for col in self.dimensions]
+        aggregates = [f"count(*)" if measure.function == 'count' else f"{measure.function}({measure.column.name})" for measure in self.measures]
+        positions = ', '.join(str(i + 1) for i in range(len(keys)))
+        return (f"SELECT {', '.join(keys + aggregates)} "
+                f"FROM (SELECT {', '.join(selected)} FROM {source} WHERE {self.time_column.name} IS NOT NULL) batch "
+                f"GROUP BY {positions} ORDER BY {positions}")
+
+    def merge_query(self, grain: str, source: str) -> str:
+        """
+            Merges the aggregates of `source` into the grain table. Rows are merged in key order
+            so that concurrent writers lock the rows they share in the same order.
+        """
+        table = self.table_name(grain)
+        columns = ['bucket'] + [col.name for col in self.dimensions] + [measure.name for measure in self.measures]
+        key = ', '.join(['bucket'] + [col.name for col in self.dimensions])
+        updates = ', '.join(f"{measure.name} = {MERGE_EXPRESSIONS[measure.function].format(table=table, name=measure.name)}" for measure in self.measures)
+        return (f"INSERT INTO {table} ({', '.join(columns)}) {self.aggregate_query(grain, source)} "
+                f"ON CONFLICT ({key}) DO UPDATE SET {updates}")
+
+    def merge_statements(self, source: str) -> List[str]:
+        """Named data-modifying CTEs merging the rows of `source` into every grain table."""
+        return [f"{self.table_name(grain)}_merge AS ({self.merge_query(grain, source)})" for grain in self.grains]
+
+    def rebuild(self, database: DatabaseConnectionPool) -> None:
+        """Recomputes the grain tables from the whole log table, e.g. after the rollup was added."""
+        for grain in self.grains:
+            database.execute_command(f"TRUNCATE {self.table_name(grain)}")
+            database.execute_command(self.merge_query(grain, self.table))
+            applog.logger.debug(f"Rollup table {self.table_name(grain)} rebuilt.")
+
+    def exists(self, database: DatabaseConnectionPool) -> bool:
+        tables = [self.table_name(grain) for grain in self.grains]
+        result = database.execute_command("SELECT count(to_regclass(name)) FROM unnest(%s) AS name", (tables,))
+        return result[0][0] == len(tables)
+
+    def __repr__(self) -> str:
+        return f"Rollup {self.name} of {self.table} by {', '.join(col.name for col in self.dimensions) or 'time'} per {', '.join(self.grains)}: {self.measures}"
+
+def merge_hook(rollups: List, source: str = 'inserted') -> Tuple[List[str], List[str]]:
+    """
+        Returns the columns the insert of a batch must return and the CTEs merging them, read from
+        `source`, into the rollups, or anything else with `source_columns` and `merge_statements`
+        such as chart datasets.
+    """
+    returning = list(dict.fromkeys(name for rollup in rollups for name in rollup.source_columns()))
+    statements = [statement for rollup in rollups for statement in rollup.merge_statements(source)]
+    return returning, statements
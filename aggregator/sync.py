@@ -0,0 +1,121 @@
+import os
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, List, Tuple
+
+import applog
+import metrics
+
+SYNC_LOG_TYPES = ('extended', 'performance', 'csp')
+
+class SyncResult:
+    """
+        Outcome of syncing the logs of one proxy: the local files rsync created or appended
+        to, as (log type, path) pairs, the bytes transferred and the log types that failed.
+    """
+    def __init__(self, server: str):
+        self.server = server
+        self.files: List[Tuple[str, str]] = []
+        self.bytes = 0
+        self.seconds = 0.0
+        self.errors: List[str] = []
+
+    def __repr__(self) -> str:
+        status = f"failed: {'; '.join(self.errors)}" if self.errors else "ok"
+        return f"{self.server}: {len(self.files)} files, {self.bytes} bytes in {self.seconds:.1f}s, {status}"
+
+
+class LogSync:
+    """
+        Pulls the logs of every proxy in servers.list with rsync over ssh, as sync.sh does,
+        but syncs up to `concurrency` proxies at a time.
+
+        The log types of a proxy are synced one after the other over a single ssh connection
+        kept open by an ssh ControlMaster, so only the first rsync pays for the handshake.
+        rsync reports every file it received, so ingest is handed exactly the files that changed.
+    """
+    def __init__(self, servers: List[str], destination: str, ssh_key: str, user: str = 'root', concurrency: int = 8,
+                 timeout: float = 600, control_dir: str = '/run/aggregator', log_types: Tuple[str, ...] = SYNC_LOG_TYPES):
+        self.servers = servers
+        self.destination = destination
+        self.ssh_key = ssh_key
+        self.user = user
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.control_dir = control_dir
+        self.log_types = log_types
+
+    @staticmethod
+    def read_servers(file_path: str) -> List[str]:
+        """Reads servers.list: one proxy per line, '#' starts a comment, 'localhost' uses local logs."""
+        servers = []
+        with open(file_path) as file:
+            for line in file:
+                server = line.split('#', 1)[0].strip()
+                if server and server != 'localhost' and server not in servers:
+                    servers.append(server)
+        return servers
+
+    def ssh_command(self) -> str:
+        # %C is a hash of the connection parameters, which keeps the socket path short.
+        return (f"ssh -i {self.ssh_key} -o BatchMode=yes -o ControlMaster=auto "
+                f"-o ControlPath={self.control_dir}/ssh-%C -o ControlPersist=120")
+
+    def rsync_command(self, server: str, log_type: str, target: str) -> List[str]:
+        return ['rsync', '--append', '--compress', '--times', '--archive', '--recursive', '--no-links',
+                f"--include=*{log_type}.log", f"--log-file={target}/.journal", f"--timeout={int(self.timeout)}",
+                # One line per item: change flags, bytes transferred and the name.
+                '--out-format=%i %b %n',
+                '-e', self.ssh_command(), f"{self.user}@{server}:{log_type}/", target]
+
+    def sync_server(self, server: str) -> SyncResult:
+        result = SyncResult(server)
+        start = time.perf_counter()
+        for log_type in self.log_types:
+            target = os.path.join(self.destination, server, log_type)
+            os.makedirs(target, exist_ok=True)
+            try:
+                process = subprocess.run(self.rsync_command(server, log_type, target), capture_output=True, text=True, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                result.errors.append(f"{log_type}: timed out after {self.timeout}s")
+                continue
+            for line in process.stdout.splitlines():
+                flags, _, rest = line.partition(' ')
+                transferred, _, name = rest.partition(' ')
+                # '>f' is a regular file received from the proxy.
+                if flags.startswith('>f') and transferred.isdigit():
+                    result.files.append((log_type, os.path.join(target, name)))
+                    result.bytes += int(transferred)
+            if process.returncode != 0:
+                error = process.stderr.strip().splitlines()
+                result.errors.append(f"{log_type}: rsync exited with {process.returncode}{f': {error[-1]}' if error else ''}")
+                if process.returncode == 255:
+                    # ssh could not reach the proxy; its other log types would fail the same way.
+                    break
+        result.seconds = time.perf_counter() - start
+        return result
+
+    def sync(self, on_result: Callable[[SyncResult], None] = None) -> List[SyncResult]:
+        """
+            Syncs all proxies and returns their results. `on_result` is called as each proxy
+            finishes, so its files can be ingested while slower proxies are still syncing.
+        """
+        os.makedirs(self.control_dir, exist_ok=True)
+        results = []
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            futures = [executor.submit(self.sync_server, server) for server in self.servers]
+            for future in as_completed(futures):
+                result = future.result()
+                metrics.SYNC_BYTES.inc(result.server, amount=result.bytes)
+                metrics.SYNC_FILES.inc(result.server, amount=len(result.files))
+                metrics.STAGE_SECONDS.observe(result.seconds, 'sync')
+                if result.errors:
+                    metrics.SYNC_FAILURES.inc(result.server)
+                    applog.logger.warning(f"Sync of {result}")
+                else:
+                    applog.logger.info(f"Sync of {result}")
+                if on_result:
+                    on_result(result)
+                results.append(result)
+        return results
@@ -0,0 +1,180 @@
+"""Synthetic SafeSquid log generator.
+
+Writes extended, performance or CSP logs laid out as the columns of the log type
+in log_structure.xml, as plain or gzip files. Values follow the shape of real
+proxy traffic: a few hundred users and hosts with a skewed popularity, mostly
+successful responses, several requests per second sharing timestamps and one to
+three values in the array columns. CSP logs are written as JSON reports.
+
+Usage:
+    python3 benchmarks/loggen.py extended /tmp/extended.log [--lines 200000] [--gzip] [--seed 0]
+"""
+
+import gzip
+import json
+import os
+import random
+import sys
+import time
+from typing import Callable, Dict, Iterator
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aggregator'))
+
+from log_parser import LogParser, LogColumn
+
+log_structure_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aggregator', 'log_structure.xml')
+
+START_EPOCH = 1717430400
+HOSTS = [f"{name}.{tld}" for name in ('www.google', 'mail.google', 'cdn.jsdelivr', 'api.github', 'www.youtube', 'static.xx.fbcdn',
+                                      'login.microsoftonline', 'update.microsoft', 'www.wikipedia', 'news.ycombinator')
+         for tld in ('com', 'net', 'org')]
+TLDS = ('com', 'net', 'org', 'io', 'in')
+STATUSES = (200,) * 14 + (204, 206, 301, 302, 304, 304, 403, 404, 500, 502)
+METHODS = ('GET',) * 8 + ('POST', 'CONNECT')
+MIMES = ('text/html', 'application/json', 'image/png', 'image/jpeg', 'application/javascript', 'text/css', 'video/mp4', '-')
+AGENTS = ('Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/126.0 Safari/537.36',
+          'Mozilla/5.0 (X11; Linux x86_64; rv:127.0) Gecko/20100101 Firefox/127.0',
+          'Microsoft-CryptoAPI/10.0', 'curl/8.5.0')
+ARRAY_VALUES = {
+    'categories': ('search_engines', 'social_networking', 'news', 'webmail', 'software_updates', 'streaming_media', 'adult', 'malware'),
+    'user_groups': ('staff', 'engineering', 'sales', 'guests', 'admins'),
+    'time_profiles': ('working_hours', 'lunch', 'after_hours'),
+}
+
+
+def skewed(rng: random.Random, count: int) -> int:
+    """Index in [0, count) where low indexes are much more frequent, as for users and hosts."""
+    return min(int(rng.paretovariate(1.2)) - 1, count - 1)
+
+
+def timestamp(column: LogColumn, index: int) -> str:
+    # Proxies log many requests per second, so consecutive lines share timestamps.
+    epoch = START_EPOCH + index // 20
+    if column.data_format == "DD/Mon/YYYY:HH24:MI:SS":
+        return time.strftime('%d/%b/%Y:%H:%M:%S', time.gmtime(epoch))
+    if column.data_format == "YYYYMMDDHH24MISS":
+        return time.strftime('%Y%m%d%H%M%S', time.gmtime(epoch))
+    return str(epoch)
+
+
+# Generators of extended log fields by column name, given the random source, the line
+# index and the host of the request, which the url and host columns must agree on.
+EXTENDED_FIELDS: Dict[str, Callable[[random.Random, int, str], str]] = {
+    'record_id': lambda rng, index, host: f"{index:016x}",
+    'client_id': lambda rng, index, host: str(skewed(rng, 500)),
+    'request_id': lambda rng, index, host: str(index),
+    'elapsed_time': lambda rng, index, host: str(int(rng.expovariate(1 / 150))),
+    'status': lambda rng, index, host: str(rng.choice(STATUSES)),
+    'size': lambda rng, index, host: str(int(rng.lognormvariate(8, 2))),
+    'upload': lambda rng, index, host: str(int(rng.lognormvariate(6, 1.5))),
+    'download': lambda rng, index, host: str(int(rng.lognormvariate(9, 2.5))),
+    'bypassed': lambda rng, index, host: 'true' if rng.random() < 0.05 else 'false',
+    'client_ip': lambda rng, index, host: f"10.0.{skewed(rng, 4)}.{skewed(rng, 250) + 1}",
+    'username': lambda rng, index, host: f"user{skewed(rng, 300)}" if rng.random() < 0.9 else '-',
+    'method': lambda rng, index, host: rng.choice(METHODS),
+    'url': lambda rng, index, host: f"https://{host}/{'/'.join(str(rng.randrange(1000)) for _ in range(rng.randint(1, 4)))}",
+    'http_referer': lambda rng, index, host: f"https://{HOSTS[skewed(rng, len(HOSTS))]}/" if rng.random() < 0.6 else '-',
+    'useragent': lambda rng, index, host: rng.choice(AGENTS),
+    'mime': lambda rng, index, host: rng.choice(MIMES),
+    'request_host': lambda rng, index, host: host,
+    'request_tld': lambda rng, index, host: host.rsplit('.', 1)[-1],
+    'referer_host': lambda rng, index, host: HOSTS[skewed(rng, len(HOSTS))] if rng.random() < 0.6 else '-',
+    'referer_tld': lambda rng, index, host: rng.choice(TLDS),
+}
+
+
+def extended_field(column: LogColumn) -> Callable[[random.Random, int, str], str]:
+    """Returns the generator of an extended log column."""
+    if column.name in EXTENDED_FIELDS:
+        return EXTENDED_FIELDS[column.name]
+    if column.isArray:
+        values = ARRAY_VALUES.get(column.name, tuple(f"{column.name}_{i}" for i in range(6)))
+        return lambda rng, index, host: ','.join(rng.sample(values, rng.randint(1, 3)))
+    if column.datatype == "TIMESTAMP":
+        return lambda rng, index, host: timestamp(column, index)
+    return lambda rng, index, host: '-' if rng.random() < 0.5 else f"{column.name}_{rng.randrange(5)}"
+
+
+def performance_field(column: LogColumn, rng: random.Random, index: int) -> str:
+    # Performance logs are one sample per second; counters grow and deltas stay small.
+    if column.datatype == "TIMESTAMP":
+        epoch = START_EPOCH + index
+        return time.strftime('%Y%m%d%H%M%S', time.gmtime(epoch)) if column.data_format else str(epoch)
+    if column.datatype == "FLOAT":
+        return f"{rng.uniform(0, 8):.2f}"
+    if column.name.endswith('_delta'):
+        return str(int(rng.expovariate(1 / 50)))
+    if column.name.endswith('_kbytes'):
+        return str(4_000_000 + rng.randrange(1_000_000))
+    return str(index * 3 + rng.randrange(100))
+
+
+def csp_report(rng: random.Random, index: int) -> str:
+    host = HOSTS[skewed(rng, len(HOSTS))]
+    directive = rng.choice(('script-src', 'style-src', 'img-src', 'connect-src', 'frame-src'))
+    return json.dumps({
+        'csp-report': {
+            'document-uri': f"https://{host}/{rng.randrange(100)}",
+            'referrer': '',
+            'violated-directive': directive,
+            'effective-directive': directive,
+            'original-policy': f"default-src 'self'; {directive} 'self'",
+            'disposition': 'enforce',
+            'blocked-uri': rng.choice(('inline', 'eval', f"https://{HOSTS[skewed(rng, len(HOSTS))]}/x.js")),
+            'status-code': 200,
+            'line-number': rng.randrange(500),
+            'column-number': rng.randrange(120),
+            'source-file': f"https://{host}/app.js",
+        },
+        'from': {'user': f"user{skewed(rng, 300)}", 'date': START_EPOCH + index // 5},
+        'info': {'CLIENTID': skewed(rng, 500), 'USERNAME': f"user{skewed(rng, 300)}", 'handler': 'csp'},
+    })
+
+
+def synthetic_lines(parser: LogParser, count: int, seed: int = 0) -> Iterator[str]:
+    """Yields `count` log lines of the parser's log type, with a trailing newline."""
+    rng = random.Random(seed)
+    if parser.file_type == 'json':
+        for index in range(count):
+            yield csp_report(rng, index) + '\n'
+        return
+    delimiter = '\t' if parser.file_type == 'tsv' else ','
+    if parser.log_type == 'performance':
+        for index in range(count):
+            yield delimiter.join(performance_field(column, rng, index) for column in parser.log_schema) + '\n'
+        return
+    fields = [extended_field(column) for column in parser.log_schema]
+    for index in range(count):
+        host = HOSTS[skewed(rng, len(HOSTS))]
+        yield delimiter.join(field(rng, index, host) for field in fields) + '\n'
+
+
+def write_log(log_type: str, file_path: str, count: int, seed: int = 0) -> int:
+    """Writes a synthetic log file, gzip compressed if the path ends with .gz. Returns its size in bytes."""
+    parser = LogParser(None)
+    parser.load_log_schema(log_type, log_structure_path)
+    opener = gzip.open if file_path.endswith('.gz') else open
+    with opener(file_path, 'wt') as file:
+        # A header line, as in the proxy's own logs, CSP reports included; ingest skips it.
+        file.write((',' if parser.file_type == 'csv' else '\t').join(column.name for column in parser.log_schema) + '\n')
+        file.writelines(synthetic_lines(parser, count, seed))
+    return os.path.getsize(file_path)
+
+
+@click.command()
+@click.argument('log_type', type=click.Choice(['extended', 'performance', 'csp']))
+@click.argument('output', type=click.Path(dir_okay=False))
+@click.option('--lines', 'line_count', type=click.IntRange(1), default=200000)
+@click.option('--gzip', 'compress', is_flag=True, default=False, help='Compress the output; .gz is appended to its name.')
+@click.option('--seed', type=int, default=0)
+def main(log_type: str, output: str, line_count: int, compress: bool, seed: int):
+    if compress and not output.endswith('.gz'):
+        output += '.gz'
+    size = write_log(log_type, output, line_count, seed)
+    print(f"Wrote {line_count} {log_type} lines to {output} ({size} bytes).")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,104 @@
+"""Micro-benchmark of the per-line parser against the batch parser.
+
+Compares `LogParser.parse_log_line`, called once per line, with
+`LogParser.parse_log_lines`, called once per batch, on synthetic lines built
+from the schema in log_structure.xml. The per-line parser leaves every value
+as text for PostgreSQL to convert, so it is measured both as is and followed
+by the same per-value conversions the batch parser applies. `LogParser.parse_row`
+converts one line with the row converter generated from the schema; it is the
+baseline the batch parser is measured against, with the rows of each batch kept
+as an ingest keeps them. The batch parser is measured in both its modes, column by
+column and line by line, and the faster one is the mode to declare with the parse
+attribute of the log type in log_structure.xml.
+
+Usage:
+    python3 benchmarks/parse_bench.py [--log-type extended] [--lines 200000] [--batch-size 5000]
+"""
+
+import os
+import random
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aggregator'))
+
+from log_parser import LogParser, LogColumn, column_converter
+
+log_structure_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'aggregator', 'log_structure.xml')
+
+
+def synthetic_field(column: LogColumn, rng: random.Random, index: int) -> str:
+    if column.isArray:
+        return ','.join(f"{column.name}_{rng.randrange(20)}" for _ in range(rng.randint(1, 3)))
+    if column.datatype == "INTEGER":
+        return str(rng.randrange(100000))
+    if column.datatype == "FLOAT":
+        return f"{rng.random() * 100:.2f}"
+    if column.datatype == "BOOLEAN":
+        return rng.choice(('true', 'false'))
+    if column.datatype == "TIMESTAMP":
+        # Proxies log many requests per second, so consecutive lines share timestamps.
+        epoch = 1717430400 + index // 20
+        if column.data_format == "DD/Mon/YYYY:HH24:MI:SS":
+            return time.strftime('%d/%b/%Y:%H:%M:%S', time.gmtime(epoch))
+        if column.data_format == "YYYYMMDDHH24MISS":
+            return time.strftime('%Y%m%d%H%M%S', time.gmtime(epoch))
+        return str(epoch)
+    return f"{column.name}-{rng.randrange(1000)}"
+
+
+def synthetic_lines(parser: LogParser, count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    delimiter = '\t' if parser.file_type == 'tsv' else ','
+    return [delimiter.join(synthetic_field(column, rng, index) for column in parser.log_schema) + '\n' for index in range(count)]
+
+
+@click.command()
+@click.option('--log-type', type=click.Choice(['extended', 'performance']), default='extended')
+@click.option('--lines', 'line_count', type=click.IntRange(1), default=200000)
+@click.option('--batch-size', type=click.IntRange(1), default=5000)
+def main(log_type: str, line_count: int, batch_size: int):
+    parser = LogParser(None)
+    parser.load_log_schema(log_type, log_structure_path)
+    lines = synthetic_lines(parser, line_count)
+
+    start = time.perf_counter()
+    for line in lines:
+        parser.parse_log_line(line.strip())
+    per_line = time.perf_counter() - start
+
+    convert = [converter[1] if converter else None for converter in map(column_converter, parser.log_schema)]
+    start = time.perf_counter()
+    for line in lines:
+        fields = parser.parse_log_line(line.strip())
+        tuple(f(','.join(v) if isinstance(v, list) else v) if f else v for f, v in zip(convert, fields))
+    per_line_typed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for i in range(0, len(lines), batch_size):
+        [parser.parse_row(line) for line in lines[i:i + batch_size]]
+    per_row = time.perf_counter() - start
+
+    batched = {}
+    for mode in ('columns', 'rows'):
+        parser.parse_by_row = mode == 'rows'
+        start = time.perf_counter()
+        rows = 0
+        for i in range(0, len(lines), batch_size):
+            rows += len(parser.parse_log_lines(lines[i:i + batch_size]))
+        batched[mode] = time.perf_counter() - start
+    fastest = min(batched, key=batched.get)
+
+    print(f"{log_type}: {line_count} lines, batch size {batch_size}")
+    print(f"  parse_log_line:           {per_line:.3f}s  {line_count / per_line:,.0f} lines/s (text only)")
+    print(f"  parse_log_line + convert: {per_line_typed:.3f}s  {line_count / per_line_typed:,.0f} lines/s (typed)")
+    print(f"  parse_row:                {per_row:.3f}s  {line_count / per_row:,.0f} lines/s (typed, compiled row converter)")
+    for mode, seconds in batched.items():
+        print(f"  parse_log_lines, {mode + ':':8} {seconds:.3f}s  {rows / seconds:,.0f} lines/s (typed, {per_row / seconds:.2f}x parse_row)")
+    print(f"  speedup over parse_row: {per_row / batched[fastest]:.2f}x, parsing by {fastest}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""CLI startup benchmark.
+
+Times fresh interpreter processes for the start of the common commands, the cost
+paid by every process a script spawns per log file:
+
+    import        python -c "import main"
+    help          python main.py --help
+    insert-setup  import main, create the database pool and load the extended log schema,
+                  everything `main.py insert` does before its first batch but connecting
+
+Each scenario is run `--runs` times; the JSON report gives the median and minimum
+wall times in milliseconds, the modules slowest to import with main.py
+(from `python -X importtime`) and whether the medians are within the budget.
+Exits with status 1 when a median is over budget.
+
+Usage:
+    python3 benchmarks/startup_bench.py [--runs 20] [--aggregator-dir aggregator]
+"""
+
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from typing import Dict, List
+
+import click
+
+repo_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+
+# Median wall time allowed per scenario, in milliseconds, interpreter start-up included.
+BUDGET_MS = {'import': 125, 'help': 150, 'insert-setup': 200}
+
+INSERT_SETUP = """
+import main
+from database import DatabaseConnectionPool
+from log_parser import BasicLogParser
+parser = BasicLogParser(DatabaseConnectionPool('postgres', '', '127.0.0.1', '5432', 'postgres', 20), 'extended_logs')
+parser.load_log_schema('extended', {xml!r})
+"""
+
+
+def scenarios(aggregator_dir: str) -> Dict[str, List[str]]:
+    xml = os.path.join(aggregator_dir, 'log_structure.xml')
+    return {
+        'import': [sys.executable, '-c', 'import main'],
+        'help': [sys.executable, os.path.join(aggregator_dir, 'main.py'), '--help'],
+        'insert-setup': [sys.executable, '-c', INSERT_SETUP.format(xml=xml)],
+    }
+
+
+def time_command(command: List[str], cwd: str, runs: int) -> List[float]:
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        process = subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        times.append((time.perf_counter() - start) * 1000)
+        if process.returncode != 0:
+            raise RuntimeError(process.stderr.strip().splitlines()[-1] if process.stderr.strip() else f"exit status {process.returncode}")
+    return times
+
+
+def slowest_imports(command: List[str], cwd: str, count: int) -> List[Dict]:
+    """Parses `-X importtime` output into the modules with the largest self time."""
+    stderr = subprocess.run([command[0], '-X', 'importtime'] + command[1:], cwd=cwd, check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True).stderr
+    modules = []
+    for line in stderr.splitlines():
+        if not line.startswith('import time:') or 'self [us]' in line:
+            continue
+        own, cumulative, name = line[len('import time:'):].split('|')
+        modules.append({'module': name.strip(), 'self_ms': round(int(own) / 1000, 2), 'cumulative_ms': round(int(cumulative) / 1000, 2)})
+    return sorted(modules, key=lambda module: module['self_ms'], reverse=True)[:count]
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(['git', '-C', repo_dir, 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--runs', type=click.IntRange(1), default=20)
+@click.option('--aggregator-dir', type=click.Path(exists=True, file_okay=False), default=os.path.join(repo_dir, 'aggregator'))
+@click.option('--top', type=click.IntRange(0), default=10, help='Number of slowest imports to report.')
+def main(runs: int, aggregator_dir: str, top: int):
+    aggregator_dir = os.path.abspath(aggregator_dir)
+    report = {'commit': git_commit(), 'python': sys.version.split()[0], 'runs': runs, 'scenarios': {}}
+    over_budget = False
+    for name, command in scenarios(aggregator_dir).items():
+        try:
+            times = time_command(command, aggregator_dir, runs)
+        except RuntimeError as e:
+            # For example a tree whose pool connects at start-up, without a server to connect to.
+            report['scenarios'][name] = {'error': str(e), 'budget_ms': BUDGET_MS[name], 'within_budget': False}
+            over_budget = True
+            continue
+        median = statistics.median(times)
+        report['scenarios'][name] = {'median_ms': round(median, 1), 'min_ms': round(min(times), 1),
+                                     'budget_ms': BUDGET_MS[name], 'within_budget': median <= BUDGET_MS[name]}
+        over_budget = over_budget or median > BUDGET_MS[name]
+    report['slowest_imports'] = slowest_imports(scenarios(aggregator_dir)['import'], aggregator_dir, top)
+    print(json.dumps(report, indent=2))
+    sys.exit(1 if over_budget else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,179 +1,196 @@
 ##### Connections #####
 # chart 1
+# summed per minute in performance_logs_chart_connections, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(client_connections_handled - client_connections_closed) AS ConcurrentClientConnections,
-        FLOOR(client_threads_in_use) AS ConcurrentActiveRequests
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(ConcurrentClientConnections / samples) AS ConcurrentClientConnections,
+        FLOOR(ConcurrentActiveRequests / samples) AS ConcurrentActiveRequests
+FROM performance_logs_chart_connections;
 
 
 
 ##### Incoming Pressure #####
 # chart 2
+# summed per minute in performance_logs_chart_incoming_pressure, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(connections_handled_delta) AS NewIncomingConnections, 
-        FLOOR(client_connections_in_pool) AS ConnectionInPool
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(NewIncomingConnections / samples) AS NewIncomingConnections,
+        FLOOR(ConnectionInPool / samples) AS ConnectionInPool
+FROM performance_logs_chart_incoming_pressure;
 
 
 
 ##### Request Handling #####
 # chart 3
+# summed per minute in performance_logs_chart_request_handling, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(transactions_handled_delta) AS client_transactions_handled, 
-        FLOOR(outbound_connections_created_delta + outbound_connections_failed_delta + outbound_connection_pool_reused_delta + new_dns_queries_delta) AS OutboundConnectionsDemanded
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(client_transactions_handled / samples) AS client_transactions_handled,
+        FLOOR(OutboundConnectionsDemanded / samples) AS OutboundConnectionsDemanded
+FROM performance_logs_chart_request_handling;
 
 
 
 ##### WAN Pressure #####
 # chart 4
+# summed per minute in performance_logs_chart_wan_pressure, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(outbound_connection_pool_reused_delta) AS outbound_connection_pool_reused, 
-        FLOOR(outbound_connections_in_pool) AS outbound_connections_in_pool
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(outbound_connection_pool_reused / samples) AS outbound_connection_pool_reused,
+        FLOOR(outbound_connections_in_pool / samples) AS outbound_connections_in_pool
+FROM performance_logs_chart_wan_pressure;
 
 
 
 ##### Network Pressure #####
 # chart 5
+# summed per minute in performance_logs_chart_network_pressure, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(client_connections_handled - client_connections_closed + outbound_connections_created_delta + outbound_connections_in_pool) AS TotalTCPConnections, 
-        FLOOR(client_connections_in_pool + outbound_connections_in_pool) AS IdleTCPConnections
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(TotalTCPConnections / samples) AS TotalTCPConnections,
+        FLOOR(IdleTCPConnections / samples) AS IdleTCPConnections
+FROM performance_logs_chart_network_pressure;
 
 
 
 ##### Data Xfer #####
 # chart 6
+# summed per minute in performance_logs_chart_data_xfer, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(bytes_in_kbytes_delta / 1048576) AS BytesInMB, 
-        FLOOR(bytes_out_kbytes_delta / 1048576) AS BytesOutMB
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(BytesInMB / samples) AS BytesInMB,
+        FLOOR(BytesOutMB / samples) AS BytesOutMB
+FROM performance_logs_chart_data_xfer;
 
 
 
 ##### Caching #####
 # chart 7
+# summed per minute in performance_logs_chart_caching, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(caching_objects_created_in_memory - caching_objects_removed_from_memory) AS CachingObjectsInMemory, 
-        FLOOR(caching_objects_removed_from_memory_delta) AS caching_objects_removed_from_memory, 
-        FLOOR(caching_objects_created_in_memory_delta) AS caching_objects_created_in_memory
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(CachingObjectsInMemory / samples) AS CachingObjectsInMemory,
+        FLOOR(caching_objects_removed_from_memory / samples) AS caching_objects_removed_from_memory,
+        FLOOR(caching_objects_created_in_memory / samples) AS caching_objects_created_in_memory
+FROM performance_logs_chart_caching;
 
 
 
 ##### DNS #####
 # chart 8
+# summed per minute in performance_logs_chart_dns, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(new_dns_queries_delta) AS new_dns_queries, 
-        FLOOR(dns_queries_reused_delta) AS dns_queries_reused
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(new_dns_queries / samples) AS new_dns_queries,
+        FLOOR(dns_queries_reused / samples) AS dns_queries_reused
+FROM performance_logs_chart_dns;
 
 
 
 ##### Threading Capacity #####
 # chart 9
+# summed per minute in performance_logs_chart_threading_capacity, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(spare_client_threads) AS spare_client_threads, 
-        FLOOR(client_threads_in_use) AS client_threads_in_use, 
-        FLOOR(client_threads_in_waiting) AS client_threads_in_waiting
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(spare_client_threads / samples) AS spare_client_threads,
+        FLOOR(client_threads_in_use / samples) AS client_threads_in_use,
+        FLOOR(client_threads_in_waiting / samples) AS client_threads_in_waiting
+FROM performance_logs_chart_threading_capacity;
 
 
 
 ##### System Memory #####
 # chart 10
+# summed per minute in performance_logs_chart_system_memory, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(total_system_memory_kbytes / 1048576) AS TotalSystemMemoryGB, 
-        FLOOR(free_system_memory_kbytes / 1024) AS FreeSystemMemoryMB
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(TotalSystemMemoryGB / samples) AS TotalSystemMemoryGB,
+        FLOOR(FreeSystemMemoryMB / samples) AS FreeSystemMemoryMB
+FROM performance_logs_chart_system_memory;
 
 
 
 ##### SafeSquid Memory #####
 # chart 11
+# summed per minute in performance_logs_chart_safesquid_memory, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(safesquid_virtual_memory_kbytes / 1024) AS SafeSquidVirtualMemoryMB, 
-        FLOOR(safesquid_library_memory_kbytes / 1024) AS SafeSquidLibraryMemoryMB, 
-        FLOOR(safesquid_resident_memory_kbytes / 1024) AS SafeSquidResidentMemoryMB, 
-        FLOOR(safesquid_shared_memory_kbytes / 1024) AS SafeSquidSharedMemoryMB, 
-        FLOOR(safesquid_code_memory_kbytes / 1024) AS SafeSquidCodeMemoryMB, 
-        FLOOR(safesquid_data_memory_kbytes / 1024) AS SafeSquidDataMemoryMB
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(SafeSquidVirtualMemoryMB / samples) AS SafeSquidVirtualMemoryMB,
+        FLOOR(SafeSquidLibraryMemoryMB / samples) AS SafeSquidLibraryMemoryMB,
+        FLOOR(SafeSquidResidentMemoryMB / samples) AS SafeSquidResidentMemoryMB,
+        FLOOR(SafeSquidSharedMemoryMB / samples) AS SafeSquidSharedMemoryMB,
+        FLOOR(SafeSquidCodeMemoryMB / samples) AS SafeSquidCodeMemoryMB,
+        FLOOR(SafeSquidDataMemoryMB / samples) AS SafeSquidDataMemoryMB
+FROM performance_logs_chart_safesquid_memory;
 
 
 
 ##### Errors #####
 # chart 12
+# summed per minute in performance_logs_chart_errors, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(dns_query_failures_delta) AS dns_query_failures, 
-        FLOOR(outbound_connections_failed_delta) AS outbound_connections_failed, 
-        FLOOR(threading_errors_delta) AS threading_errors
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(dns_query_failures / samples) AS dns_query_failures,
+        FLOOR(outbound_connections_failed / samples) AS outbound_connections_failed,
+        FLOOR(threading_errors / samples) AS threading_errors
+FROM performance_logs_chart_errors;
 
 
 
 ##### System Load #####
 # chart 13
+# summed per minute in performance_logs_chart_system_load, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(load_avg_1_min) AS load_avg_1_min, 
-        FLOOR(load_avg_5_min) AS load_avg_5_min, 
-        FLOOR(load_avg_15_min) AS load_avg_15_min
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(load_avg_1_min / samples) AS load_avg_1_min,
+        FLOOR(load_avg_5_min / samples) AS load_avg_5_min,
+        FLOOR(load_avg_15_min / samples) AS load_avg_15_min
+FROM performance_logs_chart_system_load;
 
 
 
 ##### CPU Switching #####
 # chart 14
+# summed per minute in performance_logs_chart_cpu_switching, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(running_processes) AS running_processes, 
-        FLOOR(waiting_processes) AS waiting_processes
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(running_processes / samples) AS running_processes,
+        FLOOR(waiting_processes / samples) AS waiting_processes
+FROM performance_logs_chart_cpu_switching;
 
 
 
 ##### CPU Utilization 1 #####
 # chart 15
+# summed per minute in performance_logs_chart_cpu_utilization_1, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(total_time_delta * 1000) AS TotalCPUUseDeltaMsecs, 
-        FLOOR(user_time_delta * 1000) AS UserTimeMsecs, 
-        FLOOR(system_time_delta * 1000) AS SystemTimeMsecs
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(TotalCPUUseDeltaMsecs / samples) AS TotalCPUUseDeltaMsecs,
+        FLOOR(UserTimeMsecs / samples) AS UserTimeMsecs,
+        FLOOR(SystemTimeMsecs / samples) AS SystemTimeMsecs
+FROM performance_logs_chart_cpu_utilization_1;
 
 
 
 ##### CPU Utilization 2 #####
 # chart 16
+# summed per minute in performance_logs_chart_cpu_utilization_2, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR((total_time + total_time_delta) / elapsed_time) AS TotalCPUUseTrend, 
-        FLOOR((user_time + user_time_delta) / elapsed_time) AS UserTimeTrend, 
-        FLOOR((system_time + system_time_delta) / elapsed_time) AS SystemTimeTrend
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(TotalCPUUseTrend / samples) AS TotalCPUUseTrend,
+        FLOOR(UserTimeTrend / samples) AS UserTimeTrend,
+        FLOOR(SystemTimeTrend / samples) AS SystemTimeTrend
+FROM performance_logs_chart_cpu_utilization_2;
 
 
 
 ##### Process Life #####
 # chart 17
+# summed per minute in performance_logs_chart_process_life, see the <dataset> elements of aggregator/log_structure.xml
 
-SELECT timestamp, 
-        FLOOR(safesquid_virtual_memory_kbytes / 1024) AS SafeSquidVirtualMemoryMB, 
-        FLOOR(elapsed_time) AS ProcessAge
-FROM performance_logs;
+SELECT bucket AS timestamp,
+        FLOOR(SafeSquidVirtualMemoryMB / samples) AS SafeSquidVirtualMemoryMB,
+        FLOOR(ProcessAge / samples) AS ProcessAge
+FROM performance_logs_chart_process_life;
 
 
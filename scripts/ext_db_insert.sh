@@ -10,6 +10,8 @@ touch "${WATCH_EXT}"
 
 while read -r FILE EVENT
 do
+    # The ingest daemon picks up rotated files itself; only one process may write the ingest ledger.
+    systemctl is-active --quiet aggregator.service && continue
     echo "INFO: ${LOG_TIME} Programme Info: Watch File: ${EXT_LOG}: ${EVENT}"
     EXT_LOG_FILE=$(cat ${FILE})
     python3 ${SCRIPT_DIR}/${PY_INSERT} insert extended ${EXT_LOG_FILE}
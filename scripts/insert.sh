@@ -14,44 +14,26 @@ fi
 
 SCRIPT_DIR="/opt/aggregator/bin"
 PY_INSERT="main.py"
-PY_CSP_CONVERT="csp_convertor.py"
 
 declare -A LOG_TYPE
 
 LOG_TYPE["extended"]="extended"
 LOG_TYPE["performance"]="performance"
-LOG_TYPE["csp_converted"]="csp"
+LOG_TYPE["csp"]="csp"
 
 
-CONVERT_CSP () 
-{
-    for LOGFILE in /var/log/aggregator/safesquid/*/csp/*
-    do
-        LOG_DIR="$(dirname "${LOGFILE}")"
-        LOG_FILE="$(basename "${LOGFILE}")"
-        CSP_CONVERT_OUT="${LOG_DIR}_converted/${LOG_FILE}"
-        [ ! -d "${LOG_DIR}_converted" ] && mkdir -p "${LOG_DIR}_converted" 
-        python3 ${SCRIPT_DIR}/${PY_CSP_CONVERT} "${LOGFILE}"  "${CSP_CONVERT_OUT}"
-    done
-}
-
 INSERT_INTO_DB () 
 {
-    for LOG in ${!LOG_TYPE[@]} 
-    do 
-        for LOGFILE in /var/log/aggregator/safesquid/*/${LOG}/*
-        do
-            LOG_DIR="$(dirname "${LOGFILE}")"
-            python3 ${SCRIPT_DIR}/${PY_INSERT} insert ${LOG_TYPE[${LOG}]} "${LOGFILE}" 
-        done
-    done     
+    # One process for all proxies and log types: files are inserted concurrently, largest first.
+    python3 ${SCRIPT_DIR}/${PY_INSERT} insert auto --mode copy --processes "$(nproc)" \
+        $(for LOG in ${!LOG_TYPE[@]}; do echo "/var/log/aggregator/safesquid/*/${LOG_TYPE[${LOG}]}"; done)
 }
 
 MAIN () 
 {
     source /opt/aggregator/safesquid_reporting/bin/activate 
-    CONVERT_CSP
-    INSERT_INTO_DB
+    # The ingest daemon picks up synced files itself; only one process may write the ingest ledger.
+    systemctl is-active --quiet aggregator.service || INSERT_INTO_DB
     deactivate
 }
 
@@ -24,19 +24,9 @@ LOG_TYPE=(extended)
 LOG_TYPE+=(performance)
 LOG_TYPE+=(csp)
 
-SERVERS=();
-
-GET_SERVERS()
-{
-	local COMMENT="#*"
-	while read -r SNAME
-	do
-		SERVERS+=(${SNAME%%${COMMENT}})
-	done < "${SERVERS_LIST}"	
-}
-
-
 RSYNC_COMMAND="/usr/bin/rsync"
+SCRIPT_DIR="/opt/aggregator/bin"
+VENV="/opt/aggregator/safesquid_reporting"
 # LOG_CONVERTOR="/usr/local/bin/log_convert"
 LOG="/var/log/sync.log"
 # NEW_LOG="N"
@@ -51,43 +41,17 @@ CHECK_FOLDERS()
 
 START_SYNC()
 {
-	s=${#SERVERS[@]}
-	for (( i=0; i<s; i++))
-	do
-		for LOG_DIR in ${LOG_TYPE[*]}
-		do 
-			local RSYNC=();
-			local SOURCE=${SERVERS[$i]}
-			[ "x${SOURCE}" == "x${LOCAL_HOST}" ] && echo "info: log_file: Use local log files" && continue
-			local DEST="${LOCAL_AGGREGATOR_DIRECTORY}/${SOURCE}/${LOG_DIR}"
-
-			[ ! -d "${DEST}" ] && mkdir -p "${DEST}"
-			[ ! -d "${DEST}" ] && echo "failed to create: ${DEST}" && continue;
-			# mkdir -p "${LOCAL_AGGREGATOR_DIRECTORY}/${SOURCE}/${ACCESS_LOG_SUB_FOLDER}"
-			
-			RSYNC+=("$(which rsync)")
-			RSYNC+=("--append")
-			RSYNC+=("--compress")
-			RSYNC+=("--times")
-			RSYNC+=("--archive")
-			RSYNC+=("--recursive")
-			RSYNC+=("--no-links")
-			RSYNC+=("--info=FLIST")
-			RSYNC+=("--include=*${LOG_DIR}.log")
-			RSYNC+=("--log-file=${DEST}/.journal")
-			RSYNC+=("--verbose")
-			echo "${RSYNC[*]} -e "ssh -i ${KEY_STORE}/${SSH_KEY}" ${SYNC_USER}@${SOURCE}:${LOG_DIR}/ "${DEST}""
-			"${RSYNC[@]}" -e "ssh -i ${KEY_STORE}/${SSH_KEY}" "${SYNC_USER}@${SOURCE}":"${LOG_DIR}/" "${DEST}"
-			echo "RSYNC: $SOURCE: $?"
-		done
-	done
+	# main.py syncs several proxies at a time over one ssh connection per proxy;
+	# see the [sync] section of config.ini for the concurrency and timeouts.
+	source "${VENV}/bin/activate"
+	python3 "${SCRIPT_DIR}/main.py" sync
+	echo "SYNC: $?"
 }
 
 
 MAIN()
 {
-	date >> ${LOG}
-	GET_SERVERS
+	# main.py sync stamps ${LOG} for monit.
 	CHECK_FOLDERS
 	START_SYNC
 }
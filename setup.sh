@@ -139,7 +139,23 @@ password = ${PGPASSWORD}
 host = ${PGHOST}
 port = ${PGPORT}
 dbname = ${PGDATABASE}
-maxconns = 1
+maxconns = 20
+
+[metrics]
+textfile = /var/lib/aggregator/metrics.prom
+port = 0
+
+[sync]
+servers = /opt/aggregator/servers.list
+key = /root/.ssh/id_rsa
+user = root
+concurrency = 8
+timeout = 600
+
+[dedup]
+enabled = true
+capacity = 4000000
+days = 7
 _EOL
 }
 
@@ -250,6 +266,35 @@ _EOL
 	systemctl enable superset.service && systemctl start superset.service
 }
 
+# Create a service for the ingest daemon
+AGGREGATOR_SERVICE () 
+{
+echo "INFO: Creating a service for the aggregator ingest daemon"
+[ ! -d "${SERVICE_DIR}" ] && mkdir -p ${SERVICE_DIR}
+cat << _EOL > ${SERVICE_DIR}/aggregator.service
+[Unit]
+Description=Aggregator log ingest daemon
+After=network.target postgresql.service
+
+[Service]
+User=root
+Group=root
+WorkingDirectory=${SCRIPT_DIR}/
+ExecStart=${VENV_NAME}/bin/python3 ${SCRIPT_DIR}/main.py serve
+KillSignal=SIGTERM
+TimeoutStopSec=300
+Restart=on-failure
+RestartSec=5s
+
+[Install]
+WantedBy=multi-user.target
+_EOL
+
+	ln -sf ${SERVICE_DIR}/aggregator.service /etc/systemd/system/
+	[ -f "/etc/systemd/system/aggregator.service" ] && systemctl daemon-reload
+	systemctl enable aggregator.service && systemctl start aggregator.service
+}
+
 # Setup Superset
 SETUP_SUPERSET () 
 {
@@ -275,8 +320,18 @@ DB_CREATE ()
 	local TABLE_EXT_EXISTS=$(sudo -i -u postgres psql -d  "${PGDATABASE}" -t -c "SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = 'extended_logs';" | tr -d '[:space:]')
 	local TABLE_PERF_EXISTS=$(sudo -i -u postgres psql -d  "${PGDATABASE}" -t -c "SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = 'performance_logs';" | tr -d '[:space:]')
 	local TABLE_CSP_EXISTS=$(sudo -i -u postgres psql -d  "${PGDATABASE}" -t -c "SELECT 1 FROM pg_tables WHERE schemaname = 'public' AND tablename = 'csp_logs';" | tr -d '[:space:]')
-	[ -z ${TABLE_EXT_EXISTS} ] && python3 ${SCRIPT_DIR}/main.py create-database extended
-	[ -z ${TABLE_PERF_EXISTS} ] && python3 ${SCRIPT_DIR}/main.py create-database performance
+	if [ -z ${TABLE_EXT_EXISTS} ]; then
+		python3 ${SCRIPT_DIR}/main.py create-database extended
+	else
+		# A table created by an earlier version lacks the columns enrichment derives.
+		python3 ${SCRIPT_DIR}/main.py add-derived-columns extended
+	fi
+	if [ -z ${TABLE_PERF_EXISTS} ]; then
+		python3 ${SCRIPT_DIR}/main.py create-database performance
+	else
+		# The charts read the dataset tables, which a table created by an earlier version lacks.
+		python3 ${SCRIPT_DIR}/main.py refresh-datasets performance
+	fi
 	[ -z ${TABLE_CSP_EXISTS} ] && python3 ${SCRIPT_DIR}/main.py create-database csp
 }
 
@@ -350,6 +405,7 @@ MAIN ()
 	PY_PACKAGES
 	SETUP_PSQL
 	SETUP_SUPERSET
+	AGGREGATOR_SERVICE
 	GEN_SSH_KEY
 	SHARE_AUTHORIZATION
 	MONIT_PAM